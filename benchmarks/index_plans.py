@@ -0,0 +1,238 @@
+"""
+Seeds a scratch schema with ~1M rows per hot table and checks, via EXPLAIN,
+that every hot query is answered from the index it was designed for.
+
+The queries are built from models/schemas.py the same way the services build
+them, so a schema or query change that loses its index fails this script.
+
+    python -m benchmarks.index_plans            # seed, explain, time
+    python -m benchmarks.index_plans --rows 100000 --keep
+
+Connection settings come from the usual PG_* environment variables. All
+tables are created inside the `bench_indexes` schema, the application tables
+in `public` are never touched.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from sqlalchemy import text, desc
+from sqlalchemy.dialects import postgresql
+from sqlmodel import SQLModel, select
+
+from database import engine
+from models import schemas
+
+SCHEMA = "bench_indexes"
+SEEDED_TABLES = {"users", "posts", "activities", "dmm", "post_likes", "post_hashtag", "followers", "hashtags"}
+
+
+def hot_queries():
+    """(name, statement, expected index, accepted scan node types)"""
+    index_only = {"Index Only Scan"}
+    index_scan = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+    return [
+        (
+            "activities by receiver, newest first",
+            select(schemas.Activity)
+            .where(schemas.Activity.receiver_id == 42)
+            .order_by(desc(schemas.Activity.created_at))
+            .offset(0).limit(5),
+            "idx_activities_receiver_id_created_at", index_scan,
+        ),
+        (
+            "posts of a user, newest first",
+            select(schemas.Post)
+            .where(schemas.Post.user_id == 42)
+            .order_by(desc(schemas.Post.created_at)),
+            "idx_posts_user_id_created_at", index_scan,
+        ),
+        (
+            "dmm fingerprint lookup",
+            select(schemas.DMM.video_id).where(schemas.DMM.hash_value == "hash_4242"),
+            "unique_hash_value", index_only,
+        ),
+        (
+            "dmm fingerprint joined to post and owner",
+            select(schemas.Post, schemas.User)
+            .select_from(schemas.DMM)
+            .join(schemas.Post, schemas.DMM.video_id == schemas.Post.id)
+            .join(schemas.User, schemas.User.user_id == schemas.Post.user_id)
+            .where(schemas.DMM.hash_value == "hash_4242"),
+            "unique_hash_value", index_only,
+        ),
+        (
+            "likes of a post",
+            select(schemas.User)
+            .join(schemas.PostLikes, schemas.PostLikes.user_id == schemas.User.user_id)
+            .where(schemas.PostLikes.post_id == 4242),
+            "idx_post_likes_post_id_user_id", index_only,
+        ),
+        (
+            "posts of a hashtag",
+            select(schemas.Post)
+            .join(schemas.PostHashtag, schemas.PostHashtag.post_id == schemas.Post.id)
+            .where(schemas.PostHashtag.hashtag_id == 42),
+            "idx_post_hashtag_hashtag_id_post_id", index_only,
+        ),
+        (
+            "followers of a user",
+            select(schemas.User)
+            .join(schemas.Follower, schemas.Follower.follower_id == schemas.User.user_id)
+            .where(schemas.Follower.following_id == 42),
+            "idx_followers_following_id_follower_id", index_only,
+        ),
+        (
+            "feed page",
+            select(schemas.Post, schemas.User.username, schemas.User.profile_picture)
+            .join(schemas.User)
+            .order_by(desc(schemas.Post.created_at))
+            .offset(0).limit(5),
+            "idx_posts_created_at", index_scan,
+        ),
+    ]
+
+
+def compile_query(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def walk_plan(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk_plan(child)
+
+
+async def seed(conn, rows: int):
+    users = max(rows // 10, 100)
+    hashtags = max(rows // 100, 10)
+    statements = [
+        f"""INSERT INTO users (name, username, email, password_hash, security_key, profile_picture,
+                               bio, warning, created_at, following_count, followers_count,
+                               unread_activity_count)
+            SELECT 'user', 'user_' || i, 'user_' || i || '@example.com', 'x', 'x', 'user_default',
+                   '', 0, now() - (i || ' seconds')::interval, 0, 0, 0
+            FROM generate_series(1, {users}) i""",
+        f"""INSERT INTO hashtags (name) SELECT 'tag_' || i FROM generate_series(1, {hashtags}) i""",
+        f"""INSERT INTO posts (user_id, media_url, caption, likes_count, media_type, created_at)
+            SELECT 1 + (i % {users}), 'media_' || i, '', 0,
+                   CASE WHEN i % 3 = 0 THEN 'image' ELSE 'video' END,
+                   now() - (i || ' seconds')::interval
+            FROM generate_series(1, {rows}) i""",
+        f"""INSERT INTO dmm (dmm_id, video_id, hash_value, created_at)
+            SELECT lpad(to_hex(i), 16, '0'), i, 'hash_' || i, now()
+            FROM generate_series(1, {rows}) i""",
+        f"""INSERT INTO post_likes (user_id, post_id)
+            SELECT DISTINCT 1 + ((i::bigint * 7919) % {users}), 1 + (i % {rows})
+            FROM generate_series(1, {rows}) i""",
+        f"""INSERT INTO post_hashtag (post_id, hashtag_id)
+            SELECT i, 1 + (i % {hashtags}) FROM generate_series(1, {rows}) i""",
+        f"""INSERT INTO followers (follower_id, following_id, created_at)
+            SELECT DISTINCT f, t, now() FROM (
+                SELECT 1 + ((i::bigint * 7919) % {users}) AS f, 1 + (i % {users}) AS t
+                FROM generate_series(1, {rows}) i
+            ) s WHERE f != t""",
+        f"""INSERT INTO activities (receiver_id, sender_id, kind, post_id, created_at)
+            SELECT 1 + (i % {users}), 1 + ((i::bigint * 31) % {users}), 'like', 1 + (i % {rows}),
+                   now() - (i || ' seconds')::interval
+            FROM generate_series(1, {rows}) i""",
+    ]
+    for statement in statements:
+        await conn.execute(text(statement))
+
+
+async def prepare(rows: int):
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        await conn.run_sync(
+            lambda sync_conn: SQLModel.metadata.create_all(
+                sync_conn.execution_options(schema_translate_map={None: SCHEMA})
+            )
+        )
+        await conn.execute(text(f"SET LOCAL search_path TO {SCHEMA}, public"))
+        await seed(conn, rows)
+
+    # VACUUM sets the visibility map, without it nothing can be index only
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+        for table in sorted(SEEDED_TABLES):
+            await conn.execute(text(f"VACUUM ANALYZE {table}"))
+
+
+async def explain(repeat: int) -> list[dict]:
+    results = []
+    async with engine.connect() as conn:
+        await conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+        for name, statement, expected_index, node_types in hot_queries():
+            sql = compile_query(statement)
+            result = await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+            plan = result.scalar_one()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            nodes = list(walk_plan(plan[0]["Plan"]))
+
+            seq_scans = sorted({
+                n["Relation Name"] for n in nodes
+                if n["Node Type"] == "Seq Scan" and n.get("Relation Name") in SEEDED_TABLES
+            })
+            # every scan of the expected index counts, one heap-fetching scan spoils an index only query
+            used = [n for n in nodes if n.get("Index Name") == expected_index]
+            ok = bool(used) and all(n["Node Type"] in node_types for n in used) and not seq_scans
+
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                await conn.execute(text(sql))
+                timings.append((time.perf_counter() - start) * 1000)
+
+            results.append({
+                "query": name,
+                "expected_index": expected_index,
+                "expected_nodes": sorted(node_types),
+                "scans": sorted({f'{n["Node Type"]} {n.get("Index Name") or n.get("Relation Name", "")}'.strip()
+                                 for n in nodes if "Scan" in n["Node Type"]}),
+                "seq_scans": seq_scans,
+                "ok": ok,
+                "p50_ms": round(statistics.median(timings), 3),
+                "max_ms": round(max(timings), 3),
+            })
+    return results
+
+
+async def main(args):
+    if not args.skip_seed:
+        start = time.perf_counter()
+        await prepare(args.rows)
+        print(f"seeded {args.rows} rows per table in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    results = await explain(args.repeat)
+
+    if not args.keep:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    await engine.dispose()
+
+    for r in results:
+        status = "ok  " if r["ok"] else "FAIL"
+        print(f'{status} {r["query"]:<42} p50 {r["p50_ms"]:>8.3f} ms  {", ".join(r["scans"])}', file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": args.rows, "results": results}, f, indent=2)
+
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="rows seeded into each hot table")
+    parser.add_argument("--repeat", type=int, default=50, help="timed executions per query")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded schema for inspection")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse a schema kept by --keep")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,331 @@
+"""
+Times every stage of the media pipeline on synthetic fixtures so a regression
+in the hot path shows up as numbers instead of as slow uploads.
+
+Fixtures are generated locally (cv2 for videos, PIL for images) in a range of
+resolutions, durations and frame rates, with and without a face. Each stage
+runs in a fresh process, so the peak RSS reported is the stage's own.
+
+    python -m benchmarks.media_pipeline                       # default matrix
+    python -m benchmarks.media_pipeline --quick --output bench.json
+    python -m benchmarks.media_pipeline --face-image face.jpg --stages analyze
+
+Without --face-image the "face" fixtures carry a drawn face, which the HOG
+detector may or may not pick up; pass a real photo to exercise the
+recognition path fully.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+FIXTURE_DIR = os.path.join(tempfile.gettempdir(), "deepmark_bench_fixtures")
+WATERMARK = "benchbenchbench0"
+
+
+@dataclass(frozen=True)
+class VideoCase:
+    width: int
+    height: int
+    seconds: float
+    fps: int
+    face: bool
+
+    @property
+    def name(self) -> str:
+        return f"{self.height}p_{self.seconds:g}s_{self.fps}fps{'_face' if self.face else ''}"
+
+    @property
+    def frames(self) -> int:
+        return int(self.seconds * self.fps)
+
+
+@dataclass(frozen=True)
+class ImageCase:
+    width: int
+    height: int
+    face: bool
+
+    @property
+    def name(self) -> str:
+        return f"{self.width}x{self.height}{'_face' if self.face else ''}"
+
+
+VIDEO_CASES = [
+    VideoCase(640, 360, 5, 30, False),
+    VideoCase(640, 360, 5, 30, True),
+    VideoCase(1280, 720, 5, 30, True),
+    VideoCase(1280, 720, 10, 60, True),
+    VideoCase(1920, 1080, 5, 30, True),
+]
+IMAGE_CASES = [
+    ImageCase(1280, 720, False),
+    ImageCase(1920, 1080, True),
+    ImageCase(4032, 3024, True),
+]
+QUICK_VIDEO_CASES = [VideoCase(640, 360, 2, 30, True)]
+QUICK_IMAGE_CASES = [ImageCase(1280, 720, True)]
+
+# stage -> kind of fixture it runs on
+STAGES = {
+    "analyze": "video",
+    "embed_watermark": "video",
+    "extract_watermark": "video",
+    "video_get_metadata": "video",
+    "video_append_metadata": "video",
+    "image_get_metadata": "image",
+    "image_add_metadata": "image",
+}
+
+
+# fixtures
+
+def load_face(path):
+    if not path:
+        return None
+    face = cv2.imread(path)
+    if face is None:
+        raise SystemExit(f"could not read face image {path}")
+    return face
+
+
+def draw_face(canvas, cx, cy, size, face=None):
+    """Pastes `face` (or a drawn stand-in) centred on (cx, cy)."""
+    if face is not None:
+        scaled = cv2.resize(face, (size, size))
+        top, left = max(cy - size // 2, 0), max(cx - size // 2, 0)
+        h = min(size, canvas.shape[0] - top)
+        w = min(size, canvas.shape[1] - left)
+        canvas[top:top + h, left:left + w] = scaled[:h, :w]
+        return
+    axes = (size // 3, size // 2 - size // 10)
+    cv2.ellipse(canvas, (cx, cy), axes, 0, 0, 360, (140, 170, 215), -1)
+    for dx in (-size // 7, size // 7):
+        cv2.circle(canvas, (cx + dx, cy - size // 10), size // 18, (40, 40, 40), -1)
+    cv2.ellipse(canvas, (cx, cy + size // 6), (size // 8, size // 20), 0, 0, 180, (60, 60, 150), 3)
+
+
+def background(width, height, t, rng):
+    """Moving gradient plus noise, so the encoder and the DWT see real texture."""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = (x + y + t * 4) % 255
+    frame = np.stack([base, np.roll(base, 40, axis=1), 255 - base], axis=-1)
+    frame += rng.normal(0, 6, frame.shape).astype(np.float32)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def video_fixture(case: VideoCase, face_image=None) -> str:
+    suffix = "_photo" if face_image is not None and case.face else ""
+    path = os.path.join(FIXTURE_DIR, f"{case.name}{suffix}.mp4")
+    if os.path.exists(path):
+        return path
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    rng = np.random.default_rng(0)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), case.fps, (case.width, case.height))
+    size = case.height // 2
+    for i in range(case.frames):
+        frame = background(case.width, case.height, i, rng)
+        if case.face:
+            cx = case.width // 2 + int(case.width / 6 * np.sin(i / case.fps))
+            draw_face(frame, cx, case.height // 2, size, face_image)
+        out.write(frame)
+    out.release()
+    return path
+
+
+def image_fixture(case: ImageCase, face_image=None) -> str:
+    suffix = "_photo" if face_image is not None and case.face else ""
+    path = os.path.join(FIXTURE_DIR, f"{case.name}{suffix}.jpg")
+    if os.path.exists(path):
+        return path
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    frame = background(case.width, case.height, 0, np.random.default_rng(0))
+    if case.face:
+        draw_face(frame, case.width // 2, case.height // 2, case.height // 2, face_image)
+    Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).save(path, quality=90)
+    return path
+
+
+# stages, each run in its own process
+
+def open_upload(path: str, content_type: str):
+    from starlette.datastructures import UploadFile, Headers
+
+    with open(path, "rb") as f:
+        data = f.read()
+    return UploadFile(
+        file=BytesIO(data),
+        filename=os.path.basename(path),
+        headers=Headers({"content-type": content_type}),
+    )
+
+
+async def stage_runner(stage: str, path: str):
+    """Returns a coroutine factory for one timed run of `stage` on `path`."""
+    if stage == "analyze":
+        from video_module import analyze
+        return lambda: analyze.analyze_video_face_recognition(open_upload(path, "video/mp4"))
+    if stage == "embed_watermark":
+        from video_module import watermark
+        return lambda: watermark.embed_watermark(open_upload(path, "video/mp4"), WATERMARK)
+    if stage == "extract_watermark":
+        from video_module import watermark
+        # extraction is timed on media that carries a mark, like real re-uploads
+        marked = await watermark.embed_watermark(open_upload(path, "video/mp4"), WATERMARK)
+        data = marked.file.read()
+
+        async def extract():
+            from starlette.datastructures import UploadFile
+            return await watermark.extract_watermark(UploadFile(file=BytesIO(data), filename=marked.filename))
+        return extract
+    if stage == "video_get_metadata":
+        from video_module import metadata
+        return lambda: metadata.get_metadata(open_upload(path, "video/mp4"))
+    if stage == "video_append_metadata":
+        from video_module import metadata
+        return lambda: metadata.append_metadata(open_upload(path, "video/mp4"), {"copyright": f"deepmark{WATERMARK}"})
+    if stage == "image_get_metadata":
+        from image_module import metadata
+        return lambda: metadata.get_metadata(open_upload(path, "image/jpeg"))
+    if stage == "image_add_metadata":
+        from image_module import metadata
+        return lambda: metadata.add_metadata(open_upload(path, "image/jpeg"), {"copyright": WATERMARK})
+    raise ValueError(f"unknown stage {stage}")
+
+
+def run_stage(stage: str, path: str, repeat: int, warmup: int, queue):
+    async def timed():
+        run = await stage_runner(stage, path)
+        for _ in range(warmup):
+            await run()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await run()
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    try:
+        timings = asyncio.run(timed())
+        result = {"timings": timings}
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    queue.put(result)
+
+
+def measure(stage: str, path: str, repeat: int, warmup: int, timeout: float) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=run_stage, args=(stage, path, repeat, warmup, queue))
+    process.start()
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        result = {"error": f"no result within {timeout:g}s"}
+    process.join(5)
+    if process.is_alive():
+        process.kill()
+    return result
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(stage: str, case, path: str, measured: dict) -> dict:
+    row = {
+        "stage": stage,
+        "fixture": case.name,
+        "fixture_bytes": os.path.getsize(path),
+        **{f"fixture_{k}": v for k, v in asdict(case).items()},
+        "peak_rss_mb": measured["peak_rss_mb"],
+    }
+    if "error" in measured:
+        row["error"] = measured["error"]
+        return row
+    timings = measured["timings"]
+    p50 = statistics.median(timings)
+    row.update(
+        runs=len(timings),
+        p50_ms=round(p50 * 1000, 2),
+        p95_ms=round(percentile(timings, 95) * 1000, 2),
+        max_ms=round(max(timings) * 1000, 2),
+    )
+    if isinstance(case, VideoCase):
+        row["frames_per_sec"] = round(case.frames / p50, 1)
+    return row
+
+
+def main(args) -> int:
+    face_image = load_face(args.face_image)
+    video_cases = QUICK_VIDEO_CASES if args.quick else VIDEO_CASES
+    image_cases = QUICK_IMAGE_CASES if args.quick else IMAGE_CASES
+    stages = args.stages or list(STAGES)
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    results = []
+    for stage in stages:
+        cases = video_cases if STAGES[stage] == "video" else image_cases
+        for case in cases:
+            if STAGES[stage] == "video":
+                path = video_fixture(case, face_image)
+            else:
+                path = image_fixture(case, face_image)
+            row = summarize(stage, case, path, measure(stage, path, args.repeat, args.warmup, args.timeout))
+            results.append(row)
+            if "error" in row:
+                print(f'FAIL {stage:<22} {case.name:<22} {row["error"]}', file=sys.stderr)
+            else:
+                fps = f'{row["frames_per_sec"]:>8.1f} fps' if "frames_per_sec" in row else " " * 12
+                print(
+                    f'ok   {stage:<22} {case.name:<22} p50 {row["p50_ms"]:>9.1f} ms  '
+                    f'p95 {row["p95_ms"]:>9.1f} ms {fps}  rss {row["peak_rss_mb"]:>7.1f} MB',
+                    file=sys.stderr,
+                )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "opencv": cv2.__version__,
+                "repeat": args.repeat,
+                "face_image": bool(face_image is not None),
+                "results": results,
+            }, f, indent=2)
+
+    return 0 if all("error" not in r for r in results) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs="+", metavar="STAGE", help=f"subset of: {', '.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage and fixture")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before timing")
+    parser.add_argument("--timeout", type=float, default=900, help="seconds allowed per stage and fixture")
+    parser.add_argument("--face-image", help="photo pasted into the face fixtures")
+    parser.add_argument("--quick", action="store_true", help="one small fixture of each kind")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    sys.exit(main(parser.parse_args()))
@@ -1,19 +1,57 @@
+import os
 from sqlmodel import SQLModel
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
 
 from models import security
 
 
-DATABASE_URL = f"postgresql+asyncpg://{security.database.pg_user}:{security.database.pg_password}@{security.database.pg_host}:{security.database.pg_port}/{security.database.pg_database}"
+DATABASE_URL = security.database.database_url or f"postgresql+asyncpg://{security.database.pg_user}:{security.database.pg_password}@{security.database.pg_host}:{security.database.pg_port}/{security.database.pg_database}"
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
 
 engine = create_async_engine(DATABASE_URL)
 
 
-async def startup():
-    async with engine.begin() as conn:
-        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
-        await conn.execute(text("CREATE INDEX IF NOT EXISTS idx_users_email_trgm ON users USING GIN (email gin_trgm_ops);"))
+class SchemaVersionError(RuntimeError):
+    pass
+
+
+def head_revision() -> str:
+    """Returns the newest revision in migrations/versions."""
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(Config(ALEMBIC_INI)).get_current_head()
+
+
+async def check_schema_version():
+    """Fails fast when the database is not migrated to the revision this build expects."""
+    expected = head_revision()
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(text("SELECT version_num FROM alembic_version"))
+            current = result.scalar_one_or_none()
+    except ProgrammingError:
+        current = None
+
+    if current != expected:
+        raise SchemaVersionError(
+            f"database schema is at revision {current}, expected {expected}; run `alembic upgrade head`"
+        )
+
+
+async def create_schema():
+    """Creates every table directly from the models, for local development only."""
     async with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
         await conn.run_sync(SQLModel.metadata.create_all)
 
+
+async def startup():
+    if security.database.schema_mode == "create_all":
+        await create_schema()
+    else:
+        await check_schema_version()
@@ -0,0 +1,162 @@
+"""
+Admission control for the media endpoints.
+
+Uploads and the demo analysis routes hold a CPU for seconds to minutes, so
+they are admitted through a per-process limit on concurrent jobs with a
+short bounded queue, plus a per-user limit on concurrent jobs and a token
+bucket on job starts. Requests over a limit fail fast with 429 (this user)
+or 503 (this node) and a Retry-After header, instead of piling up behind
+the running jobs and slowing every other endpoint down.
+
+Limits are per worker process; with several uvicorn workers a node admits
+workers x MEDIA_MAX_CONCURRENT jobs.
+"""
+import asyncio
+import contextlib
+import math
+import os
+import time
+from collections import OrderedDict, defaultdict
+from fastapi import Depends, HTTPException, Request, status
+from jose import jwt, JWTError
+
+import metrics
+from models import security
+from .token import ALGORITHM, SECRET_KEY
+
+settings = security.admission_settings
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second up to `burst`, per key. The least recently
+    used keys are forgotten beyond `max_keys`, which only ever hands a
+    client a full bucket again.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> (tokens, monotonic time of the last update)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def take(self, key: str) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def give_back(self, key: str):
+        """Returns a token taken for a request that was rejected later on."""
+        if key in self._buckets:
+            tokens, updated = self._buckets[key]
+            self._buckets[key] = (min(self.burst, tokens + 1), updated)
+
+
+class MediaLimiter:
+    def __init__(
+        self, max_concurrent: int, max_queued: int, queue_timeout: float,
+        user_max_concurrent: int, bucket: TokenBucket,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.user_max_concurrent = user_max_concurrent
+        self.bucket = bucket
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._per_user: defaultdict[str, int] = defaultdict(int)
+        self.running = 0
+        self.waiting = 0
+
+    @contextlib.asynccontextmanager
+    async def admit(self, key: str):
+        """Holds a job slot for `key` for the duration of the block, or raises a 429/503."""
+        if self.user_max_concurrent and self._per_user.get(key, 0) >= self.user_max_concurrent:
+            reject(status.HTTP_429_TOO_MANY_REQUESTS, "a media job of yours is still running", self.queue_timeout, "user_busy")
+        retry_after = self.bucket.take(key)
+        if retry_after:
+            reject(status.HTTP_429_TOO_MANY_REQUESTS, "too many media requests", retry_after, "rate_limited")
+        if self.running >= self.max_concurrent and self.waiting >= self.max_queued:
+            self.bucket.give_back(key)
+            reject(status.HTTP_503_SERVICE_UNAVAILABLE, "server is busy", self.queue_timeout, "node_busy")
+
+        self._per_user[key] += 1
+        try:
+            await self._acquire(key)
+            self.running += 1
+            try:
+                yield
+            finally:
+                self.running -= 1
+                self._slots.release()
+        finally:
+            self._per_user[key] -= 1
+            if not self._per_user[key]:
+                del self._per_user[key]
+
+    async def _acquire(self, key: str):
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.bucket.give_back(key)
+            reject(status.HTTP_503_SERVICE_UNAVAILABLE, "server is busy", self.queue_timeout, "queue_timeout")
+        finally:
+            self.waiting -= 1
+            metrics.observe("admission_wait", time.perf_counter() - start)
+
+
+def reject(status_code: int, detail: str, retry_after: float, reason: str):
+    if metrics.enabled:
+        metrics.admission_rejected.inc(1, reason)
+    raise HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+    )
+
+
+limiter = MediaLimiter(
+    settings.media_max_concurrent or os.cpu_count() or 1,
+    settings.media_max_queued,
+    settings.media_queue_timeout,
+    settings.media_user_max_concurrent,
+    TokenBucket(settings.media_user_per_minute / 60, settings.media_user_burst),
+)
+
+
+def client_key(request: Request) -> str:
+    """
+    The user id of a valid bearer token, otherwise the client address. The
+    token is only decoded here; the route still verifies the user.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            user_id = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("id")
+            if user_id is not None:
+                return f"user:{user_id}"
+        except JWTError:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+async def admit_media_job(request: Request):
+    async with limiter.admit(client_key(request)):
+        yield
+
+
+MediaJob = Depends(admit_media_job)
@@ -3,11 +3,14 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import jwt,JWTError
 from datetime import datetime,timedelta
 from sqlmodel import select
+import logging
 
 from dependencies.db import SessionDep
 from models import security,schemas
 
 
+logger = logging.getLogger(__name__)
+
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="v1/auth/token")
 SECRET_KEY = security.jwtsettings.secret_key
 ALGORITHM = security.jwtsettings.algorithm
@@ -40,7 +43,7 @@ async def get_current_user(db: SessionDep, token: str = Depends(oauth2_bearer)):
            return None,"'user can't access account, limit reached" 
         return db_user, ""
     except JWTError:
-        print("jwt error")
+        logger.info("rejected an invalid jwt")
         return None,"error"
     
 async def verify_token(db: SessionDep, token: str):
@@ -0,0 +1,22 @@
+import numpy as np
+from typing import Optional
+from PIL import Image, ImageOps
+
+from video_module.analyze import FACE_MAX_SIDE, Fingerprint, frame_records
+
+
+def fingerprint(path: str) -> Optional[str]:
+    """
+    The SHA256 of the face analysis of the image at `path`, one record per
+    face like the tracks of a video, None when it has no faces. Blocking,
+    safe to run in a worker process.
+    """
+    with Image.open(path) as image:
+        # EXIF orientation applied, like ffmpeg applies the rotation of a video
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        width = image.width
+        image.thumbnail((FACE_MAX_SIDE, FACE_MAX_SIDE), Image.Resampling.BOX)
+        rgb_frame = np.asarray(image)
+    hasher = Fingerprint()
+    hasher.update(frame_records(rgb_frame, width / rgb_frame.shape[1]))
+    return hasher.hexdigest()
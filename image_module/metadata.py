@@ -8,6 +8,9 @@ from PIL import Image
 from PIL.ExifTags import TAGS
 from starlette.datastructures import UploadFile as StarletteUploadFile, Headers
 
+import metrics
+
+@metrics.timed("image_metadata_read")
 async def get_metadata(image_file: UploadFile) -> dict:
     # Read the image data
     content = await image_file.read()
@@ -57,6 +60,7 @@ async def get_metadata(image_file: UploadFile) -> dict:
     metadata["exif"] = exif_data
     return metadata
 
+@metrics.timed("image_metadata_write")
 async def add_metadata(image_file: UploadFile, tags: dict) -> UploadFile:
 
     # Read the image data
@@ -0,0 +1,139 @@
+"""
+Watermarks for still images, written and read by the version 2 engine of
+video_module/watermark.py. The mark lives on the luma plane scaled to
+MARK_SIDE pixels on its long side, so a resized copy is read on the same
+grid, and extraction decodes JPEGs straight to that size (draft mode)
+instead of decoding the full picture.
+"""
+import asyncio
+from io import BytesIO
+from typing import Optional
+
+import cv2
+import numpy as np
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+from starlette.datastructures import Headers, UploadFile as StarletteUploadFile
+
+import metrics
+from video_module import preview, watermark
+
+# long side of the luma plane the mark is computed on
+MARK_SIDE = 640
+# formats that are re-encoded with a mark, others are stored unmarked
+FORMATS = {"JPEG", "PNG", "WEBP"}
+QUALITY = 90
+
+
+def mark_size(width: int, height: int) -> tuple[int, int]:
+    """(width, height) of the plane carrying the mark of a `width` x `height` image."""
+    scale = MARK_SIDE / max(width, height)
+    return max(round(width * scale), 1), max(round(height * scale), 1)
+
+
+@metrics.timed("image_watermark_embed")
+async def embed_watermark(image_file: UploadFile, watermark_text: str) -> UploadFile:
+    """
+    Embeds a watermark in the given UploadFile image and returns a new
+    UploadFile, or `image_file` itself for formats that are not marked.
+    """
+    marked, _ = await _embed(image_file, watermark_text, with_previews=False)
+    return marked
+
+
+@metrics.timed("image_watermark_embed")
+async def embed_watermark_with_previews(
+    image_file: UploadFile, watermark_text: str
+) -> tuple[UploadFile, Optional[preview.Previews]]:
+    """Like embed_watermark, and also makes the poster and thumbnail from the marked pixels."""
+    return await _embed(image_file, watermark_text, with_previews=True)
+
+
+async def _embed(
+    image_file: UploadFile, watermark_text: str, with_previews: bool
+) -> tuple[UploadFile, Optional[preview.Previews]]:
+    await image_file.seek(0)
+    content = await image_file.read()
+    await image_file.seek(0)
+    marked, previews = await asyncio.to_thread(embed_image, content, watermark_text, with_previews)
+    if marked is None:
+        return image_file, previews
+    return StarletteUploadFile(
+        file=BytesIO(marked),
+        filename=image_file.filename,
+        headers=Headers({"content-type": image_file.content_type or "image/jpeg"}),
+    ), previews
+
+
+@metrics.timed("image_watermark_extract")
+async def extract_watermark(image_file: UploadFile) -> Optional[str]:
+    """Extracts the watermark from an UploadFile image."""
+    await image_file.seek(0)
+    content = await image_file.read()
+    await image_file.seek(0)
+    return await asyncio.to_thread(read_image, content)
+
+
+def embed_image(
+    content: bytes, watermark_text: str, with_previews: bool = False
+) -> tuple[Optional[bytes], Optional[preview.Previews]]:
+    """
+    The image re-encoded in its own format with the mark, None when its
+    format is not in FORMATS, it is too small to carry a mark or it cannot
+    be decoded, and with `with_previews` its poster and thumbnail. The EXIF
+    orientation is applied to the pixels, so the mark is upright the way the
+    picture is shown. Blocking.
+    """
+    try:
+        with Image.open(BytesIO(content)) as image:
+            image_format = image.format
+            if image_format not in FORMATS and not with_previews:
+                return None, None
+            icc_profile = image.info.get("icc_profile")
+            upright = ImageOps.exif_transpose(image)
+            exif = upright.getexif()
+            alpha = upright.getchannel("A") if "A" in upright.getbands() else None
+            rgb = upright.convert("RGB")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None, None
+
+    size = mark_size(rgb.width, rgb.height)
+    # an image too narrow for a whole tile on the mark plane is stored as it is, its mark could not be read back
+    markable = image_format in FORMATS and watermark.fits_tile(*size)
+    pixels = np.asarray(rgb)
+    if markable:
+        luma = np.asarray(rgb.convert("L").resize(size, Image.Resampling.BOX), dtype=np.float32)
+        offsets = cv2.resize(
+            watermark.luma_offsets(luma, watermark_text), (rgb.width, rgb.height), interpolation=cv2.INTER_NEAREST
+        )
+        # the same amount added to R, G and B moves luma by it and leaves the colour alone
+        pixels = cv2.add(pixels, cv2.merge([offsets, offsets, offsets]), dtype=cv2.CV_8U)
+    # made from the marked pixels, which keep the mark at any size
+    previews = preview.still(cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)) if with_previews else None
+    if not markable:
+        return None, previews
+
+    marked = Image.fromarray(pixels)
+    if alpha is not None:
+        marked.putalpha(alpha)
+
+    output = BytesIO()
+    options = {"exif": exif, "icc_profile": icc_profile}
+    if image_format in ("JPEG", "WEBP"):
+        options["quality"] = QUALITY
+    marked.save(output, format=image_format, **{k: v for k, v in options.items() if v})
+    return output.getvalue(), previews
+
+
+def read_image(content: bytes) -> Optional[str]:
+    """The version 2 mark of an encoded image, None when it carries none. Blocking."""
+    try:
+        with Image.open(BytesIO(content)) as image:
+            size = mark_size(*image.size)
+            # JPEGs decode their luma at 1/2, 1/4 or 1/8 scale, no smaller than the mark plane
+            image.draft("L", size)
+            luma = ImageOps.exif_transpose(image.convert("L"))
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    luma = luma.resize(mark_size(luma.width, luma.height), Image.Resampling.BOX)
+    return watermark.read_luma(np.asarray(luma, dtype=np.float32))
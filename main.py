@@ -1,12 +1,19 @@
-from fastapi import FastAPI,HTTPException
+import logging
+import time
+from fastapi import FastAPI,HTTPException,Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 
 
-from database import startup
+from database import startup,engine
 from api import router
 from exception_handlers import validation_exception_handler,http_exception_handler
+from services import activity,events,faces,dmm_filter
+from dependencies import admission
+from routers import metrics as metrics_router
+import metrics
 
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="DeepMark",
@@ -20,7 +27,17 @@ app = FastAPI(
 @app.on_event("startup")
 async def on_startup():
     await startup()
-    print("Database Succesfully Connected")
+    logger.info("Database Succesfully Connected")
+    await faces.startup()
+    await dmm_filter.startup()
+    await events.broker.start()
+
+#Flushing buffered activities
+@app.on_event("shutdown")
+async def on_shutdown():
+    await activity.writer.stop()
+    await events.broker.stop()
+    await dmm_filter.shutdown()
 
 #Adding CORS
 app.add_middleware(
@@ -38,3 +55,28 @@ app.add_exception_handler(HTTPException, http_exception_handler)
 #Adding Main Router
 app.include_router(router)
 
+#Adding Metrics
+if metrics.enabled:
+    metrics.instrument_engine(engine)
+    metrics.gauge("deepmark_activity_queue_depth", "Activities waiting for the next batched write.", activity.writer.pending)
+    metrics.gauge("deepmark_activity_subscribers", "Open activity WebSocket subscriptions.", events.broker.subscriber_count)
+    metrics.gauge("deepmark_media_jobs_running", "Media jobs holding an admission slot.", lambda: admission.limiter.running)
+    metrics.gauge("deepmark_media_jobs_waiting", "Media jobs queued for an admission slot.", lambda: admission.limiter.waiting)
+
+    @app.middleware("http")
+    async def record_request_latency(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # the route template keeps the label set bounded, unmatched paths share one label
+            route = request.scope.get("route")
+            metrics.request_seconds.observe(
+                time.perf_counter() - start, request.method, getattr(route, "path", "unmatched"), status
+            )
+
+    app.include_router(metrics_router.router)
+
@@ -0,0 +1,311 @@
+"""
+Process-local metrics in the Prometheus text format.
+
+Everything is a no-op unless METRICS_ENABLED is set: `span` returns a shared
+null context, `timed` and `decode` hand back what they were given and
+`observe` returns before touching any state, so instrumented hot
+paths cost one attribute lookup when metrics are off.
+
+Each uvicorn worker keeps its own registry; scrape every worker, or run with
+a single worker per pod.
+"""
+import bisect
+import contextlib
+import functools
+import math
+import threading
+import time
+from typing import Callable, Iterable, Optional
+from pydantic_settings import BaseSettings
+
+
+# kept out of models/security.py so the media modules import without the server settings
+class Settings(BaseSettings):
+    metrics_enabled : bool = False
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+
+enabled = Settings().metrics_enabled
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, from a single query up to a long video
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    """A value read from `callback` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, callback: Callable[[], Optional[float]]):
+        super().__init__(name, help)
+        self.callback = callback
+
+    def render(self):
+        value = self.callback()
+        if value is None:
+            return []
+        return self.header() + [f"{self.name} {_number(value)}"]
+
+
+class LabeledGauge(Metric):
+    """A value per label set, set and removed by the code that owns it."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def remove(self, *labels):
+        with self._lock:
+            self._values.pop(labels, None)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [bucket counts..., sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * len(self.buckets) + [0.0]
+            row[index] += 1
+            row[-1] += value
+
+    def render(self):
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for labels, row in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(row[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+registry: list[Metric] = []
+
+
+def register(metric: Metric) -> Metric:
+    registry.append(metric)
+    return metric
+
+
+stage_seconds = register(Histogram(
+    "deepmark_stage_seconds", "Time spent in each media pipeline stage.", ["stage"]
+))
+frames_processed = register(Counter(
+    "deepmark_frames_processed_total", "Video frames read by each pipeline stage.", ["stage"]
+))
+media_progress = register(LabeledGauge(
+    "deepmark_media_progress_ratio", "Share of its frames each running media job has read, by stage.", ["stage", "job"]
+))
+request_seconds = register(Histogram(
+    "deepmark_http_request_seconds", "HTTP request latency by route.", ["method", "route", "status"]
+))
+query_seconds = register(Histogram(
+    "deepmark_db_query_seconds", "Database statement latency by statement type.", ["operation"]
+))
+admission_rejected = register(Counter(
+    "deepmark_admission_rejected_total", "Media requests turned away by admission control.", ["reason"]
+))
+dmm_filter_lookups = register(Counter(
+    "deepmark_dmm_filter_lookups_total", "DMM key lookups by the Bloom filter's answer.", ["kind", "result"]
+))
+response_cache_requests = register(Counter(
+    "deepmark_response_cache_requests_total", "Cached read endpoint requests by how they were answered.", ["endpoint", "result"]
+))
+
+
+def gauge(name: str, help: str, callback: Callable[[], Optional[float]]):
+    register(Gauge(name, help, callback))
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# instrumentation helpers
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stage_seconds.observe(time.perf_counter() - self.start, self.stage)
+        return False
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def span(stage: str):
+    """Times the enclosed block as `stage`."""
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(stage)
+
+
+def timed(stage: str):
+    """Decorator form of `span` for coroutines; a no-op when metrics are off."""
+    def decorate(fn):
+        if not enabled:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with _Span(stage):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def decode(stage: str, frames: Iterable):
+    """
+    Passes `frames` through, timing how long producing them takes as the
+    "decode" stage and counting them as processed by `stage`.
+    """
+    if not enabled:
+        return frames
+    return _timed_frames(stage, frames)
+
+
+def _timed_frames(stage, frames):
+    elapsed = 0.0
+    count = 0
+    iterator = iter(frames)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                frame = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            count += 1
+            yield frame
+    finally:
+        stage_seconds.observe(elapsed, "decode")
+        frames_processed.inc(count, stage)
+
+
+def observe(stage: str, seconds: float):
+    if enabled:
+        stage_seconds.observe(seconds, stage)
+
+
+def instrument_engine(engine):
+    """Times every statement the engine executes."""
+    from sqlalchemy import event
+
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["metrics_query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        query_seconds.observe(time.perf_counter() - start, operation)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def failed(context):
+        starts = context.connection.info.get("metrics_query_start") if context.connection else None
+        if starts:
+            starts.pop()
+
+    pool = sync_engine.pool
+    if hasattr(pool, "checkedout"):
+        gauge("deepmark_db_pool_checked_out", "Connections currently checked out of the pool.", pool.checkedout)
+    if hasattr(pool, "size"):
+        gauge("deepmark_db_pool_size", "Configured size of the connection pool.", pool.size)
+    if hasattr(pool, "overflow"):
+        gauge("deepmark_db_pool_overflow", "Connections opened beyond the pool size.", pool.overflow)
@@ -0,0 +1,170 @@
+"""initial schema
+
+Mirrors models/schemas.py as it was created by `SQLModel.metadata.create_all`
+together with the pg_trgm extension and the trigram index on users.email
+that `database.startup` used to create on every boot.
+
+Databases that were bootstrapped by the old startup hook already contain all
+of this; mark them with `alembic stamp 0001` instead of upgrading.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    op.create_table(
+        "hashtags",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("idx_hashtag_name", "hashtags", ["name"])
+    op.create_index("idx_hashtag_id", "hashtags", ["id"])
+
+    op.create_table(
+        "users",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=100), nullable=False),
+        sa.Column("username", sa.String(length=50), nullable=False),
+        sa.Column("email", sa.String(length=100), nullable=False),
+        sa.Column("password_hash", sa.String(length=255), nullable=False),
+        sa.Column("security_key", sa.String(length=255), nullable=False),
+        sa.Column("profile_picture", sa.String(length=255), nullable=False),
+        sa.Column("bio", sa.String(length=250), nullable=True),
+        sa.Column("warning", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("following_count", sa.Integer(), nullable=False),
+        sa.Column("followers_count", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("user_id"),
+        sa.UniqueConstraint("email", name="unique_email"),
+        sa.UniqueConstraint("username", name="unique_username"),
+        sa.CheckConstraint("warning <= 3", name="check_warning_limit"),
+    )
+    op.create_index("idx_username", "users", ["username"])
+    op.create_index("idx_user_id", "users", ["user_id"])
+    op.create_index(
+        "idx_users_email_trgm",
+        "users",
+        ["email"],
+        postgresql_using="gin",
+        postgresql_ops={"email": "gin_trgm_ops"},
+    )
+
+    op.create_table(
+        "followers",
+        sa.Column("follower_id", sa.Integer(), nullable=False),
+        sa.Column("following_id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("follower_id", "following_id"),
+        sa.UniqueConstraint("follower_id", "following_id", name="unique_follow"),
+        sa.CheckConstraint("follower_id != following_id", name="check_no_self_follow"),
+        sa.ForeignKeyConstraint(["follower_id"], ["users.user_id"]),
+        sa.ForeignKeyConstraint(["following_id"], ["users.user_id"]),
+    )
+
+    op.create_table(
+        "posts",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("media_url", sa.String(length=255), nullable=False),
+        sa.Column("caption", sa.String(length=500), nullable=True),
+        sa.Column("likes_count", sa.Integer(), nullable=False),
+        sa.Column("media_type", sa.String(length=10), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("media_url", name="unique_media_url"),
+        sa.CheckConstraint("media_type IN ('image', 'video')", name="check_media_type"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.user_id"]),
+    )
+    op.create_index("idx_posts_user_id", "posts", ["user_id"])
+    op.create_index("idx_posts_created_at", "posts", ["created_at"])
+    op.create_index("idx_posts_media_type", "posts", ["media_type"])
+
+    op.create_table(
+        "activities",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("receiver_name", sa.String(), nullable=True),
+        sa.Column("sender_name", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("media_type", sa.String(), nullable=False),
+        sa.Column("liked_post_id", sa.Integer(), nullable=True),
+        sa.Column("liked_post_url", sa.String(length=255), nullable=True),
+        sa.Column("liked_user_profile_picture", sa.String(length=255), nullable=True),
+        sa.Column("followed_profile_picture", sa.String(length=255), nullable=True),
+        sa.Column("detected_post_id", sa.Integer(), nullable=True),
+        sa.Column("detected_post_url", sa.String(length=255), nullable=True),
+        sa.Column("detected_user_profile_picture", sa.String(length=255), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.ForeignKeyConstraint(["receiver_name"], ["users.username"]),
+        sa.ForeignKeyConstraint(["sender_name"], ["users.username"]),
+        sa.ForeignKeyConstraint(["liked_post_id"], ["posts.id"]),
+        sa.ForeignKeyConstraint(["detected_post_id"], ["posts.id"]),
+    )
+    op.create_index("idx_notifications_receiver_name", "activities", ["receiver_name"])
+
+    op.create_table(
+        "dmm",
+        sa.Column("dmm_id", sa.CHAR(length=16), nullable=False),
+        sa.Column("video_id", sa.Integer(), nullable=True),
+        sa.Column("hash_value", sa.String(length=255), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("dmm_id"),
+        sa.UniqueConstraint("hash_value", name="unique_hash_value"),
+        sa.ForeignKeyConstraint(["video_id"], ["posts.id"]),
+    )
+    op.create_index("idx_dmm_video_id", "dmm", ["video_id"])
+
+    op.create_table(
+        "post_hashtag",
+        sa.Column("post_id", sa.Integer(), nullable=False),
+        sa.Column("hashtag_id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("post_id", "hashtag_id"),
+        sa.ForeignKeyConstraint(["post_id"], ["posts.id"]),
+        sa.ForeignKeyConstraint(["hashtag_id"], ["hashtags.id"]),
+    )
+
+    op.create_table(
+        "post_likes",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("post_id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("user_id", "post_id"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.user_id"]),
+        sa.ForeignKeyConstraint(["post_id"], ["posts.id"]),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("post_likes")
+    op.drop_table("post_hashtag")
+    op.drop_index("idx_dmm_video_id", table_name="dmm")
+    op.drop_table("dmm")
+    op.drop_index("idx_notifications_receiver_name", table_name="activities")
+    op.drop_table("activities")
+    op.drop_index("idx_posts_media_type", table_name="posts")
+    op.drop_index("idx_posts_created_at", table_name="posts")
+    op.drop_index("idx_posts_user_id", table_name="posts")
+    op.drop_table("posts")
+    op.drop_table("followers")
+    op.drop_index("idx_users_email_trgm", table_name="users")
+    op.drop_index("idx_user_id", table_name="users")
+    op.drop_index("idx_username", table_name="users")
+    op.drop_table("users")
+    op.drop_index("idx_hashtag_id", table_name="hashtags")
+    op.drop_index("idx_hashtag_name", table_name="hashtags")
+    op.drop_table("hashtags")
@@ -0,0 +1,76 @@
+"""query driven indexes
+
+Drops indexes that duplicate a primary key or unique constraint, or that no
+query uses, and adds composite indexes for the hot lookups:
+
+- activities of a receiver, newest first
+- posts of a user, newest first
+- dmm fingerprint lookups joined to posts (covering video_id)
+- likes of a post, posts of a hashtag, followers of a user
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_index("idx_user_id", table_name="users")
+    op.drop_index("idx_username", table_name="users")
+    op.drop_index("idx_hashtag_id", table_name="hashtags")
+    op.drop_index("idx_posts_media_type", table_name="posts")
+    # the (follower_id, following_id) primary key already enforces it
+    op.drop_constraint("unique_follow", "followers", type_="unique")
+
+    op.drop_index("idx_posts_user_id", table_name="posts")
+    op.create_index("idx_posts_user_id_created_at", "posts", ["user_id", "created_at"])
+
+    op.drop_index("idx_notifications_receiver_name", table_name="activities")
+    op.create_index(
+        "idx_activities_receiver_name_created_at", "activities", ["receiver_name", "created_at"]
+    )
+
+    op.drop_constraint("unique_hash_value", "dmm", type_="unique")
+    op.create_index(
+        "unique_hash_value", "dmm", ["hash_value"], unique=True, postgresql_include=["video_id"]
+    )
+
+    op.create_index("idx_post_likes_post_id_user_id", "post_likes", ["post_id", "user_id"])
+    op.create_index(
+        "idx_post_hashtag_hashtag_id_post_id", "post_hashtag", ["hashtag_id", "post_id"]
+    )
+    op.create_index(
+        "idx_followers_following_id_follower_id", "followers", ["following_id", "follower_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("idx_followers_following_id_follower_id", table_name="followers")
+    op.drop_index("idx_post_hashtag_hashtag_id_post_id", table_name="post_hashtag")
+    op.drop_index("idx_post_likes_post_id_user_id", table_name="post_likes")
+
+    op.drop_index("unique_hash_value", table_name="dmm")
+    op.create_unique_constraint("unique_hash_value", "dmm", ["hash_value"])
+
+    op.drop_index("idx_activities_receiver_name_created_at", table_name="activities")
+    op.create_index("idx_notifications_receiver_name", "activities", ["receiver_name"])
+
+    op.drop_index("idx_posts_user_id_created_at", table_name="posts")
+    op.create_index("idx_posts_user_id", "posts", ["user_id"])
+
+    op.create_unique_constraint("unique_follow", "followers", ["follower_id", "following_id"])
+    op.create_index("idx_posts_media_type", "posts", ["media_type"])
+    op.create_index("idx_hashtag_id", "hashtags", ["id"])
+    op.create_index("idx_username", "users", ["username"])
+    op.create_index("idx_user_id", "users", ["user_id"])
@@ -0,0 +1,115 @@
+"""activities keyed by user id
+
+Activities reference the receiver, sender and post by id instead of copying
+usernames, profile pictures and media urls onto every row; readers join
+them in. Adds the per-user unread activity counter maintained by the
+batched activity writer.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("users", sa.Column("unread_activity_count", sa.Integer(), nullable=False, server_default="0"))
+    op.alter_column("users", "unread_activity_count", server_default=None)
+
+    op.add_column("activities", sa.Column("receiver_id", sa.Integer(), nullable=True))
+    op.add_column("activities", sa.Column("sender_id", sa.Integer(), nullable=True))
+    op.add_column("activities", sa.Column("kind", sa.String(length=10), nullable=True))
+    op.add_column("activities", sa.Column("post_id", sa.Integer(), nullable=True))
+
+    op.execute("""
+        UPDATE activities a
+        SET receiver_id = r.user_id,
+            sender_id = s.user_id,
+            kind = CASE
+                WHEN a.liked_post_id IS NOT NULL THEN 'like'
+                WHEN a.detected_post_id IS NOT NULL THEN 'detection'
+                ELSE 'follow'
+            END,
+            post_id = COALESCE(a.liked_post_id, a.detected_post_id)
+        FROM users r, users s
+        WHERE r.username = a.receiver_name AND s.username = a.sender_name
+    """)
+    op.execute("DELETE FROM activities WHERE receiver_id IS NULL OR sender_id IS NULL")
+
+    op.alter_column("activities", "receiver_id", nullable=False)
+    op.alter_column("activities", "sender_id", nullable=False)
+    op.alter_column("activities", "kind", nullable=False)
+    op.create_foreign_key("activities_receiver_id_fkey", "activities", "users", ["receiver_id"], ["user_id"])
+    op.create_foreign_key("activities_sender_id_fkey", "activities", "users", ["sender_id"], ["user_id"])
+    op.create_foreign_key("activities_post_id_fkey", "activities", "posts", ["post_id"], ["id"])
+    op.create_check_constraint("check_activity_kind", "activities", "kind IN ('like', 'follow', 'detection')")
+
+    op.drop_index("idx_activities_receiver_name_created_at", table_name="activities")
+    op.create_index("idx_activities_receiver_id_created_at", "activities", ["receiver_id", "created_at"])
+
+    for column in (
+        "receiver_name", "sender_name", "media_type",
+        "liked_post_id", "liked_post_url", "liked_user_profile_picture",
+        "followed_profile_picture",
+        "detected_post_id", "detected_post_url", "detected_user_profile_picture",
+    ):
+        op.drop_column("activities", column)
+
+
+def downgrade() -> None:
+    op.add_column("activities", sa.Column("receiver_name", sa.String(), nullable=True))
+    op.add_column("activities", sa.Column("sender_name", sa.String(), nullable=True))
+    op.add_column("activities", sa.Column("media_type", sa.String(), nullable=False, server_default=""))
+    op.alter_column("activities", "media_type", server_default=None)
+    op.add_column("activities", sa.Column("liked_post_id", sa.Integer(), nullable=True))
+    op.add_column("activities", sa.Column("liked_post_url", sa.String(length=255), nullable=True))
+    op.add_column("activities", sa.Column("liked_user_profile_picture", sa.String(length=255), nullable=True))
+    op.add_column("activities", sa.Column("followed_profile_picture", sa.String(length=255), nullable=True))
+    op.add_column("activities", sa.Column("detected_post_id", sa.Integer(), nullable=True))
+    op.add_column("activities", sa.Column("detected_post_url", sa.String(length=255), nullable=True))
+    op.add_column("activities", sa.Column("detected_user_profile_picture", sa.String(length=255), nullable=True))
+
+    op.execute("""
+        UPDATE activities a
+        SET receiver_name = r.username,
+            sender_name = s.username,
+            media_type = COALESCE(p.media_type, ''),
+            liked_post_id = CASE WHEN a.kind = 'like' THEN a.post_id END,
+            liked_post_url = CASE WHEN a.kind = 'like' THEN p.media_url ELSE '' END,
+            liked_user_profile_picture = CASE WHEN a.kind = 'like' THEN s.profile_picture ELSE '' END,
+            followed_profile_picture = CASE WHEN a.kind = 'follow' THEN s.profile_picture ELSE '' END,
+            detected_post_id = CASE WHEN a.kind = 'detection' THEN a.post_id END,
+            detected_post_url = CASE WHEN a.kind = 'detection' THEN p.media_url ELSE '' END,
+            detected_user_profile_picture = CASE WHEN a.kind = 'detection' THEN s.profile_picture ELSE '' END
+        FROM users r, users s, activities a2
+        LEFT JOIN posts p ON p.id = a2.post_id
+        WHERE a2.id = a.id AND r.user_id = a.receiver_id AND s.user_id = a.sender_id
+    """)
+
+    op.create_foreign_key("activities_receiver_name_fkey", "activities", "users", ["receiver_name"], ["username"])
+    op.create_foreign_key("activities_sender_name_fkey", "activities", "users", ["sender_name"], ["username"])
+    op.create_foreign_key("activities_liked_post_id_fkey", "activities", "posts", ["liked_post_id"], ["id"])
+    op.create_foreign_key("activities_detected_post_id_fkey", "activities", "posts", ["detected_post_id"], ["id"])
+
+    op.drop_index("idx_activities_receiver_id_created_at", table_name="activities")
+    op.create_index("idx_activities_receiver_name_created_at", "activities", ["receiver_name", "created_at"])
+
+    op.drop_constraint("check_activity_kind", "activities", type_="check")
+    op.drop_constraint("activities_post_id_fkey", "activities", type_="foreignkey")
+    op.drop_constraint("activities_sender_id_fkey", "activities", type_="foreignkey")
+    op.drop_constraint("activities_receiver_id_fkey", "activities", type_="foreignkey")
+    for column in ("post_id", "kind", "sender_id", "receiver_id"):
+        op.drop_column("activities", column)
+
+    op.drop_column("users", "unread_activity_count")
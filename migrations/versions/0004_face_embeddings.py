@@ -0,0 +1,39 @@
+"""face embeddings
+
+One int8 quantized face embedding per identity seen in a video post, loaded
+into the in-process similarity index at startup and polled by id after.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "face_embeddings",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("post_id", sa.Integer(), nullable=False),
+        sa.Column("embedding", sa.LargeBinary(length=128), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.ForeignKeyConstraint(["post_id"], ["posts.id"], ondelete="CASCADE"),
+    )
+    op.create_index("idx_face_embeddings_post_id", "face_embeddings", ["post_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("idx_face_embeddings_post_id", table_name="face_embeddings")
+    op.drop_table("face_embeddings")
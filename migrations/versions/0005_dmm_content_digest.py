@@ -0,0 +1,32 @@
+"""dmm content digest
+
+SHA256 of the upload as it was received, hashed while the body streamed in,
+so an exact re-upload is answered before any decoding. Rows written before
+this revision, and by the backfill, have none.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("dmm", sa.Column("content_digest", sa.CHAR(length=64), nullable=True))
+    op.create_index("idx_dmm_content_digest", "dmm", ["content_digest"])
+
+
+def downgrade() -> None:
+    op.drop_index("idx_dmm_content_digest", table_name="dmm")
+    op.drop_column("dmm", "content_digest")
@@ -0,0 +1,28 @@
+"""dmm created_at index
+
+Every worker polls the dmm rows created since its last look to keep its
+Bloom filter (services/dmm_filter.py) current between rebuilds.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("idx_dmm_created_at", "dmm", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("idx_dmm_created_at", table_name="dmm")
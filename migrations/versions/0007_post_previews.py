@@ -0,0 +1,33 @@
+"""post previews
+
+Public ids of the poster, thumbnail and preview clip made at ingest and
+stored next to the media. Older posts keep them null.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("posts", sa.Column("poster_url", sa.String(length=255), nullable=True))
+    op.add_column("posts", sa.Column("thumbnail_url", sa.String(length=255), nullable=True))
+    op.add_column("posts", sa.Column("preview_url", sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("posts", "preview_url")
+    op.drop_column("posts", "thumbnail_url")
+    op.drop_column("posts", "poster_url")
@@ -0,0 +1,36 @@
+"""dmm nullable hash_value
+
+Media without faces has no face fingerprint and stores a null hash_value,
+which the unique index does not compare. The one row holding the hash every
+faceless video used to get, the version byte alone, is cleared.
+
+Downgrading fails while rows with a null hash_value exist.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# sha256 of bytes([2]), the fingerprint of a video without face tracks at fingerprint version 2
+FACELESS_HASH = "dbc1b4c900ffe48d575b5da5c638040125f65db0fe3e24494b76ea986457d986"
+
+
+def upgrade() -> None:
+    op.alter_column("dmm", "hash_value", existing_type=sa.String(length=255), nullable=True)
+    op.execute(sa.text("UPDATE dmm SET hash_value = NULL WHERE hash_value = :faceless").bindparams(faceless=FACELESS_HASH))
+
+
+def downgrade() -> None:
+    op.alter_column("dmm", "hash_value", existing_type=sa.String(length=255), nullable=False)
@@ -0,0 +1,33 @@
+"""image dmm rows without a digest hash_value
+
+Image posts stored their upload digest in hash_value as well as in
+content_digest, mixing two kinds of identifier in the fingerprint column.
+Their hash_value is cleared; scripts.backfill fills in a face fingerprint.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.text("UPDATE dmm SET hash_value = NULL WHERE hash_value = content_digest"))
+
+
+def downgrade() -> None:
+    op.execute(sa.text(
+        "UPDATE dmm SET hash_value = content_digest FROM posts"
+        " WHERE posts.id = dmm.video_id AND posts.media_type = 'image' AND dmm.hash_value IS NULL"
+    ))
@@ -62,6 +62,10 @@ class Post(PostCreate):
     user_id: int
     likes_count: int
     created_at: datetime
+    #small variants for feeds, stored like media_url; the preview clip is for videos only
+    poster_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
 
     model_config = {
         "from_attributes": True 
@@ -1,13 +1,16 @@
 from typing import Optional, List, Literal
 from sqlmodel import Field, SQLModel, Index, UniqueConstraint, CheckConstraint, Relationship
 from datetime import datetime, timezone
-from sqlalchemy import Column, DateTime,Integer,ForeignKey,CHAR
+from sqlalchemy import Column, DateTime,Integer,ForeignKey,CHAR,LargeBinary
 from uuid import UUID, uuid4
 
 #Association Tables
 
 class PostLikes(SQLModel, table=True):
     __tablename__ = "post_likes"
+    __table_args__ = (
+        Index("idx_post_likes_post_id_user_id", "post_id", "user_id"),
+    )
 
     user_id: Optional[int] = Field(
         default=None, foreign_key="users.user_id", primary_key=True
@@ -18,6 +21,9 @@ class PostLikes(SQLModel, table=True):
 
 class PostHashtag(SQLModel, table=True):
     __tablename__ = "post_hashtag"
+    __table_args__ = (
+        Index("idx_post_hashtag_hashtag_id_post_id", "hashtag_id", "post_id"),
+    )
 
     post_id: Optional[int] = Field(
         default=None, foreign_key="posts.id", primary_key=True
@@ -32,8 +38,10 @@ class PostHashtag(SQLModel, table=True):
 class User(SQLModel, table=True):
     __tablename__ = "users"
     __table_args__ = (
-        Index("idx_user_id", "user_id"),
-        Index("idx_username", "username"),
+        Index(
+            "idx_users_email_trgm", "email",
+            postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"}
+        ),
         UniqueConstraint("email", name="unique_email"),
         UniqueConstraint("username", name="unique_username"),
         CheckConstraint("warning <= 3", name="check_warning_limit"),
@@ -57,6 +65,7 @@ class User(SQLModel, table=True):
     )
     following_count: int = Field(default=0)
     followers_count: int = Field(default=0)
+    unread_activity_count: int = Field(default=0)
 
     posts: List["Post"] = Relationship(back_populates="user")
     liked_posts: List["Post"] = Relationship(
@@ -76,8 +85,7 @@ class Post(SQLModel, table=True):
     __tablename__ = "posts"
 
     __table_args__ = (
-        Index("idx_posts_user_id", "user_id"),
-        Index("idx_posts_media_type", "media_type"),
+        Index("idx_posts_user_id_created_at", "user_id", "created_at"),
         Index("idx_posts_created_at", "created_at"),
         UniqueConstraint("media_url", name="unique_media_url"),
         CheckConstraint("media_type IN ('image', 'video')", name="check_media_type"),
@@ -89,6 +97,10 @@ class Post(SQLModel, table=True):
     caption: Optional[str] = Field(default="",max_length=500)
     likes_count: int = Field(default=0)
     media_type: str = Field(max_length=10)
+    #public ids of the variants made at ingest, next to media_url; null for older posts
+    poster_url: Optional[str] = Field(default=None, max_length=255)
+    thumbnail_url: Optional[str] = Field(default=None, max_length=255)
+    preview_url: Optional[str] = Field(default=None, max_length=255)
     created_at: datetime = Field(
         sa_column=Column(DateTime(timezone=True), nullable=False),
         default_factory=lambda: datetime.now(timezone.utc),
@@ -105,8 +117,7 @@ class Post(SQLModel, table=True):
 class Hashtag(SQLModel, table = True):
     __tablename__ = "hashtags"
     __table_args__ = (
-        Index("idx_hashtag_id", "id"),
-        Index("idx_hashtag_name", "name")
+        Index("idx_hashtag_name", "name"),
     )
 
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -120,7 +131,7 @@ class Hashtag(SQLModel, table = True):
 class Follower(SQLModel, table=True):
     __tablename__ = "followers"
     __table_args__ = (
-        UniqueConstraint("follower_id", "following_id", name="unique_follow"),
+        Index("idx_followers_following_id_follower_id", "following_id", "follower_id"),
         CheckConstraint("follower_id != following_id", name="check_no_self_follow"),
     )
 
@@ -144,45 +155,60 @@ class Follower(SQLModel, table=True):
 class Activity(SQLModel, table=True):
     __tablename__ = "activities"
     __table_args__ = (
-        Index("idx_notifications_receiver_name", "receiver_name"),
+        Index("idx_activities_receiver_id_created_at", "receiver_id", "created_at"),
+        CheckConstraint("kind IN ('like', 'follow', 'detection')", name="check_activity_kind"),
     )
 
     id: Optional[int] = Field(default=None, primary_key=True)
-    receiver_name: Optional[str] = Field(foreign_key="users.username")
-    sender_name: Optional[str] = Field(default=None,foreign_key="users.username")
+    receiver_id: int = Field(foreign_key="users.user_id")
+    sender_id: int = Field(foreign_key="users.user_id")
+    kind: str = Field(max_length=10)
     created_at: datetime = Field(
         sa_column=Column(DateTime(timezone=True ), nullable=False),
         default_factory=lambda: datetime.now(timezone.utc),
     )
-    media_type: str = Literal["image", "video"]
 
-    #like activity
-    liked_post_id: Optional[int] = Field(default=None,foreign_key="posts.id")
-    liked_post_url: Optional[str] = Field(default="",max_length=255)
-    liked_user_profile_picture:Optional[str] = Field(default="", max_length=255) 
-    
-    #follow activity:
-    followed_profile_picture:Optional[str] = Field(default="", max_length=255)  
-
-    #deepfake dectected activity
-    detected_post_id: Optional[int] = Field(default=None,foreign_key="posts.id")
-    detected_post_url: Optional[str] = Field(default="",max_length=255)
-    detected_user_profile_picture:Optional[str] = Field(default="", max_length=255)
+    #liked or detected post, urls and pictures are joined in when reading
+    post_id: Optional[int] = Field(default=None,foreign_key="posts.id")
 
 
 class DMM(SQLModel, table=True):
     __tablename__ = "dmm"
     __table_args__ = (
         Index("idx_dmm_video_id", "video_id"),
-        UniqueConstraint("hash_value", name="unique_hash_value"),
+        Index("unique_hash_value", "hash_value", unique=True, postgresql_include=["video_id"]),
+        Index("idx_dmm_content_digest", "content_digest"),
+        #rows created since the last poll of services.dmm_filter
+        Index("idx_dmm_created_at", "created_at"),
     )
 
     dmm_id: str = Field(
         sa_column=Column(CHAR(16), primary_key=True, nullable=False)
     )
     video_id: Optional[int] = Field(foreign_key="posts.id")
-    hash_value: str = Field(max_length=255)
+    #face fingerprint, null for media without faces and for images until scripts.backfill fingerprints them
+    hash_value: Optional[str] = Field(default=None, max_length=255, nullable=True)
+    #SHA256 of the upload as received, before watermarking; unknown for backfilled rows
+    content_digest: Optional[str] = Field(default=None, sa_column=Column(CHAR(64), nullable=True))
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+        default_factory=lambda: datetime.now(timezone.utc),
+    )
+
+
+class FaceEmbedding(SQLModel, table=True):
+    __tablename__ = "face_embeddings"
+    __table_args__ = (
+        Index("idx_face_embeddings_post_id", "post_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    post_id: int = Field(
+        sa_column=Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False)
+    )
+    #one identity seen in the video: its mean face encoding, L2-normalized and int8 quantized (128 bytes)
+    embedding: bytes = Field(sa_column=Column(LargeBinary(128), nullable=False))
     created_at: datetime = Field(
         sa_column=Column(DateTime(timezone=True), nullable=False),
         default_factory=lambda: datetime.now(timezone.utc),
-    )
\ No newline at end of file
+    )
@@ -1,3 +1,5 @@
+from typing import Optional
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
 #Classes to Access Environment Variables
@@ -9,11 +11,23 @@ class Master(BaseSettings):
         extra = "ignore"
 
 class Database(BaseSettings):
-    pg_host : str
-    pg_port : str
-    pg_database : str
-    pg_user : str
-    pg_password : str
+    # a full SQLAlchemy url (e.g. sqlite+aiosqlite:///load.db) replaces the PG_* settings
+    database_url : Optional[str] = None
+    pg_host : Optional[str] = None
+    pg_port : Optional[str] = None
+    pg_database : Optional[str] = None
+    pg_user : Optional[str] = None
+    pg_password : Optional[str] = None
+    # "check" only verifies the alembic revision, "create_all" bootstraps the schema
+    schema_mode : str = "check"
+
+    @model_validator(mode="after")
+    def require_connection(self):
+        pg = [self.pg_host, self.pg_port, self.pg_database, self.pg_user, self.pg_password]
+        if not self.database_url and not all(pg):
+            raise ValueError("set DATABASE_URL or all of PG_HOST, PG_PORT, PG_DATABASE, PG_USER, PG_PASSWORD")
+        return self
+
     class Config:
         env_file = ".env"
         extra = "ignore"
@@ -28,10 +42,110 @@ class JWT(BaseSettings):
         extra = "ignore"
 
 class CLOUDINARY(BaseSettings):
-    cloudinary_cloud_name: str
-    cloudinary_api_key: str
-    cloudinary_api_secret_key: str
-    
+    # only needed with STORAGE_BACKEND=cloudinary
+    cloudinary_cloud_name: Optional[str] = None
+    cloudinary_api_key: Optional[str] = None
+    cloudinary_api_secret_key: Optional[str] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.cloudinary_cloud_name and self.cloudinary_api_key and self.cloudinary_api_secret_key)
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+class Activity(BaseSettings):
+    # activities are buffered and written in one multi-row insert per flush
+    activity_flush_interval_ms : int = 200
+    activity_max_batch : int = 500
+    # "memory" for a single worker, "postgres" to fan out over LISTEN/NOTIFY
+    activity_broker : str = "memory"
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+class Storage(BaseSettings):
+    # "cloudinary" or "local" (files under storage_local_dir, for tests)
+    storage_backend : str = "cloudinary"
+    storage_local_dir : str = "media"
+    # cloudinary needs at least 5MB per chunk except for the last one
+    storage_chunk_size : int = 6 * 1024 * 1024
+    storage_max_retries : int = 3
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+class Admission(BaseSettings):
+    # media jobs (uploads and demo analysis) running at once per worker process, 0 for one per core
+    media_max_concurrent : int = 0
+    # jobs allowed to wait for a slot, and for how long, before a 503
+    media_max_queued : int = 8
+    media_queue_timeout : float = 10.0
+    # per user (per client address on the demo routes): jobs at once and a token bucket
+    media_user_max_concurrent : int = 1
+    media_user_per_minute : float = 6.0
+    media_user_burst : int = 3
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+class Upload(BaseSettings):
+    # checked from the container header before any decoding
+    upload_max_image_bytes : int = 20 * 1024 * 1024
+    upload_max_video_bytes : int = 1024 * 1024 * 1024
+    upload_max_image_pixels : int = 50_000_000
+    upload_max_video_pixels : int = 3840 * 2160
+    upload_max_video_seconds : float = 900
+    # comma separated ffprobe codec names
+    upload_video_codecs : str = "h264,hevc,mpeg4,vp8,vp9,av1"
+
+    @property
+    def video_codecs(self) -> set[str]:
+        return {codec.strip() for codec in self.upload_video_codecs.split(",") if codec.strip()}
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+class Faces(BaseSettings):
+    # cosine similarity above which two identity embeddings are taken for the same person
+    face_match_similarity : float = 0.92
+    # "report" notifies the owners of matching posts, "reject" also refuses the upload
+    face_match_action : str = "report"
+    # the index scans every embedding up to this size, then only the nprobe nearest IVF lists
+    face_index_ivf_threshold : int = 50_000
+    face_index_nprobe : int = 8
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+class DMMFilter(BaseSettings):
+    # Bloom filter in front of the dmm lookups of the upload checks
+    dmm_filter_enabled : bool = True
+    # shared by the workers of a node, in the temp directory by default
+    dmm_filter_path : str = ""
+    # keys the filter is sized for at least (three per dmm row), and its false positive rate
+    dmm_filter_capacity : int = 3_000_000
+    dmm_filter_error_rate : float = 0.001
+    dmm_filter_rebuild_seconds : float = 600
+    dmm_filter_poll_seconds : float = 5
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+class ResponseCache(BaseSettings):
+    # per worker cache of the public read endpoints, invalidated by the writes of the same worker
+    response_cache_enabled : bool = True
+    # bounds how long another worker's write can go unseen
+    response_cache_ttl_seconds : float = 5
+    response_cache_max_entries : int = 10_000
+
     class Config:
         env_file = ".env"
         extra = "ignore"
@@ -40,6 +154,13 @@ master = Master()
 database = Database()
 jwtsettings = JWT()
 cloudinary_settings = CLOUDINARY()
+activity_settings = Activity()
+storage_settings = Storage()
+admission_settings = Admission()
+upload_settings = Upload()
+face_settings = Faces()
+dmm_filter_settings = DMMFilter()
+response_cache_settings = ResponseCache()
 
 
 
@@ -1,7 +1,8 @@
-from fastapi import APIRouter,Depends
+import asyncio
+from fastapi import APIRouter,Depends,WebSocket,WebSocketDisconnect,status
 
 from dependencies import db as database, token
-from services import activity
+from services import activity,events
 
 router = APIRouter(
     prefix="/activity",
@@ -18,5 +19,54 @@ async def get_activities(
     #verify token
     curr_user = await token.verify_token(db,access_token)
 
-    return await activity.get_acivities(db, curr_user.username, page, limit)
+    return await activity.get_acivities(db, curr_user, page, limit)
 
+
+#number of activities since the first page was last read
+
+@router.get("/unread")
+async def get_unread_count(
+    db: database.SessionDep,
+    access_token: str = Depends(token.oauth2_bearer)
+):
+    #verify token
+    curr_user = await token.verify_token(db, access_token)
+
+    return {"unread": curr_user.unread_activity_count}
+
+
+
+#push new activities as they are written, instead of polling /activity/
+
+@router.websocket("/ws")
+async def activity_stream(
+    websocket: WebSocket,
+    db: database.SessionDep,
+    access_token: str
+):
+    #verify token
+    curr_user, detail = await token.get_current_user(db, access_token)
+    if not curr_user:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=detail)
+        return
+    user_id, username = curr_user.user_id, curr_user.username
+    #the session is not needed anymore, give its connection back to the pool
+    await db.close()
+
+    await websocket.accept()
+    async with events.broker.subscription(user_id) as queue:
+
+        async def forward():
+            while True:
+                event = await queue.get()
+                await websocket.send_json({**event, "receiver_name": username})
+
+        sender = asyncio.create_task(forward())
+        try:
+            #clients only ever send pings, a disconnect ends the stream
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
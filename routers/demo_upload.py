@@ -5,7 +5,8 @@ from hashing import Hash
 from encryption import Encrypt,Decrypt
 from video_module import metadata as VideoMetadata,watermark,analyze
 from image_module import metadata as ImageMetadata
-from services import upload
+from services import upload,preflight
+from dependencies import admission
 
 router = APIRouter(
     tags=["demo uploads"]
@@ -18,8 +19,9 @@ async def demo(media: UploadFile = File(...)):
         "bmetadata":bmeta,
     }
 
-@router.post('/video-demo-watermark')
+@router.post('/video-demo-watermark', dependencies=[admission.MediaJob])
 async def demo(media: UploadFile = File(...)):
+    await preflight.check(media, expected="video")
     bmeta = await watermark.extract_watermark(media)
     return {
         "bmetadata":bmeta,
@@ -32,7 +34,7 @@ async def demo(media: UploadFile = File(...)):
         "bmetadata":bmeta,
     }
 
-@router.post('/video-cloudinary')
+@router.post('/video-cloudinary', dependencies=[admission.MediaJob])
 async def video_demo(media: UploadFile = File(...)):
    new_media = await VideoMetadata.append_metadata(media,{
         "copyright":f'deepmark'                                 
@@ -46,7 +48,8 @@ async def image_demo(media: UploadFile = File(...)):
     })
    await upload.upload_file("demo","deepamrksncsnjsnvosnvosnvosnnvksnvlksnvlknlksnc",new_media)
 
-@router.post('/video-analyze')
+@router.post('/video-analyze', dependencies=[admission.MediaJob])
 async def demo(media: UploadFile = File(...)):
-    hash = await analyze.analyze_video_face_recognition(media)
+    checked = await preflight.check(media, expected="video")
+    hash = await analyze.analyze_video_face_recognition(media, checked.frame_skip)
     return hash
\ No newline at end of file
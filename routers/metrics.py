@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+import metrics
+
+router = APIRouter(
+    tags=["metrics"]
+)
+
+
+#prometheus scrape endpoint, only mounted when METRICS_ENABLED is set
+@router.get("/metrics", include_in_schema=False)
+async def scrape():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -1,19 +1,21 @@
-from fastapi import APIRouter,HTTPException,status,UploadFile,File,Form,Depends
+from fastapi import APIRouter,HTTPException,status,UploadFile,File,Form,Depends,Request
 from typing import Optional
 
 from models import dtos
-from dependencies import db as database , token 
-from services import post,auth
+from dependencies import db as database , token , admission , streaming
+from services import post,auth,response_cache
 
+#uploads are hashed while they are received
 router = APIRouter(
     prefix="/posts",
-    tags=["posts"]
+    tags=["posts"],
+    route_class=streaming.DigestRoute
 )
 
 
 #create post
 
-@router.post("/",response_model=dtos.Post, status_code=status.HTTP_201_CREATED)
+@router.post("/",response_model=dtos.Post, status_code=status.HTTP_201_CREATED, dependencies=[admission.MediaJob])
 async def create_post(
     db: database.SessionDep,
     media: UploadFile = File(...),
@@ -52,15 +54,21 @@ async def get_current_user_posts(
 @router.get("/user/{username}", response_model=list[dtos.Post])
 async def get_user_post(
     username: str,
+    request: Request,
     db: database.SessionDep,
     access_token: str = Depends(token.oauth2_bearer)
 ):
     #verify token
     curr_user = await token.verify_token(db, access_token)
 
-    user = await auth.existing_user(db, username, "")
+    async def load(db):
+        user = await auth.existing_user(db, username, "")
+        if not user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="user not found")
+        posts = await post.get_user_post(db, user.user_id)
+        return posts, [response_cache.user_tag(user.user_id), *(response_cache.post_tag(p.id) for p in posts)]
 
-    return await post.get_user_post(db, user.user_id)
+    return await response_cache.respond(request, "user_posts", username, load, list[dtos.Post])
 
 
 #get posts according to hashtag
@@ -68,13 +76,18 @@ async def get_user_post(
 @router.get("/hastag/{hashtag}")
 async def get_post_from_hashtag(
     hashtag: str,
+    request: Request,
     db: database.SessionDep,
     access_token: str = Depends(token.oauth2_bearer)
 ):
     #verify token
     curr_user = await token.verify_token(db, access_token)
 
-    return await post.get_posts_from_hashtags(db, hashtag)
+    async def load(db):
+        posts = await post.get_posts_from_hashtags(db, hashtag)
+        return posts, [response_cache.hashtag_tag(hashtag), *(response_cache.post_tag(p.id) for p in posts or [])]
+
+    return await response_cache.respond(request, "hashtag", hashtag, load)
 
 
 #get posts for feed
@@ -147,13 +160,18 @@ async def like_post(
 @router.get("/likes/{post_id}", response_model=list[dtos.ProfileUserSchema])
 async def users_like_post(
     post_id: int,
+    request: Request,
     db: database.SessionDep,
     access_token: str = Depends(token.oauth2_bearer)
 ):
    #verify token
    curr_user = await token.verify_token(db, access_token)
 
-   return await post.liked_user_post(db, post_id)
+   async def load(db):
+       users = await post.liked_user_post(db, post_id)
+       return users, [response_cache.post_tag(post_id), *(response_cache.user_tag(u.user_id) for u in users)]
+
+   return await response_cache.respond(request, "likes", str(post_id), load, list[dtos.ProfileUserSchema])
 
 
 #get post
@@ -161,17 +179,20 @@ async def users_like_post(
 @router.get("/{post_id}",response_model=dtos.Post)
 async def get_post(
     post_id: int,
+    request: Request,
     db: database.SessionDep,
     access_token: str = Depends(token.oauth2_bearer)
 ):
     #verify token
    curr_user = await token.verify_token(db, access_token) 
 
-   db_post= await post.get_post_from_post_id(db, post_id)
-   if not db_post:
-       raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=" invalid post id")
-   
-   return db_post 
+   async def load(db):
+       db_post= await post.get_post_from_post_id(db, post_id)
+       if not db_post:
+           raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=" invalid post id")
+       return db_post, [response_cache.post_tag(post_id)]
+
+   return await response_cache.respond(request, "post", str(post_id), load, dtos.Post)
 
 
 
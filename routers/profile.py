@@ -1,8 +1,8 @@
-from fastapi import APIRouter,status,HTTPException,Depends
+from fastapi import APIRouter,status,HTTPException,Depends,Request
 
 from dependencies import db as database, token
 from models import dtos
-from services import profile , auth
+from services import profile , auth , response_cache
 
 router = APIRouter(
     prefix="/profile",
@@ -23,14 +23,17 @@ async def get_profile(access_token: str, db: database.SessionDep):
 #get user profile
 
 @router.post("/user",response_model=dtos.Profile)
-async def get_user_profile(access_token: str, username:str, db: database.SessionDep):
+async def get_user_profile(access_token: str, username:str, request: Request, db: database.SessionDep):
     #verify token
     curr_user = await token.verify_token(db, access_token)
 
-    db_user = await auth.existing_user(db, username, "")
-    profile = dtos.Profile.from_orm(db_user)
+    async def load(db):
+        db_user = await auth.existing_user(db, username, "")
+        if not db_user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="user not found")
+        return db_user, [response_cache.user_tag(db_user.user_id)]
 
-    return profile
+    return await response_cache.respond(request, "profile", username, load, dtos.Profile)
 
 #follow user 
 
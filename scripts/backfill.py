@@ -0,0 +1,312 @@
+"""
+Recomputes the fingerprint (dmm.hash_value) of existing posts, for a new
+analysis algorithm or for posts that never got one (images, old uploads).
+
+Posts are walked in id order with keyset pagination. Media is fetched from
+storage with bounded concurrency into a work directory and analyzed in a
+pool of low-priority worker processes; every batch is written in one
+transaction and then checkpointed, so an interrupted run resumes after the
+last written batch.
+
+    python -m scripts.backfill                                # every post, resumes from the checkpoint
+    python -m scripts.backfill --media-type image --missing-only
+    python -m scripts.backfill --workers 2 --rate 5 --max-load 0.7 --restart
+    python -m scripts.backfill --dry-run --limit 200
+
+Posts without a dmm row get a new one. Its dmm_id is not the one embedded in
+the media, so only the fingerprint check applies to those posts; the
+metadata and watermark checks need the original upload. A fingerprint that
+another post already holds is reported as a duplicate and left unwritten.
+Media without faces has no fingerprint: an existing row's hash_value is
+cleared, and no row is added for it.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import bindparam, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import engine
+from hashing import Hash
+from image_module import analyze as image_analyze
+from models import schemas
+from services.storage import StorageNotFound, backend
+from video_module import analyze as video_analyze
+
+logger = logging.getLogger("backfill")
+
+ANALYZERS = {
+    "image": image_analyze.fingerprint,
+    "video": video_analyze.fingerprint,
+}
+# added to the workers' niceness so live requests win the CPU
+WORKER_NICENESS = 10
+# what fingerprint() returns for a post it could not fetch or analyze; None means no faces
+FAILED = object()
+
+dmm = schemas.DMM.__table__
+
+
+@dataclass
+class Checkpoint:
+    # every post with an id up to `after` has been written
+    after: int = 0
+    processed: int = 0
+    updated: int = 0
+    inserted: int = 0
+    unchanged: int = 0
+    duplicates: list[int] = field(default_factory=list)
+    failed: list[int] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: str) -> "Checkpoint":
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    def save(self, path: str):
+        # written next to the old one and renamed, so a crash never leaves half a checkpoint
+        temp = f"{path}.tmp"
+        with open(temp, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+        os.replace(temp, path)
+
+
+@dataclass
+class Row:
+    post_id: int
+    media_url: str
+    media_type: str
+    username: str
+    dmm_id: Optional[str]
+    hash_value: Optional[str]
+
+
+class Throttle:
+    """Spaces work out to `rate` items per second and waits while the host is busier than `max_load`."""
+
+    def __init__(self, rate: float, max_load: float):
+        self.interval = 1 / rate if rate else 0
+        self.max_load = max_load
+        self.next_start = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            while self.max_load and os.getloadavg()[0] / (os.cpu_count() or 1) > self.max_load:
+                await asyncio.sleep(5)
+            delay = self.next_start - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start = max(self.next_start, time.monotonic()) + self.interval
+
+
+# reading
+
+async def next_batch(session: AsyncSession, after: int, args) -> list[Row]:
+    query = (
+        select(
+            schemas.Post.id, schemas.Post.media_url, schemas.Post.media_type,
+            schemas.User.username, schemas.DMM.dmm_id, schemas.DMM.hash_value,
+        )
+        .join(schemas.User, schemas.User.user_id == schemas.Post.user_id)
+        .outerjoin(schemas.DMM, schemas.DMM.video_id == schemas.Post.id)
+        .where(schemas.Post.id > after)
+        .order_by(schemas.Post.id)
+        .limit(args.batch_size)
+    )
+    if args.media_type != "all":
+        query = query.where(schemas.Post.media_type == args.media_type)
+    if args.missing_only:
+        query = query.where(or_(schemas.DMM.dmm_id.is_(None), schemas.DMM.hash_value.is_(None)))
+    result = await session.execute(query)
+    return [Row(*row) for row in result.all()]
+
+
+# fingerprinting
+
+async def fingerprint(row: Row, pool, downloads: asyncio.Semaphore, throttle: Throttle, workdir: str):
+    await throttle.wait()
+    path = os.path.join(workdir, str(row.post_id))
+    try:
+        async with downloads:
+            with open(path, "wb") as f:
+                await backend.download(f"deepmark/{row.username}", row.media_url, row.media_type, f)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, ANALYZERS[row.media_type], path)
+    except StorageNotFound:
+        logger.warning("post %d: %s is not in storage", row.post_id, row.media_url)
+        return FAILED
+    except Exception:
+        logger.warning("post %d: could not fingerprint %s", row.post_id, row.media_url, exc_info=True)
+        return FAILED
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# writing
+
+async def write_batch(
+    session: AsyncSession, rows: list[Row], hashes: dict[int, Optional[str]], checkpoint: Checkpoint, dry_run: bool
+):
+    """
+    Updates changed fingerprints in place and inserts missing ones, skipping
+    duplicates, in one transaction. A None in `hashes` is media without faces.
+    """
+    # the same fingerprint on another post, or twice in this batch
+    result = await session.execute(
+        select(dmm.c.hash_value, dmm.c.video_id).where(dmm.c.hash_value.in_({h for h in hashes.values() if h}))
+    )
+    owners = dict(result.all())
+    updates, inserts = [], []
+    for row in rows:
+        if row.post_id not in hashes:
+            continue
+        hash_value = hashes[row.post_id]
+        if row.hash_value == hash_value or (hash_value is None and row.dmm_id is None):
+            checkpoint.unchanged += 1
+            continue
+        if hash_value is not None and owners.setdefault(hash_value, row.post_id) != row.post_id:
+            checkpoint.duplicates.append(row.post_id)
+            continue
+        if row.dmm_id is not None:
+            updates.append({"b_dmm_id": row.dmm_id, "b_hash_value": hash_value})
+        else:
+            inserts.append({
+                "dmm_id": await Hash.uuid(),
+                "video_id": row.post_id,
+                "hash_value": hash_value,
+                "created_at": datetime.now(timezone.utc),
+            })
+
+    if dry_run or not (updates or inserts):
+        checkpoint.updated += len(updates)
+        checkpoint.inserted += len(inserts)
+        return
+
+    try:
+        await write_rows(session, updates, inserts)
+        await session.commit()
+    except IntegrityError:
+        # a live upload took one of the fingerprints meanwhile; write row by row
+        await session.rollback()
+        updates, inserts = await write_one_by_one(session, updates, inserts, checkpoint)
+        await session.commit()
+    checkpoint.updated += len(updates)
+    checkpoint.inserted += len(inserts)
+
+
+async def write_rows(session: AsyncSession, updates: list[dict], inserts: list[dict]):
+    if updates:
+        await session.execute(
+            update(dmm).where(dmm.c.dmm_id == bindparam("b_dmm_id")).values(hash_value=bindparam("b_hash_value")),
+            updates,
+        )
+    if inserts:
+        await session.execute(insert(dmm), inserts)
+
+
+async def write_one_by_one(session: AsyncSession, updates: list[dict], inserts: list[dict], checkpoint: Checkpoint):
+    written = ([], [])
+    for rows, kind in ((updates, 0), (inserts, 1)):
+        for row in rows:
+            try:
+                async with session.begin_nested():
+                    await write_rows(session, [row] if kind == 0 else [], [row] if kind == 1 else [])
+                written[kind].append(row)
+            except IntegrityError:
+                # updates carry no post id, look it up for the report
+                post_id = row.get("video_id") or await session.scalar(
+                    select(dmm.c.video_id).where(dmm.c.dmm_id == row["b_dmm_id"])
+                )
+                checkpoint.duplicates.append(post_id)
+    return written
+
+
+# main loop
+
+async def run(args) -> int:
+    checkpoint = Checkpoint()
+    if os.path.exists(args.checkpoint) and not args.restart:
+        checkpoint = Checkpoint.load(args.checkpoint)
+        logger.info("resuming after post %d", checkpoint.after)
+
+    pool = concurrent.futures.ProcessPoolExecutor(
+        args.workers, mp_context=multiprocessing.get_context("spawn"),
+        initializer=os.nice, initargs=(WORKER_NICENESS,),
+    )
+    downloads = asyncio.Semaphore(args.downloads)
+    throttle = Throttle(args.rate, args.max_load)
+    start = time.monotonic()
+    try:
+        with tempfile.TemporaryDirectory(prefix="deepmark-backfill-") as workdir:
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                while not args.limit or checkpoint.processed < args.limit:
+                    rows = await next_batch(session, checkpoint.after, args)
+                    # a post with several dmm rows shows up once per row
+                    rows = list({row.post_id: row for row in rows}.values())
+                    if args.limit:
+                        rows = rows[:args.limit - checkpoint.processed]
+                    if not rows:
+                        break
+                    # the read transaction is not held open while the media is analyzed
+                    await session.rollback()
+
+                    results = await asyncio.gather(*(
+                        fingerprint(row, pool, downloads, throttle, workdir) for row in rows
+                    ))
+                    hashes = {row.post_id: h for row, h in zip(rows, results) if h is not FAILED}
+                    checkpoint.failed.extend(row.post_id for row, h in zip(rows, results) if h is FAILED)
+
+                    await write_batch(session, rows, hashes, checkpoint, args.dry_run)
+                    checkpoint.after = rows[-1].post_id
+                    checkpoint.processed += len(rows)
+                    if not args.dry_run:
+                        checkpoint.save(args.checkpoint)
+                    logger.info(
+                        "after post %d: %d processed (%.1f/s), %d updated, %d inserted, %d unchanged, %d duplicates, %d failed",
+                        checkpoint.after, checkpoint.processed, checkpoint.processed / (time.monotonic() - start),
+                        checkpoint.updated, checkpoint.inserted, checkpoint.unchanged,
+                        len(checkpoint.duplicates), len(checkpoint.failed),
+                    )
+                    if args.pause:
+                        await asyncio.sleep(args.pause)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        await engine.dispose()
+
+    print(json.dumps(asdict(checkpoint), indent=2))
+    return 1 if checkpoint.failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--media-type", choices=["all", "image", "video"], default="all")
+    parser.add_argument("--missing-only", action="store_true", help="only posts without a fingerprint")
+    parser.add_argument("--batch-size", type=int, default=50, help="posts per page and per write transaction")
+    parser.add_argument("--workers", type=int, default=max((os.cpu_count() or 2) // 2, 1), help="analysis processes")
+    parser.add_argument("--downloads", type=int, default=4, help="concurrent storage downloads")
+    parser.add_argument("--rate", type=float, default=0, help="posts started per second, 0 for no limit")
+    parser.add_argument("--max-load", type=float, default=0,
+                        help="pause while the 1 minute load average per core is above this, 0 to ignore")
+    parser.add_argument("--pause", type=float, default=0, help="seconds to sleep between batches")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many posts")
+    parser.add_argument("--checkpoint", default="backfill.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first post")
+    parser.add_argument("--dry-run", action="store_true", help="compute and report, write nothing")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s %(message)s")
+    sys.exit(asyncio.run(run(args)))
@@ -1,18 +1,266 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
 from sqlmodel import select,desc
+from sqlalchemy import insert,update,bindparam,event
+from sqlalchemy.orm import Session,aliased
 
-from models import dtos,schemas
+from models import schemas,security
 from dependencies.db import SessionDep
+from database import engine
+from . import events
 
-#get activity of user 
+logger = logging.getLogger(__name__)
+
+LIKE = "like"
+FOLLOW = "follow"
+DETECTION = "detection"
+
+# session.info key of the activities recorded in the session's open transaction
+PENDING = "pending_activities"
+
+
+class ActivityWriter:
+    """
+    Buffers activity rows and writes them with one multi-row INSERT per flush,
+    outside of the request transaction, every flush interval or as soon as
+    `max_batch` rows are waiting. The receivers' unread counters are bumped
+    in the same transaction as the insert.
+
+    Rows still buffered when the process dies are lost; `stop` flushes them
+    on a clean shutdown. Written rows are published to `events.broker` for
+    the push channel.
+    """
+
+    def __init__(self, flush_interval_ms: int, max_batch: int):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        self._full.set()
+        await self._task
+        self._task = None
+
+    def enqueue(self, row: dict, details: dict):
+        """`row` is the activities row, `details` what readers would join in."""
+        self.start()
+        self._queue.put_nowait((row, details))
+        # the writer holds the first row of a batch while it waits for the rest
+        if self._queue.qsize() + 1 >= self.max_batch:
+            self._full.set()
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _run(self):
+        closing = False
+        while not closing:
+            row = await self._queue.get()
+            if row is None:
+                break
+            # let the batch fill up for one interval, or until it is full, then write all of it
+            self._full.clear()
+            if self._queue.qsize() + 1 < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            items = [row]
+            while len(items) < self.max_batch and not self._queue.empty():
+                row = self._queue.get_nowait()
+                if row is None:
+                    closing = True
+                    break
+                items.append(row)
+            await self._flush(items)
+
+    async def _flush(self, items: list[tuple[dict, dict]]):
+        rows = [row for row, _ in items]
+        unread = Counter(row["receiver_id"] for row in rows)
+        activities = schemas.Activity.__table__
+        users = schemas.User.__table__
+        try:
+            async with engine.begin() as conn:
+                result = await conn.execute(insert(activities).values(rows).returning(activities.c.id))
+                ids = result.scalars().all()
+                await conn.execute(
+                    update(users)
+                    .where(users.c.user_id == bindparam("receiver"))
+                    .values(unread_activity_count=users.c.unread_activity_count + bindparam("count")),
+                    [{"receiver": receiver, "count": unread[receiver]} for receiver in sorted(unread)],
+                )
+        except Exception:
+            # the writer keeps running for the rows still queued
+            logger.exception("failed to write %d activities", len(rows))
+            return
+
+        try:
+            await events.broker.publish([
+                {
+                    "receiver_id": row["receiver_id"],
+                    "event": activity_response({**row, "id": activity_id}, None, **details),
+                }
+                for activity_id, (row, details) in zip(ids, items)
+            ])
+        except Exception:
+            logger.exception("failed to publish %d activities", len(rows))
+
+
+writer = ActivityWriter(
+    security.activity_settings.activity_flush_interval_ms,
+    security.activity_settings.activity_max_batch,
+)
+
+
+#record activities
+
+def record(
+    db: SessionDep,
+    kind: str,
+    receiver_id: int,
+    sender: schemas.User,
+    post: Optional[schemas.Post] = None,
+):
+    """
+    Queues an activity once the session's current transaction commits, so a
+    rolled back like or follow never notifies anyone. The values are read
+    now, before the commit expires the objects.
+    """
+    session = db.sync_session
+    #the activity belongs to the transaction that is open now; begin it if the session has not yet
+    if not session.in_transaction():
+        session.begin()
+    row = {
+        "kind": kind,
+        "receiver_id": receiver_id,
+        "sender_id": sender.user_id,
+        "post_id": post.id if post else None,
+        "created_at": datetime.now(timezone.utc),
+    }
+    details = {
+        "sender_name": sender.username,
+        "sender_picture": sender.profile_picture,
+        "media_url": post.media_url if post else None,
+        "media_type": post.media_type if post else None,
+    }
+    session.info.setdefault(PENDING, []).append((row, details))
+
+
+@event.listens_for(Session, "after_commit")
+def _enqueue_committed(session):
+    for row, details in session.info.pop(PENDING, ()):
+        writer.enqueue(row, details)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back(session, previous_transaction):
+    #a savepoint rolling back leaves the outer transaction open, its activities are kept
+    if previous_transaction.parent is None:
+        session.info.pop(PENDING, None)
+
+
+def record_like(db: SessionDep, post: schemas.Post, sender: schemas.User):
+    record(db, LIKE, post.user_id, sender, post)
+
+def record_follow(db: SessionDep, receiver_id: int, sender: schemas.User):
+    record(db, FOLLOW, receiver_id, sender)
+
+def record_detection(db: SessionDep, post: schemas.Post, sender: schemas.User):
+    record(db, DETECTION, post.user_id, sender, post)
+
+
+#get activity of user
 
 async def get_acivities(
-    db: SessionDep, username: str, page: int=1, limit: int=5
-) -> list[schemas.Activity] :
+    db: SessionDep, user: schemas.User, page: int=1, limit: int=5
+) -> list[dict] :
    offset = (page - 1) * limit
+   sender = aliased(schemas.User)
+   #read before the commit below expires the user
+   user_id, username = user.user_id, user.username
 
-   query = select(schemas.Activity).where(schemas.Activity.receiver_name == username).order_by(desc(schemas.Activity.created_at))
+   #the first page marks everything as read. The counter is reset before the page is read: an
+   #increment commits with its rows, so every activity counted before the reset is visible to
+   #the page query, and every one counted after it stays unread
+   if page == 1:
+       users = schemas.User.__table__
+       await db.execute(
+           update(users)
+           .where(users.c.user_id == user_id, users.c.unread_activity_count > 0)
+           .values(unread_activity_count=0)
+       )
+       await db.commit()
+
+   query = (
+       select(
+           schemas.Activity.id, schemas.Activity.kind, schemas.Activity.post_id, schemas.Activity.created_at,
+           sender.username, sender.profile_picture, schemas.Post.media_url, schemas.Post.media_type
+       )
+       .join(sender, sender.user_id == schemas.Activity.sender_id)
+       .outerjoin(schemas.Post, schemas.Post.id == schemas.Activity.post_id)
+       .where(schemas.Activity.receiver_id == user_id)
+       .order_by(desc(schemas.Activity.created_at))
+   )
    result = await db.execute(query.offset(offset).limit(limit))
 
-   activities = result.scalars().all()
+   activities = [
+       activity_response(row, username, row.username, row.profile_picture, row.media_url, row.media_type)
+       for row in result.mappings().all()
+   ]
+
+   return activities
+
 
-   return activities
\ No newline at end of file
+def activity_response(
+    activity,
+    receiver_name: Optional[str],
+    sender_name: str,
+    sender_picture: str,
+    media_url: Optional[str],
+    media_type: Optional[str],
+) -> dict:
+    """Shapes an activity (id, kind, post_id, created_at) the way the activity feed has always returned it."""
+    kind = activity["kind"]
+    response = {
+        "id": activity["id"],
+        "kind": kind,
+        "receiver_name": receiver_name,
+        "sender_name": sender_name,
+        "created_at": activity["created_at"],
+        "media_type": media_type,
+        "liked_post_id": None,
+        "liked_post_url": "",
+        "liked_user_profile_picture": "",
+        "followed_profile_picture": "",
+        "detected_post_id": None,
+        "detected_post_url": "",
+        "detected_user_profile_picture": "",
+    }
+    if kind == LIKE:
+        response.update(
+            liked_post_id=activity["post_id"],
+            liked_post_url=media_url,
+            liked_user_profile_picture=sender_picture,
+        )
+    elif kind == FOLLOW:
+        response.update(followed_profile_picture=sender_picture)
+    elif kind == DETECTION:
+        response.update(
+            detected_post_id=activity["post_id"],
+            detected_post_url=media_url,
+            detected_user_profile_picture=sender_picture,
+        )
+    return response
@@ -5,7 +5,7 @@ from models import schemas,dtos
 from hashing import Hash
 from encryption import Encrypt
 from dependencies.db import SessionDep
-from . import upload
+from . import upload,response_cache
 
 #check for existing user
 
@@ -49,7 +49,9 @@ async def update_user(db: SessionDep, db_user: dtos.UserDtos, user_update: dtos.
     db_user.bio = user_update.get("bio") or db_user.bio
     db_user.name = user_update.get("name") or db_user.name
     if user_update.get("profile_picture"):
-        profile_pic_url =  await upload.upload_file(db_user.username, user_update.profile_picture)
+        profile_pic_url =  await upload.upload_file(db_user.username, "", user_update["profile_picture"])
         db_user.profile_picture = profile_pic_url
 
+    tag = response_cache.user_tag(db_user.user_id)
     await db.commit()
+    response_cache.invalidate(tag)
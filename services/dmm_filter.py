@@ -0,0 +1,275 @@
+"""
+Bloom filter over the keys the upload checks look up in the dmm table:
+hash_value and content_digest. Most uploads are original, so most of those
+lookups find nothing; a negative answer from the filter skips the query. The
+dmm ids read from metadata and watermarks are not in it: media carrying one
+nearly always has a row, and a row another node wrote within the last poll
+interval must not be missed.
+
+The filter is a memory-mapped file shared by every worker of a node. One
+worker at a time, under a file lock, rebuilds it from the table every
+DMM_FILTER_REBUILD_SECONDS into a new file and renames it over the old one;
+the others remap it on their next poll. Between rebuilds each worker adds the
+rows it commits right away, and polls the table every DMM_FILTER_POLL_SECONDS
+for rows created since the build, by any node. A row written on another node
+can go unseen for one poll interval, the unique hash_value constraint still
+guards the insert. Until a filter is mapped every lookup goes to the database.
+"""
+import asyncio
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import metrics
+from models import schemas, security
+
+logger = logging.getLogger(__name__)
+
+settings = security.dmm_filter_settings
+
+MAGIC = b"DMMBLOOM"
+VERSION = 1
+# magic, version, hash functions, bits, keys added, unix time the table was read at
+HEADER = struct.Struct("<8sIIQQd")
+MASK64 = (1 << 64) - 1
+# rows created this long before a poll are fetched again, for commit lag and clock skew between nodes
+POLL_OVERLAP = timedelta(seconds=60)
+LOAD_BATCH = 50_000
+
+
+def key(kind: str, value: str) -> bytes:
+    return f"{kind}:{value}".encode()
+
+
+def row_keys(dmm_id: str, hash_value: Optional[str], content_digest: Optional[str]) -> list[bytes]:
+    keys = []
+    if hash_value:
+        keys.append(key("hash", hash_value))
+    if content_digest:
+        keys.append(key("digest", content_digest))
+    return keys
+
+
+def _hashes(keys: Iterable[bytes]) -> tuple[np.ndarray, np.ndarray]:
+    pairs = [struct.unpack("<QQ", hashlib.blake2b(k, digest_size=16).digest()) for k in keys]
+    pairs = np.array(pairs, dtype=np.uint64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _positions(keys: list[bytes], hashes: int, bits: int) -> np.ndarray:
+    """(keys, hashes) bit positions by double hashing, wrapping at 64 bits."""
+    h1, h2 = _hashes(keys)
+    steps = np.arange(hashes, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(bits)
+
+
+class BloomFilter:
+    def __init__(self, path: str):
+        self.file = open(path, "r+b")
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version, self.hashes, self.bits, _, self.built_from = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} DMM filter")
+
+    @staticmethod
+    def size_for(keys: int, error_rate: float) -> tuple[int, int]:
+        """Bits and hash functions for `keys` keys at `error_rate` false positives."""
+        bits = max(int(-keys * math.log(error_rate) / math.log(2) ** 2), 64)
+        bits = -(-bits // 8) * 8
+        return bits, max(round(bits / keys * math.log(2)), 1)
+
+    @classmethod
+    def create(cls, path: str, keys: list[bytes], capacity: int, error_rate: float, built_from: float):
+        """Writes a filter holding `keys` next to `path` and renames it over it. Blocking."""
+        bits, hashes = cls.size_for(max(capacity, 2 * len(keys), 1), error_rate)
+        flags = np.zeros(bits, dtype=bool)
+        for start in range(0, len(keys), LOAD_BATCH):
+            flags[_positions(keys[start:start + LOAD_BATCH], hashes, bits).ravel()] = True
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, hashes, bits, len(keys), built_from))
+            f.write(np.packbits(flags, bitorder="little").tobytes())
+        os.replace(temp, path)
+
+    def __contains__(self, k: bytes) -> bool:
+        h1, h2 = struct.unpack("<QQ", hashlib.blake2b(k, digest_size=16).digest())
+        for i in range(self.hashes):
+            position = ((h1 + i * h2) & MASK64) % self.bits
+            if not self.map[HEADER.size + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, keys: list[bytes]):
+        if not keys:
+            return
+        positions = _positions(keys, self.hashes, self.bits).ravel()
+        # bits of one byte may be set by several processes, the read-modify-write happens under a lock
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        try:
+            for position in positions.tolist():
+                offset = HEADER.size + (position >> 3)
+                self.map[offset] |= 1 << (position & 7)
+        finally:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+_filter: Optional[BloomFilter] = None
+# rows created from here on are fetched by the next poll
+_since: Optional[datetime] = None
+_refresh_lock = asyncio.Lock()
+_poller: Optional[asyncio.Task] = None
+
+
+def path() -> str:
+    return settings.dmm_filter_path or os.path.join(tempfile.gettempdir(), "deepmark-dmm.bloom")
+
+
+def might_exist(kind: str, value: Optional[str]) -> bool:
+    """False only when no dmm row has `value` as its `kind` ("hash" or "digest") key."""
+    if value is None:
+        return False
+    if _filter is None:
+        return True
+    found = key(kind, value) in _filter
+    if metrics.enabled:
+        metrics.dmm_filter_lookups.inc(1, kind, "maybe" if found else "absent")
+    return found
+
+
+def add(dmm_id: str, hash_value: Optional[str], content_digest: Optional[str] = None):
+    """Adds a committed row, so the workers of this node see it before their next poll."""
+    if _filter is not None:
+        _filter.add(row_keys(dmm_id, hash_value, content_digest))
+
+
+async def refresh(db: AsyncSession):
+    """Rebuilds the filter when it is missing or stale, remaps it when another worker did, and polls new rows."""
+    global _filter, _since
+    async with _refresh_lock:
+        await _rebuild_if_stale(db)
+        try:
+            inode = os.stat(path()).st_ino
+        except FileNotFoundError:
+            return
+        if _filter is None or _filter.inode != inode:
+            mapped = await asyncio.to_thread(BloomFilter, path())
+            if _filter is not None:
+                _filter.close()
+            _filter = mapped
+            _since = datetime.fromtimestamp(mapped.built_from, timezone.utc) - POLL_OVERLAP
+
+        polled_at = datetime.now(timezone.utc)
+        result = await db.execute(
+            select(schemas.DMM.dmm_id, schemas.DMM.hash_value, schemas.DMM.content_digest)
+            .where(schemas.DMM.created_at >= _since)
+        )
+        keys = [k for row in result.all() for k in row_keys(*row)]
+        await db.rollback()
+        await asyncio.to_thread(_filter.add, keys)
+        _since = polled_at - POLL_OVERLAP
+
+
+async def _rebuild_if_stale(db: AsyncSession):
+    if _filter is not None and time.time() - _filter.built_from < settings.dmm_filter_rebuild_seconds:
+        return
+    # one worker of the node rebuilds, the others keep the filter they have
+    with open(f"{path()}.lock", "a") as lock:
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        try:
+            header = _read_header(path())
+            if header is not None and time.time() - header[5] < settings.dmm_filter_rebuild_seconds:
+                return
+            start = time.perf_counter()
+            built_from = time.time()
+            keys = await _load_keys(db)
+            await asyncio.to_thread(
+                BloomFilter.create, path(), keys, settings.dmm_filter_capacity, settings.dmm_filter_error_rate, built_from
+            )
+            logger.info("dmm filter rebuilt with %d keys in %.1fs", len(keys), time.perf_counter() - start)
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+async def _load_keys(db: AsyncSession) -> list[bytes]:
+    keys, after = [], ""
+    while True:
+        result = await db.execute(
+            select(schemas.DMM.dmm_id, schemas.DMM.hash_value, schemas.DMM.content_digest)
+            .where(schemas.DMM.dmm_id > after)
+            .order_by(schemas.DMM.dmm_id)
+            .limit(LOAD_BATCH)
+        )
+        rows = result.all()
+        if not rows:
+            break
+        keys.extend(k for row in rows for k in row_keys(*row))
+        after = rows[-1].dmm_id
+    await db.rollback()
+    return keys
+
+
+def _read_header(filter_path: str) -> Optional[tuple]:
+    try:
+        with open(filter_path, "rb") as f:
+            header = HEADER.unpack(f.read(HEADER.size))
+    except (FileNotFoundError, struct.error):
+        return None
+    return header if header[0] == MAGIC and header[1] == VERSION else None
+
+
+async def _poll():
+    from database import engine
+
+    while True:
+        await asyncio.sleep(settings.dmm_filter_poll_seconds)
+        try:
+            async with AsyncSession(engine) as db:
+                await refresh(db)
+        except Exception:
+            logger.exception("dmm filter refresh failed")
+
+
+async def startup():
+    global _poller
+    if not settings.dmm_filter_enabled:
+        return
+    from database import engine
+
+    try:
+        async with AsyncSession(engine) as db:
+            await refresh(db)
+    except Exception:
+        logger.exception("dmm filter could not be loaded, lookups go to the database")
+    _poller = asyncio.create_task(_poll())
+
+
+async def shutdown():
+    global _filter, _poller
+    if _poller is not None:
+        _poller.cancel()
+        _poller = None
+    if _filter is not None:
+        _filter.close()
+        _filter = None
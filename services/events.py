@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi.encoders import jsonable_encoder
+
+from models import security
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "deepmark_activity"
+
+
+class Broker:
+    """
+    In-process pub/sub of activity events, keyed by receiver id.
+
+    Every subscriber gets its own bounded queue; a subscriber that stops
+    reading loses events instead of growing memory, it can always fall back
+    to the paged /activity/ endpoint.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: dict[int, set[asyncio.Queue]] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @asynccontextmanager
+    async def subscription(self, user_id: int):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self._subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[user_id]
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def publish(self, events: list[dict]):
+        """Delivers `{"receiver_id": ..., "event": {...}}` messages."""
+        for message in events:
+            self.deliver(jsonable_encoder(message))
+
+    def deliver(self, message: dict):
+        for queue in self._subscribers.get(message["receiver_id"], ()):
+            try:
+                queue.put_nowait(message["event"])
+            except asyncio.QueueFull:
+                logger.warning("dropping activity event for slow subscriber %s", message["receiver_id"])
+
+
+class PostgresBroker(Broker):
+    """
+    Fans events out to every worker through Postgres LISTEN/NOTIFY. Each
+    worker publishes with NOTIFY and delivers whatever it hears on the
+    channel to its own local subscribers, including its own events.
+    """
+
+    def __init__(self, dsn: str, queue_size: int = 100):
+        super().__init__(queue_size)
+        self.dsn = dsn
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._reconnect: Optional[asyncio.Task] = None
+
+    async def start(self):
+        import asyncpg
+
+        self._conn = await asyncpg.connect(self.dsn)
+        self._conn.add_termination_listener(self._on_terminated)
+        await self._conn.add_listener(CHANNEL, self._on_notify)
+
+    async def stop(self):
+        if self._reconnect:
+            self._reconnect.cancel()
+        if self._conn and not self._conn.is_closed():
+            self._conn.remove_termination_listener(self._on_terminated)
+            await self._conn.close()
+        self._conn = None
+
+    async def publish(self, events: list[dict]):
+        if not events:
+            return
+        payloads = [(CHANNEL, json.dumps(jsonable_encoder(message))) for message in events]
+        try:
+            async with self._lock:
+                await self._conn.executemany("SELECT pg_notify($1, $2)", payloads)
+        except Exception:
+            logger.exception("failed to publish %d activity events", len(payloads))
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.deliver(json.loads(payload))
+
+    def _on_terminated(self, connection):
+        logger.warning("activity event connection lost, reconnecting")
+        self._reconnect = asyncio.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        delay = 1
+        while True:
+            try:
+                await self.start()
+                return
+            except Exception:
+                logger.exception("activity event reconnect failed")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+
+def create_broker() -> Broker:
+    if security.activity_settings.activity_broker == "postgres":
+        from database import engine
+
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        return PostgresBroker(dsn)
+    return Broker()
+
+
+broker = create_broker()
@@ -0,0 +1,217 @@
+"""
+Identity-level duplicate detection over face embeddings.
+
+Every video post stores one embedding per identity seen in it (see
+video_module.analyze.Identities), L2-normalized and quantized to int8. Each
+worker keeps all of them in an in-process index, loaded at startup and
+topped up from the table by id before every search, so posts written by
+other workers are found too. Matches are confirmed against the posts table,
+which also drops posts deleted since they were indexed.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from dependencies.db import SessionDep
+from models import schemas, security
+
+logger = logging.getLogger(__name__)
+
+settings = security.face_settings
+
+DIMENSIONS = 128
+# rows loaded per query when catching up with the table
+LOAD_BATCH = 10_000
+
+
+def quantize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalized float vectors to int8, components in [-1, 1] scaled by 127."""
+    return np.clip(np.rint(np.asarray(vectors) * 127), -127, 127).astype(np.int8)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class FaceIndex:
+    """
+    Cosine top-k over int8 embeddings, best match per post.
+
+    Up to `ivf_threshold` rows a query is one matrix product over every row,
+    in chunks. Beyond it the rows are partitioned into inverted lists around
+    k-means centroids and a query only scans its `nprobe` nearest lists; the
+    lists are retrained whenever the index has doubled since they were.
+    """
+
+    def __init__(self, ivf_threshold: int, nprobe: int, chunk: int = 65_536):
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.chunk = chunk
+        self._codes = np.zeros((1024, DIMENSIONS), np.int8)
+        self._post_ids = np.zeros(1024, np.int64)
+        # 1 / |code|, so a dot product with a normalized query is the cosine
+        self._scales = np.zeros(1024, np.float32)
+        self.size = 0
+        # highest face_embeddings.id loaded
+        self.last_id = 0
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: list[np.ndarray] = []
+        self._trained_size = 0
+
+    def add(self, post_ids: np.ndarray, codes: np.ndarray):
+        count = len(codes)
+        if self.size + count > len(self._codes):
+            capacity = max(len(self._codes) * 2, self.size + count)
+            self._codes = np.resize(self._codes, (capacity, DIMENSIONS))
+            self._post_ids = np.resize(self._post_ids, capacity)
+            self._scales = np.resize(self._scales, capacity)
+        rows = slice(self.size, self.size + count)
+        self._codes[rows] = codes
+        self._post_ids[rows] = post_ids
+        self._scales[rows] = 1 / np.maximum(np.linalg.norm(codes.astype(np.float32), axis=1), 1e-12)
+        if self._centroids is not None:
+            self._assign(np.arange(self.size, self.size + count))
+        self.size += count
+
+    def search(self, queries: np.ndarray, k: int = 10) -> list[tuple[int, float]]:
+        """The `k` posts most similar to any of `queries` (normalized float32), with their best cosine."""
+        if not self.size or not len(queries):
+            return []
+        best: dict[int, float] = {}
+        for rows in self._candidates(queries):
+            codes = self._codes[rows].astype(np.float32)
+            scores = (queries @ codes.T) * self._scales[rows]
+            top = scores.max(axis=0)
+            # a few rows per post at most, so k per query plus slack covers the top k posts
+            keep = min(len(top), k * len(queries) * 4)
+            picked = np.argpartition(-top, keep - 1)[:keep]
+            for post_id, score in zip(self._post_ids[rows][picked].tolist(), top[picked].tolist()):
+                if score > best.get(post_id, -1.0):
+                    best[post_id] = score
+        return sorted(best.items(), key=lambda item: -item[1])[:k]
+
+    def _candidates(self, queries):
+        if self._centroids is None:
+            for start in range(0, self.size, self.chunk):
+                yield np.arange(start, min(start + self.chunk, self.size))
+            return
+        probes = np.argsort(-(queries @ self._centroids.T), axis=1)[:, :self.nprobe]
+        rows = np.concatenate([self._lists[i] for i in np.unique(probes)])
+        for start in range(0, len(rows), self.chunk):
+            yield rows[start:start + self.chunk]
+
+    # IVF
+
+    @property
+    def needs_training(self) -> bool:
+        return self.size >= self.ivf_threshold and self.size >= 2 * self._trained_size
+
+    def train(self, iterations: int = 10, sample: int = 50_000, seed: int = 0) -> tuple[np.ndarray, int]:
+        """
+        k-means centroids over a sample of the current rows. Blocking and
+        read-only, so it can run on a thread; `install` puts them to use.
+        """
+        size = self.size
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(size, min(size, sample), replace=False)
+        data = normalize(self._codes[rows])
+        nlist = max(int(np.sqrt(size)), 1)
+        centroids = data[rng.choice(len(data), min(nlist, len(data)), replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            for i in range(len(centroids)):
+                members = data[assignment == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+            centroids = normalize(centroids)
+        return centroids, size
+
+    def install(self, centroids: np.ndarray, size: int):
+        self._centroids = centroids
+        self._lists = [np.zeros(0, np.int64) for _ in range(len(centroids))]
+        self._trained_size = size
+        self._assign(np.arange(self.size))
+
+    def _assign(self, rows: np.ndarray):
+        vectors = self._codes[rows].astype(np.float32) * self._scales[rows, None]
+        nearest = np.argmax(vectors @ self._centroids.T, axis=1)
+        for i in np.unique(nearest):
+            self._lists[i] = np.concatenate([self._lists[i], rows[nearest == i]])
+
+
+index = FaceIndex(settings.face_index_ivf_threshold, settings.face_index_nprobe)
+_refresh_lock = asyncio.Lock()
+_training: Optional[asyncio.Task] = None
+
+
+async def refresh(db: AsyncSession):
+    """Loads the embeddings written since the last refresh, by any worker."""
+    global _training
+    async with _refresh_lock:
+        while True:
+            result = await db.execute(
+                select(schemas.FaceEmbedding.id, schemas.FaceEmbedding.post_id, schemas.FaceEmbedding.embedding)
+                .where(schemas.FaceEmbedding.id > index.last_id)
+                .order_by(schemas.FaceEmbedding.id)
+                .limit(LOAD_BATCH)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            index.add(
+                np.array([row.post_id for row in rows], np.int64),
+                np.frombuffer(b"".join(row.embedding for row in rows), np.int8).reshape(-1, DIMENSIONS),
+            )
+            index.last_id = rows[-1].id
+    if index.needs_training and _training is None:
+        _training = asyncio.create_task(_train())
+
+
+async def _train():
+    global _training
+    try:
+        centroids, size = await asyncio.to_thread(index.train)
+        index.install(centroids, size)
+        logger.info("face index: %d IVF lists over %d embeddings", len(centroids), index.size)
+    except Exception:
+        logger.exception("face index training failed, searching without IVF lists")
+    finally:
+        _training = None
+
+
+async def startup():
+    from database import engine
+
+    async with AsyncSession(engine) as db:
+        await refresh(db)
+    logger.info("face index loaded with %d embeddings", index.size)
+
+
+def store(db: SessionDep, post: schemas.Post, faces: np.ndarray):
+    """Adds the post's embeddings to the session; the index picks them up on its next refresh."""
+    for code in quantize(faces):
+        db.add(schemas.FaceEmbedding(post_id=post.id, embedding=code.tobytes()))
+
+
+async def find_matches(db: SessionDep, faces: np.ndarray, user: schemas.User, k: int = 5) -> list[tuple[schemas.Post, float]]:
+    """Other users' posts showing one of `faces`, most similar first."""
+    if not len(faces):
+        return []
+    await refresh(db)
+    hits = {
+        post_id: similarity
+        for post_id, similarity in index.search(normalize(faces), k)
+        if similarity >= settings.face_match_similarity
+    }
+    if not hits:
+        return []
+    result = await db.execute(
+        select(schemas.Post).where(schemas.Post.id.in_(hits), schemas.Post.user_id != user.user_id)
+    )
+    return sorted(((post, hits[post.id]) for post in result.scalars().all()), key=lambda match: -match[1])
@@ -1,34 +1,66 @@
 from fastapi import UploadFile,File,HTTPException,status
 from sqlmodel import select,desc
-from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 from typing import List
 import re
+import asyncio
+import logging
 
 from . import process
 from dependencies.db import SessionDep
+from dependencies import streaming
 from models import dtos,schemas
-from . import auth,upload
+from . import auth,upload,activity,faces,dmm_filter,response_cache
+
+logger = logging.getLogger(__name__)
+
+# hashtags of a post, existing ones are looked up in one query
 
-# creating hastag from post
 async def create_hashtag(db: SessionDep, post: schemas.Post):
     regex = r"#\w+"
-    matches = re.findall(regex, post.caption)
+    names = list(dict.fromkeys(match[1:] for match in re.findall(regex, post.caption or "")))
+    if not names:
+        return
+
+    result = await db.execute(select(schemas.Hashtag).where(schemas.Hashtag.name.in_(names)))
+    existing = {hashtag.name: hashtag for hashtag in result.scalars().all()}
 
-    for match in matches:
-        name = match[1:]
+    for name in names:
+        post.hashtags.append(existing.get(name) or schemas.Hashtag(name=name))
 
-        result = await db.execute(select(schemas.Hashtag).where(schemas.Hashtag.name == name))
-        hashtag = result.scalar_one_or_none()
 
-        if not hashtag :
-            hashtag = schemas.Hashtag(name=name)
-            db.add(hashtag)
-            await db.commit()
-        post.hashtags.append(hashtag)
-  
+# removes an upload that will not become a post; cleanup logs its own failures
+# instead of replacing the error that caused it
+
+async def discard_upload(upload_task: asyncio.Task, username: str, media_type: str):
+    if not upload_task.done():
+        upload_task.cancel()
+    try:
+        media_url = await upload_task
+    except (asyncio.CancelledError, HTTPException):
+        return
+    await cleanup(upload.delete_file(username, media_url, media_type), "media")
 
 
+async def discard_previews(previews_task: asyncio.Task, username: str):
+    if not previews_task.done():
+        previews_task.cancel()
+    try:
+        public_ids = await previews_task
+    except asyncio.CancelledError:
+        return
+    except Exception:
+        logger.warning("previews of a discarded post of %s failed to upload", username, exc_info=True)
+        return
+    await cleanup(upload.delete_previews(username, public_ids), "previews")
+
+
+async def cleanup(deletion, what: str):
+    try:
+        await deletion
+    except Exception:
+        logger.warning("could not delete the %s of a discarded post", what, exc_info=True)
+
 
 # create post
 
@@ -40,79 +72,74 @@ async def create_post(
 ):
     curr_user_id = user.user_id
     curr_username = user.username
-    curr_profile_picture = user.profile_picture
 
-    hashed_value = await process.process_media(db, media, user)
+    #analysis and every duplicate check run before watermarking or uploading
+    analysis = await process.process_media(db, media, user)
+    #images are not analyzed at upload: no fingerprint until scripts.backfill computes one, and
+    #exact re-uploads are caught by the content digest stored next to it
+    hashed_value = analysis.fingerprint if analysis else None
     deepmark_result = await process.add_attributes(media, user)
 
-    media_url = await upload.upload_file(
-        user.username,
+    #the upload streams while the rows are prepared
+    upload_task = asyncio.create_task(upload.upload_file(
+        curr_username,
         deepmark_result["metadata_value"],
         deepmark_result["final_media"]
-    )
+    ))
+    previews_task = asyncio.create_task(upload.upload_previews(
+        curr_username,
+        deepmark_result["metadata_value"],
+        deepmark_result["previews"]
+    ))
 
     db_post = schemas.Post(
         caption=post.caption,
-        media_url=media_url,
+        media_url="",
         media_type=post.media_type,
         user_id=curr_user_id
     )
-
-    post_obj = dtos.PostCreate(
-        media_type=db_post.media_type,
-        media_url=db_post.media_url
-    )
-
-    await create_hashtag(db, db_post)
-
-    db.add(db_post)
-
-    await db.commit()
-    await db.refresh(db_post)
-    
-    db_dmm = schemas.DMM(
-        dmm_id=deepmark_result["dmm_id"],
-        video_id=db_post.id,
-        hash_value=hashed_value
-    )
-
     try:
-        db.add(db_dmm)
+        await create_hashtag(db, db_post)
+        media_url = await upload_task
+        preview_ids = await previews_task
+    except BaseException:
+        await discard_upload(upload_task, curr_username, post.media_type)
+        await discard_previews(previews_task, curr_username)
+        raise
+    db_post.media_url = media_url
+    for column, public_id in preview_ids.items():
+        setattr(db_post, column, public_id)
+
+    #post, hashtags, dmm and face embeddings are written in one transaction
+    #media without faces has no fingerprint, its dmm row still carries the watermark id
+    dmm_keys = (deepmark_result["dmm_id"], hashed_value, await streaming.content_digest(media))
+    try:
+        db.add(db_post)
+        await db.flush()
+        db.add(schemas.DMM(
+            dmm_id=dmm_keys[0],
+            video_id=db_post.id,
+            hash_value=dmm_keys[1],
+            content_digest=dmm_keys[2]
+        ))
+        if analysis is not None:
+            faces.store(db, db_post, analysis.faces)
+        hashtags = [hashtag.name for hashtag in db_post.hashtags]
         await db.commit()
     except IntegrityError:
+        #another upload with the same fingerprint won the race
         await db.rollback()
-        await upload.delete_file(curr_username, post_obj.media_url, post_obj.media_type)
-        await db.delete(db_post)
-        await db.commit()
-        result = await db.execute(
-            select(schemas.Post, schemas.User)
-            .select_from(schemas.DMM)
-            .join(schemas.Post, schemas.DMM.video_id == schemas.Post.id)
-            .join(schemas.User, schemas.User.user_id == schemas.Post.user_id)
-            .where(schemas.DMM.hash_value == hashed_value)
-        )
-        data = result.first()
-        post, post_user = data
-        if post_user.user_id == curr_user_id:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="post was already uploaded"
-            )
-        detected_activity = schemas.Activity(
-            receiver_name=post_user.username,
-            sender_name=curr_username,
-            media_type=post.media_type,
-            detected_user_profile_picture=curr_profile_picture,  
-            detected_post_id=post.id,
-            detected_post_url=post.media_url
-        )
-        db.add(detected_activity)
-        await db.commit()
+        await cleanup(upload.delete_file(curr_username, media_url, post.media_type), "media")
+        await cleanup(upload.delete_previews(curr_username, preview_ids), "previews")
+        await db.refresh(user)
+        await process.check_video_fingerprint(db, hashed_value, user)
         raise HTTPException(
-            status_code=status.HTTP_406_NOT_ACCEPTABLE,
-            detail=f'you don\'t own this media'
+            status_code=status.HTTP_409_CONFLICT,
+            detail="post could not be created"
         )
-    
+
+    dmm_filter.add(*dmm_keys)
+    response_cache.invalidate(response_cache.user_tag(curr_user_id), *map(response_cache.hashtag_tag, hashtags))
     await db.refresh(db_post)
     return db_post
 
@@ -151,12 +178,7 @@ async def get_random_posts(
     limit: int = 10,
     hashtag: str = None
 ):
-    result = await db.execute(select(func.count(schemas.Post.id)))
-    total_posts = result.scalar() or 0
-
     offset = (page - 1) * limit
-    if offset >= total_posts:
-        return[]
 
     query = select(schemas.Post, schemas.User.username,schemas.User.profile_picture).join(schemas.User)
 
@@ -203,6 +225,7 @@ async def delete_from_post_id(db: SessionDep, post_id: int):
     if post:
         await db.delete(post)
         await db.commit()
+        response_cache.invalidate(response_cache.post_tag(post_id))
 
 
 
@@ -217,7 +240,7 @@ async def like_post(db: SessionDep, post_id: int, username: str):
     if not user:
         return False, "invalid username"
     
-    await db.refresh(post, ["liked_by_users","user"])
+    await db.refresh(post, ["liked_by_users"])
 
     if user in post.liked_by_users:
         return False, "already liked"
@@ -225,16 +248,9 @@ async def like_post(db: SessionDep, post_id: int, username: str):
     post.liked_by_users.append(user)
     post.likes_count = len(post.liked_by_users)
 
-    like_activity = schemas.Activity(
-        receiver_name=post.user.username,
-        media_type=post.media_type,
-        sender_name=username,
-        liked_user_profile_picture=user.profile_picture,
-        liked_post_id=post_id,
-        liked_post_url=post.media_url
-    )
-    db.add(like_activity)
+    activity.record_like(db, post, user)
     await db.commit()
+    response_cache.invalidate(response_cache.post_tag(post_id))
 
     return True, "done"
 
@@ -259,6 +275,7 @@ async def unlike_post(db: SessionDep, post_id: int, username:str):
     post.likes_count = len(post.liked_by_users)
 
     await db.commit() 
+    response_cache.invalidate(response_cache.post_tag(post_id))
 
     return True, "done"
 
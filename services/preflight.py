@@ -0,0 +1,139 @@
+"""
+Cheap checks on an upload before any of it is decoded: the real format from
+its first bytes, then size, resolution, duration and codec from the
+container header. Oversized, mislabeled or unreadable media is rejected in
+milliseconds, and long videos are analyzed on fewer frames.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from fastapi import HTTPException, UploadFile, status
+from PIL import Image
+
+import metrics
+from models import security
+from video_module import analyze, decode
+from .storage import stream_size
+
+logger = logging.getLogger(__name__)
+
+settings = security.upload_settings
+
+# (offset, magic bytes, kind, format); ftyp boxes are told apart by their brand below
+SIGNATURES = [
+    (0, b"\xff\xd8\xff", "image", "jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image", "png"),
+    (0, b"GIF87a", "image", "gif"),
+    (0, b"GIF89a", "image", "gif"),
+    (0, b"BM", "image", "bmp"),
+    (8, b"WEBP", "image", "webp"),
+    (8, b"AVI ", "video", "avi"),
+    (4, b"ftyp", "video", "mp4"),
+    (0, b"\x1a\x45\xdf\xa3", "video", "matroska"),
+    (0, b"FLV", "video", "flv"),
+    (0, b"\x30\x26\xb2\x75\x8e\x66\xcf\x11", "video", "asf"),
+]
+HEAD_BYTES = 16
+# ftyp brands of still images (HEIF/AVIF) share the mp4 container
+IMAGE_BRANDS = {b"heic", b"heix", b"mif1", b"msf1", b"avif"}
+
+
+@dataclass(frozen=True)
+class Preflight:
+    kind: str
+    format: str
+    size: int
+    video: Optional[decode.VideoInfo] = None
+    # sampling interval for the face analysis of a video
+    frame_skip: Optional[int] = None
+
+
+def sniff(head: bytes) -> Optional[tuple[str, str]]:
+    """(kind, format) from the first bytes of a file, None when unknown."""
+    for offset, magic, kind, format in SIGNATURES:
+        if head[offset:offset + len(magic)] != magic:
+            continue
+        if magic == b"WEBP" and not head.startswith(b"RIFF"):
+            continue
+        if magic == b"ftyp":
+            brand = head[8:12]
+            if brand in IMAGE_BRANDS:
+                return "image", brand.decode()
+            return kind, "mov" if brand == b"qt  " else format
+        return kind, format
+    return None
+
+
+async def check(media: UploadFile, expected: Optional[str] = None) -> Preflight:
+    """
+    Raises 413, 415 or 422 for media that must not be processed. `expected`
+    ("image" or "video") is the kind the client declared.
+    """
+    with metrics.span("preflight"):
+        #uploads received through streaming.DigestRoute kept their first bytes
+        head = getattr(media, "head", None)
+        if head is None:
+            await media.seek(0)
+            head = await media.read(HEAD_BYTES)
+            await media.seek(0)
+        head = head[:HEAD_BYTES]
+        size = media.size if media.size is not None else await asyncio.to_thread(stream_size, media.file)
+
+        sniffed = sniff(head)
+        if sniffed is None:
+            reject(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "media format is not supported")
+        kind, format = sniffed
+        if expected and kind != expected:
+            reject(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"media content is {kind}, declared as {expected}")
+
+        if kind == "image":
+            return await asyncio.to_thread(check_image, media, format, size)
+        return await asyncio.to_thread(check_video, media, format, size)
+
+
+def check_image(media: UploadFile, format: str, size: int) -> Preflight:
+    if size > settings.upload_max_image_bytes:
+        reject(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, f"images are limited to {settings.upload_max_image_bytes // 2**20}MB")
+    try:
+        # only the header is parsed, the pixels are not decoded
+        with Image.open(media.file) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        width = height = settings.upload_max_image_pixels
+    except Exception:
+        reject(status.HTTP_422_UNPROCESSABLE_ENTITY, "image could not be read")
+    finally:
+        media.file.seek(0)
+    if width * height > settings.upload_max_image_pixels:
+        reject(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, f"images are limited to {settings.upload_max_image_pixels:,} pixels")
+    return Preflight("image", format, size)
+
+
+def check_video(media: UploadFile, format: str, size: int) -> Preflight:
+    if size > settings.upload_max_video_bytes:
+        reject(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, f"videos are limited to {settings.upload_max_video_bytes // 2**20}MB")
+    try:
+        with decode.media_path(media) as path:
+            info = decode.probe(path)
+    except decode.DecodeError:
+        logger.info("rejected an unreadable %s upload", format, exc_info=True)
+        reject(status.HTTP_422_UNPROCESSABLE_ENTITY, "video could not be read")
+    finally:
+        media.file.seek(0)
+
+    if info.codec not in settings.video_codecs:
+        reject(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"video codec {info.codec or 'unknown'} is not supported")
+    if info.width * info.height > settings.upload_max_video_pixels:
+        reject(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, f"videos are limited to {settings.upload_max_video_pixels:,} pixels per frame")
+    if info.duration > settings.upload_max_video_seconds:
+        reject(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, f"videos are limited to {settings.upload_max_video_seconds:g} seconds")
+
+    frame_skip = analyze.frame_skip_for(info.estimated_frames)
+    if frame_skip > analyze.FRAME_SKIP:
+        logger.info("analyzing every %dth frame of a %.0fs video", frame_skip, info.duration)
+    return Preflight("video", format, size, info, frame_skip)
+
+
+def reject(status_code: int, detail: str):
+    raise HTTPException(status_code=status_code, detail=detail)
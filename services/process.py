@@ -1,14 +1,20 @@
 import re
+import logging
 from fastapi import UploadFile,HTTPException,status
 from sqlmodel import select
 from typing import Optional
 
 from dependencies.db import SessionDep
+from dependencies import streaming
 from models import schemas
 from encryption import Decrypt,Encrypt
-from video_module import analyze,metadata as VideoMetadata,watermark
-from image_module import metadata as ImageMetadata
+from video_module import analyze,metadata as VideoMetadata,progress,watermark
+from image_module import metadata as ImageMetadata,watermark as ImageWatermark
 from hashing import Hash
+from . import activity,faces,preflight,dmm_filter
+import metrics
+
+logger = logging.getLogger(__name__)
 
 
 #process media
@@ -18,28 +24,101 @@ async def process_media(db: SessionDep, media: UploadFile, user: schemas.User):
             status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
             detail="media is not an image or a video"
         )
-    if media.content_type.startswith("image/"):
+    #an exact copy of a stored upload is answered before anything is decoded
+    await check_content_digest(db, await streaming.content_digest(media), user)
+    #format, size and duration are checked before anything is decoded
+    checked = await preflight.check(media, expected=media.content_type.split("/")[0])
+    if checked.kind == "image":
         return await process_image(db, media, user)
     else:
-       return await process_video(db, media, user)
+       return await process_video(db, media, user, checked.frame_skip)
 
 #process image media
 async def process_image(db: SessionDep, media: UploadFile, user: schemas.User):
     metadata = await ImageMetadata.get_metadata(media)
-    print(metadata)
+    logger.debug("image metadata %s", metadata)
+    #the watermark reads in milliseconds from a reduced-size decode
+    embeded_watermark = await ImageWatermark.extract_watermark(media)
+    await check_video_watermark(db, embeded_watermark, user, None)
 
 #process video media   
-async def process_video(db: SessionDep, media: UploadFile, user: schemas.User):
-    hashed_value = await analyze.analyze_video_face_recognition(media)
-    # # # print(hashed_value)
-    # hashed_value="24d52db5740495ee7ea0ab117a053b7f9fb887664d66c746183810eea94a6b2b"
+async def process_video(db: SessionDep, media: UploadFile, user: schemas.User, frame_skip: Optional[int] = None):
+    on_progress = progress.metrics_progress()
+    analysis = await analyze.analyze_video_faces(media, frame_skip, on_progress)
+    hashed_value = analysis.fingerprint
+    await check_video_fingerprint(db, hashed_value, user)
     metadata = await VideoMetadata.get_metadata(media)
     await check_video_metadata(db, metadata, user, hashed_value)
-    embeded_watermark = await watermark.extract_watermark(media)
+    embeded_watermark = await watermark.extract_watermark(media, on_progress)
     await check_video_watermark(db, embeded_watermark, user, hashed_value)
-    return hashed_value
+    await check_video_faces(db, analysis, user)
+    return analysis
             
 
+#reject media whose upload bytes are already stored
+
+async def check_content_digest(db: SessionDep, digest: str, curr_user: schemas.User):
+    if not dmm_filter.might_exist("digest", digest):
+        return
+    result = await db.execute(
+        select(schemas.Post)
+        .select_from(schemas.DMM)
+        .join(schemas.Post, schemas.DMM.video_id == schemas.Post.id)
+        .where(schemas.DMM.content_digest == digest)
+        .limit(1)
+    )
+    post = result.scalar_one_or_none()
+    if post:
+        await reject_duplicate(db, post, curr_user)
+
+
+#reject media whose fingerprint is already stored; media without faces has none
+
+async def check_video_fingerprint(db: SessionDep, hashed_value: Optional[str], curr_user: schemas.User):
+    if not dmm_filter.might_exist("hash", hashed_value):
+        return
+
+    result = await db.execute(
+        select(schemas.Post)
+        .select_from(schemas.DMM)
+        .join(schemas.Post, schemas.DMM.video_id == schemas.Post.id)
+        .where(schemas.DMM.hash_value == hashed_value)
+    )
+    post = result.scalar_one_or_none()
+    if post:
+        await reject_duplicate(db, post, curr_user)
+
+
+async def reject_duplicate(db: SessionDep, post: schemas.Post, curr_user: schemas.User):
+    if post.user_id == curr_user.user_id:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="post was already uploaded"
+        )
+    activity.record_detection(db, post, curr_user)
+    await db.commit()
+    raise HTTPException(
+        status_code=status.HTTP_406_NOT_ACCEPTABLE,
+        detail=f'you don\'t own this media'
+    )
+
+#match faces of other users' videos, across crops and re-encodes
+
+async def check_video_faces(db: SessionDep, analysis: analyze.FaceAnalysis, curr_user: schemas.User):
+    matches = await faces.find_matches(db, analysis.faces, curr_user)
+    if not matches:
+        return
+
+    logger.info("faces of a new upload match %d posts, best %.3f", len(matches), matches[0][1])
+    for post, _ in matches[:3]:
+        activity.record_detection(db, post, curr_user)
+    if faces.settings.face_match_action == "reject":
+        await db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="faces in this media match another user's post"
+        )
+
 async def check_video_metadata(db:SessionDep, metadata:str, curr_user:schemas.User, hashed_value: str ):
     user_cipher = await Decrypt.generate_user_cipher(curr_user.security_key)
     copyright = metadata[0].get("copyright", None)
@@ -50,6 +129,7 @@ async def check_video_metadata(db:SessionDep, metadata:str, curr_user:schemas.Us
         for i in range(0, len(parts) - 1, 2):  
             result.append(parts[i] + parts[i + 1])
         if len(result) == 2 :
+            #ids carried by the media nearly always have a row, they are looked up without the dmm filter
             dmm_id_user = await Decrypt.decrypt_data(result[0],user_cipher)
             if dmm_id_user is not None:
                 result = await db.execute(
@@ -62,6 +142,8 @@ async def check_video_metadata(db:SessionDep, metadata:str, curr_user:schemas.Us
                         detail="post was already uploaded"
                     )
             dmm_id_master = await Decrypt.decrypt_data(result[1],Decrypt.master_cipher)
+            if dmm_id_master is None:
+                return
             result = await db.execute(
                 select(schemas.DMM, schemas.Post, schemas.User)
                 .join(schemas.Post, schemas.DMM.video_id == schemas.Post.id)
@@ -69,16 +151,10 @@ async def check_video_metadata(db:SessionDep, metadata:str, curr_user:schemas.Us
                 .where(schemas.DMM.dmm_id == dmm_id_master)
             )
             data = result.first()
+            if not data:
+                return
             dmm, post, user = data
-            detected_activity = schemas.Activity(
-                receiver_name=user.username,
-                sender_name=curr_user.username,
-                media_type=post.media_type,
-                detected_user_profile_picture=curr_user.profile_picture,
-                detected_post_id=post.id,
-                detected_post_url=post.media_url
-            )
-            db.add(detected_activity)
+            activity.record_detection(db, post, curr_user)
             if(dmm.hash_value != hashed_value):
                 curr_user.warning+=1
                 db.add(curr_user)
@@ -94,11 +170,12 @@ async def check_video_metadata(db:SessionDep, metadata:str, curr_user:schemas.Us
                 detail=f'you don\'t own this media'
             )
             
+#also checks images, whose hashed_value is None
 async def check_video_watermark(
     db: SessionDep,
     embeded_watermark: Optional[str],
     curr_user: schemas.User,
-    hashed_value: str
+    hashed_value: Optional[str]
 ):
     if not embeded_watermark:
         return 
@@ -108,13 +185,14 @@ async def check_video_watermark(
                 status_code=status.HTTP_406_NOT_ACCEPTABLE,
                 detail="you don't own this media"
         )
+    #a decoded watermark nearly always has a row, and one another node wrote since the dmm filter's
+    #last poll must not be missed, so it is always looked up
     result = await db.execute(
-                select(schemas.DMM, schemas.Post, schemas.User)
-                .join(schemas.Post, schemas.DMM.video_id == schemas.Post.id)
-                .join(schemas.User, schemas.User.user_id == schemas.Post.user_id)
-                .where(schemas.DMM.dmm_id == embeded_watermark)
-            )
-    
+        select(schemas.DMM, schemas.Post, schemas.User)
+        .join(schemas.Post, schemas.DMM.video_id == schemas.Post.id)
+        .join(schemas.User, schemas.User.user_id == schemas.Post.user_id)
+        .where(schemas.DMM.dmm_id == embeded_watermark)
+    )
     data = result.first()
     if not data :
        raise HTTPException(
@@ -124,16 +202,8 @@ async def check_video_watermark(
     
     dmm, post, user = data
     if post.user_id != curr_user.user_id:
-        detected_activity = schemas.Activity(
-                receiver_name=user.username,
-                sender_name=curr_user.username,
-                media_type=post.media_type,
-                detected_user_profile_picture=curr_user.profile_picture,
-                detected_post_id=post.id,
-                detected_post_url=post.media_url
-            )
-        db.add(detected_activity)
-        if(dmm.hash_value != hashed_value):
+        activity.record_detection(db, post, curr_user)
+        if(hashed_value is not None and dmm.hash_value != hashed_value):
             curr_user.warning+=1
             db.add(curr_user)
             await db.commit()
@@ -171,15 +241,19 @@ async def add_image_attributes(media: UploadFile, user: schemas.User) -> dict:
     user_cipher = await Decrypt.generate_user_cipher(user.security_key) 
 
     dmm_id = await Hash.uuid()
-    metadata_value = await Encrypt.encrypt_data(dmm_id,user_cipher)
-    metadata_value += await Encrypt.encrypt_data(dmm_id,Encrypt.master_cipher)
-    metadata_added_media = await ImageMetadata.add_metadata(media,{
+    with metrics.span("encryption"):
+        metadata_value = await Encrypt.encrypt_data(dmm_id,user_cipher)
+        metadata_value += await Encrypt.encrypt_data(dmm_id,Encrypt.master_cipher)
+    #poster and thumbnail come from the pixels decoded for the watermark
+    watermark_added_media, previews = await ImageWatermark.embed_watermark_with_previews(media, dmm_id)
+    metadata_added_media = await ImageMetadata.add_metadata(watermark_added_media,{
         "copyright":f's{metadata_value}'
     })
     return {
         "dmm_id": dmm_id,
         "metadata_value": metadata_value,
-        "final_media": metadata_added_media
+        "final_media": metadata_added_media,
+        "previews": previews
     }  
 
 
@@ -189,17 +263,22 @@ async def add_video_attributes(media: UploadFile, user: schemas.User) -> dict:
 
     dmm_id = await Hash.uuid()
 
-    watermark_added_media = await watermark.embed_watermark(media, dmm_id)
+    #poster, thumbnail and preview clip come from the frames decoded for the watermark
+    watermark_added_media, previews = await watermark.embed_watermark_with_previews(
+        media, dmm_id, progress.metrics_progress()
+    )
 
-    metadata_value = await Encrypt.encrypt_data(dmm_id,user_cipher)
-    metadata_value += await Encrypt.encrypt_data(dmm_id,Encrypt.master_cipher)
+    with metrics.span("encryption"):
+        metadata_value = await Encrypt.encrypt_data(dmm_id,user_cipher)
+        metadata_value += await Encrypt.encrypt_data(dmm_id,Encrypt.master_cipher)
     final_media = await VideoMetadata.append_metadata(watermark_added_media,{
         "copyright":f'deepmark{metadata_value}'
     })
     return {
         "dmm_id": dmm_id,
         "metadata_value":metadata_value,
-        "final_media": final_media
+        "final_media": final_media,
+        "previews": previews
     } 
 
 
@@ -5,7 +5,7 @@ from typing import Optional
 
 from dependencies.db import SessionDep
 from models import schemas,dtos
-from . import auth
+from . import auth,activity,response_cache
 
 
 # follow 
@@ -26,14 +26,10 @@ async def follow(db: SessionDep, follower: str, following: str):
 
     #creating activity
 
-    follow_activity = schemas.Activity(
-        receiver_name=db_following.username,
-        sender_name=db_follower.username,
-        followed_profile_picture=db_follower.profile_picture
-    )
-    db.add(follow_activity)
-
+    activity.record_follow(db, db_following.user_id, db_follower)
+    tags = response_cache.user_tag(db_follower.user_id), response_cache.user_tag(db_following.user_id)
     await db.commit()
+    response_cache.invalidate(*tags)
     return True, "followed"
 # unfollow 
 
@@ -51,7 +47,9 @@ async def unfollow(db: SessionDep, follower: str, following: str):
     db_follower.following_count-=1
     db_following.followers_count-=1
 
+    tags = response_cache.user_tag(db_follower.user_id), response_cache.user_tag(db_following.user_id)
     await db.commit()
+    response_cache.invalidate(*tags)
 
 # get followers
 
@@ -0,0 +1,220 @@
+"""
+Short-lived cache of the public read endpoints: a post, its likes, the posts
+of a hashtag or of a user, and a user's profile.
+
+Entries are the JSON bodies of the responses, kept RESPONSE_CACHE_TTL_SECONDS
+by each worker. Requests that miss on the same key while it loads wait for
+that one load instead of running their own (single-flight), so a hot key
+reaches the database once per TTL per worker. Loads run in their own session,
+so a client going away does not fail the requests waiting on it.
+
+Every entry is tagged with what it shows (post:<id>, user:<id>,
+hashtag:<name>) and the writes invalidate their tags once they commit. A load
+that a write overlapped is answered but not kept, and requests that arrived
+after the write load again. Invalidation reaches only the worker that wrote:
+the others serve their entry until the TTL runs out.
+
+Responses carry an ETag of the body; a GET with a matching If-None-Match is
+answered 304 without a body.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from fastapi import Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import metrics
+from models import security
+
+settings = security.response_cache_settings
+
+# the client keeps the body but asks again every time, with the ETag
+CACHE_CONTROL = "private, no-cache"
+
+Loader = Callable[[AsyncSession], Awaitable[tuple[Any, Iterable[str]]]]
+
+
+def post_tag(post_id: int) -> str:
+    return f"post:{post_id}"
+
+
+def user_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def hashtag_tag(name: str) -> str:
+    return f"hashtag:{name}"
+
+
+@dataclass
+class Entry:
+    body: bytes
+    etag: str
+    tags: frozenset
+    expires: float = 0.0
+    # the last invalidation of its tags seen while it loaded
+    invalidated: int = 0
+
+
+@dataclass
+class _Flight:
+    task: asyncio.Task
+    # the invalidation count when it started
+    started: int
+
+
+_entries: "OrderedDict[str, Entry]" = OrderedDict()
+# tag -> keys of the entries carrying it
+_tagged: dict[str, set[str]] = {}
+_flights: dict[str, _Flight] = {}
+# counts invalidations; each tag invalidated while loads run maps to the count it was last invalidated at
+_epoch = 0
+_tag_epochs: dict[str, int] = {}
+
+
+def invalidate(*tags: str):
+    """Drops the entries showing any of `tags`; called by the writes right after they commit."""
+    global _epoch
+    _epoch += 1
+    for tag in tags:
+        for key in _tagged.pop(tag, ()):
+            _remove(key)
+        # only loads already running need to know
+        if _flights:
+            _tag_epochs[tag] = _epoch
+
+
+async def respond(request: Request, endpoint: str, key: str, load: Loader, model: Optional[Any] = None) -> Response:
+    """
+    The response of `endpoint` for `key`, from the cache or from `load`.
+    `load` gets a session of its own and returns the content and the tags it
+    shows; the content is serialized through `model` like a response_model,
+    or like an endpoint without one. HTTPExceptions it raises reach every
+    waiting request and are not cached.
+    """
+    key = f"{endpoint}:{key}"
+    if not settings.response_cache_enabled:
+        metrics.response_cache_requests.inc(1, endpoint, "disabled")
+        return _response(request, await _load(load, model))
+
+    result = "hit"
+    while True:
+        arrived = _epoch
+        entry = _get(key)
+        if entry is not None:
+            break
+        flight = _flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.create_task(_fill(key, load, model)), arrived)
+            flight.task.add_done_callback(_retrieve)
+            _flights[key] = flight
+            result = "miss"
+        elif result == "hit":
+            result = "coalesced"
+        entry = await asyncio.shield(flight.task)
+        # a load started before this request reflects the writes committed before it only if none overlapped it
+        if flight.started >= arrived or entry.invalidated <= flight.started:
+            break
+    metrics.response_cache_requests.inc(1, endpoint, result)
+    return _response(request, entry)
+
+
+def _get(key: str) -> Optional[Entry]:
+    entry = _entries.get(key)
+    if entry is None:
+        return None
+    if entry.expires <= time.monotonic():
+        _remove(key)
+        return None
+    _entries.move_to_end(key)
+    return entry
+
+
+def _remove(key: str):
+    entry = _entries.pop(key, None)
+    if entry is None:
+        return
+    for tag in entry.tags:
+        keys = _tagged.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _tagged[tag]
+
+
+def _put(key: str, entry: Entry):
+    _remove(key)
+    entry.expires = time.monotonic() + settings.response_cache_ttl_seconds
+    _entries[key] = entry
+    for tag in entry.tags:
+        _tagged.setdefault(tag, set()).add(key)
+    while len(_entries) > settings.response_cache_max_entries:
+        _remove(next(iter(_entries)))
+
+
+async def _fill(key: str, load: Loader, model: Optional[Any]) -> Entry:
+    flight = _flights[key]
+    try:
+        entry = await _load(load, model)
+        entry.invalidated = max((_tag_epochs.get(tag, 0) for tag in entry.tags), default=0)
+        if entry.invalidated <= flight.started:
+            _put(key, entry)
+        return entry
+    finally:
+        if _flights.get(key) is flight:
+            del _flights[key]
+        if not _flights:
+            _tag_epochs.clear()
+
+
+async def _load(load: Loader, model: Optional[Any]) -> Entry:
+    from database import engine
+
+    async with AsyncSession(engine) as db:
+        content, tags = await load(db)
+        # serialized in the session, relationships may still load
+        body = _encode(content, model)
+    return Entry(body=body, etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"', tags=frozenset(tags))
+
+
+def _encode(content: Any, model: Optional[Any]) -> bytes:
+    if model is None:
+        return json.dumps(
+            jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+    adapter = _adapter(model)
+    return adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+
+
+@lru_cache(maxsize=None)
+def _adapter(model: Any) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+def _retrieve(task: asyncio.Task):
+    # every waiter may have gone away before the load failed
+    if not task.cancelled():
+        task.exception()
+
+
+def _response(request: Request, entry: Entry) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": CACHE_CONTROL}
+    if request.method in ("GET", "HEAD") and _matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # weak comparison, as for If-None-Match
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from typing import BinaryIO
+
+from models import security
+
+logger = logging.getLogger(__name__)
+
+
+class StorageError(Exception):
+    pass
+
+
+class StorageNotFound(StorageError):
+    pass
+
+
+class StorageBackend:
+    """
+    Where published media lives. Implementations must not block the event
+    loop and must not hold more than one chunk of the file in memory.
+    """
+
+    async def upload(
+        self, file: BinaryIO, folder: str, public_id: str, resource_type: str, context: dict
+    ) -> str:
+        """Stores `file` from its current position and returns its public id."""
+        raise NotImplementedError
+
+    async def delete(self, folder: str, public_id: str, resource_type: str):
+        raise NotImplementedError
+
+    async def download(self, folder: str, public_id: str, resource_type: str, file: BinaryIO):
+        """Writes the stored media into `file`, one chunk at a time."""
+        raise NotImplementedError
+
+
+class CloudinaryStorage(StorageBackend):
+    """
+    Chunked Cloudinary uploads. Every chunk is sent from a worker thread with
+    the same X-Unique-Upload-Id, so a failed chunk is retried on its own and
+    the upload resumes where it stopped instead of starting over.
+    """
+
+    def __init__(self, chunk_size: int, max_retries: int):
+        # configures the cloudinary credentials
+        from dependencies import cloud  # noqa: F401
+
+        if not security.cloudinary_settings.configured:
+            raise StorageError("STORAGE_BACKEND=cloudinary needs the CLOUDINARY_* settings")
+
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+
+    async def upload(self, file, folder, public_id, resource_type, context):
+        import cloudinary.uploader
+
+        size = await asyncio.to_thread(stream_size, file)
+        if not size:
+            raise StorageError("empty file")
+
+        options = {
+            "folder": folder,
+            "public_id": public_id,
+            "resource_type": resource_type,
+            "overwrite": True,
+            "context": context,
+        }
+        upload_id = uuid.uuid4().hex
+        offset = 0
+        result = None
+        while offset < size:
+            chunk = await asyncio.to_thread(file.read, self.chunk_size)
+            if not chunk:
+                break
+            headers = {
+                "Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}",
+                "X-Unique-Upload-Id": upload_id,
+            }
+            result = await self._with_retries(
+                cloudinary.uploader.upload_large_part,
+                (public_id, chunk),
+                http_headers=headers,
+                **options,
+            )
+            offset += len(chunk)
+        return result["public_id"].split("/")[-1]
+
+    async def delete(self, folder, public_id, resource_type):
+        import cloudinary.uploader
+
+        result = await self._with_retries(
+            cloudinary.uploader.destroy, f"{folder}/{public_id}", resource_type=resource_type
+        )
+        if result.get("result") != "ok":
+            raise StorageNotFound("File not found or already deleted")
+
+    async def download(self, folder, public_id, resource_type, file):
+        import cloudinary.utils
+        import httpx
+
+        url, _ = cloudinary.utils.cloudinary_url(f"{folder}/{public_id}", resource_type=resource_type, secure=True)
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            file.seek(0)
+            file.truncate()
+            try:
+                async with httpx.AsyncClient(timeout=60) as client:
+                    async with client.stream("GET", url) as response:
+                        if response.status_code == 404:
+                            raise StorageNotFound("File not found")
+                        response.raise_for_status()
+                        async for chunk in response.aiter_bytes(self.chunk_size):
+                            await asyncio.to_thread(file.write, chunk)
+                return
+            except httpx.HTTPError as e:
+                client_error = isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500
+                if client_error or attempt == self.max_retries:
+                    raise
+                logger.warning("cloudinary download failed, retry %d/%d", attempt + 1, self.max_retries, exc_info=True)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _with_retries(self, fn, *args, **kwargs):
+        from cloudinary import exceptions
+
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await asyncio.to_thread(fn, *args, **kwargs)
+            except (exceptions.BadRequest, exceptions.AuthorizationRequired, exceptions.NotAllowed):
+                raise
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("cloudinary call failed, retry %d/%d", attempt + 1, self.max_retries, exc_info=True)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+
+class LocalStorage(StorageBackend):
+    """Keeps media under a local directory, for tests and load tests."""
+
+    def __init__(self, root: str, chunk_size: int):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def path(self, folder: str, public_id: str) -> str:
+        return os.path.join(self.root, folder, public_id)
+
+    async def upload(self, file, folder, public_id, resource_type, context):
+        path = self.path(folder, public_id)
+        await asyncio.to_thread(self._copy, file, path)
+        return public_id
+
+    def _copy(self, file, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(file, out, self.chunk_size)
+
+    async def delete(self, folder, public_id, resource_type):
+        try:
+            await asyncio.to_thread(os.remove, self.path(folder, public_id))
+        except FileNotFoundError:
+            raise StorageNotFound("File not found or already deleted")
+
+    async def download(self, folder, public_id, resource_type, file):
+        try:
+            await asyncio.to_thread(self._copy_out, self.path(folder, public_id), file)
+        except FileNotFoundError:
+            raise StorageNotFound("File not found")
+
+    def _copy_out(self, path, file):
+        with open(path, "rb") as source:
+            shutil.copyfileobj(source, file, self.chunk_size)
+
+
+def stream_size(file: BinaryIO) -> int:
+    """Bytes left in `file` from its current position."""
+    position = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell() - position
+    file.seek(position)
+    return size
+
+
+def create_backend() -> StorageBackend:
+    settings = security.storage_settings
+    if settings.storage_backend == "local":
+        return LocalStorage(settings.storage_local_dir, settings.storage_chunk_size)
+    return CloudinaryStorage(settings.storage_chunk_size, settings.storage_max_retries)
+
+
+backend = create_backend()
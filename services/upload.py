@@ -1,16 +1,29 @@
-import cloudinary.uploader
-import uuid  
+import asyncio
+import logging
+import uuid
 import os
+from io import BytesIO
+from typing import Optional
 from fastapi import File, UploadFile, HTTPException
 
-from dependencies import cloud
+from .storage import backend, StorageNotFound
+from video_module.preview import Previews
+import metrics
+
+logger = logging.getLogger(__name__)
 
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
 VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi", ".mkv", ".flv", ".wmv"}
+# Previews field -> (posts column, resource type)
+PREVIEW_COLUMNS = {
+    "poster": ("poster_url", "image"),
+    "thumbnail": ("thumbnail_url", "image"),
+    "clip": ("preview_url", "video"),
+}
 
 async def upload_file(username: str, metadata_value: str, file: UploadFile = File(...)):
     try:
-       
+
         file_extension = os.path.splitext(file.filename)[1].lower()
         if file_extension in IMAGE_EXTENSIONS:
             resource_type = "image"
@@ -18,34 +31,80 @@ async def upload_file(username: str, metadata_value: str, file: UploadFile = Fil
             resource_type = "video"
         else:
             raise HTTPException(status_code=400, detail="Unsupported file type")
-        
+
         new_filename = f"{uuid.uuid4()}"
 
-        result = cloudinary.uploader.upload(
-            file.file.read(),
-            folder=f'deepmark/{username}',
-            resource_type=resource_type,  
-            public_id=new_filename,  
-            overwrite=True,
-            context={
-                "copyright":f'deepmark{metadata_value}'
-            }    
-        )
-
-        return  result["public_id"].split("/")[-1]  
+        file.file.seek(0)
+        with metrics.span("upload"):
+            return await backend.upload(
+                file.file,
+                folder=f'deepmark/{username}',
+                public_id=new_filename,
+                resource_type=resource_type,
+                context={
+                    "copyright":f'deepmark{metadata_value}'
+                }
+            )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 async def delete_file(username:str, public_id: str, resource_type: str):
     try:
-        corrected_public_id = f'deepmark/{username}/{public_id}'
-        result = cloudinary.uploader.destroy(
-            corrected_public_id,
-            resource_type=resource_type
-        )
-
-        if result.get("result") != "ok":
-            raise HTTPException(status_code=404, detail="File not found or already deleted")
-    
+        await backend.delete(f'deepmark/{username}', public_id, resource_type)
+    except StorageNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def upload_previews(username: str, metadata_value: str, previews: Optional[Previews]) -> dict:
+    """
+    Stores the variants in `previews` next to the media and returns their
+    public ids by posts column. A variant that fails to upload is left out,
+    the post is still created.
+    """
+    if previews is None:
+        return {}
+    uploads = {
+        column: (getattr(previews, field), resource_type)
+        for field, (column, resource_type) in PREVIEW_COLUMNS.items()
+        if getattr(previews, field)
+    }
+    with metrics.span("upload"):
+        results = await asyncio.gather(*(
+            backend.upload(
+                BytesIO(data),
+                folder=f'deepmark/{username}',
+                public_id=f"{uuid.uuid4()}",
+                resource_type=resource_type,
+                context={
+                    "copyright":f'deepmark{metadata_value}'
+                }
+            )
+            for data, resource_type in uploads.values()
+        ), return_exceptions=True)
+    public_ids = {}
+    for column, result in zip(uploads, results):
+        if isinstance(result, BaseException):
+            logger.warning("could not upload the %s of a post of %s", column, username, exc_info=result)
+        else:
+            public_ids[column] = result
+    return public_ids
+
+
+async def delete_previews(username: str, public_ids: dict):
+    """
+    Deletes variants stored by upload_previews, ignoring the ones already
+    gone. It only runs to clean up, so other storage failures are logged and
+    the remaining variants are still deleted.
+    """
+    resource_types = dict(PREVIEW_COLUMNS.values())
+    for column, public_id in public_ids.items():
+        try:
+            await backend.delete(f'deepmark/{username}', public_id, resource_types[column])
+        except StorageNotFound:
+            pass
+        except Exception:
+            logger.warning("could not delete the %s %s of %s", column, public_id, username, exc_info=True)
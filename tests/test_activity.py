@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("sqlmodel")
+pytest.importorskip("asyncpg")
+
+from services import activity
+
+
+def test_full_batch_flushes_before_the_interval():
+    async def scenario():
+        writer = activity.ActivityWriter(flush_interval_ms=60_000, max_batch=3)
+        flushed = []
+
+        async def flush(items):
+            flushed.append(len(items))
+
+        writer._flush = flush
+        for i in range(3):
+            writer.enqueue({"receiver_id": i}, {})
+        await asyncio.wait_for(_until(lambda: flushed), 5)
+        await writer.stop()
+        return flushed
+
+    assert asyncio.run(scenario()) == [3]
+
+
+async def _until(condition):
+    while not condition():
+        await asyncio.sleep(0.01)
+
+
+def test_rolled_back_activity_is_not_enqueued(monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    enqueued = []
+    monkeypatch.setattr(activity.writer, "enqueue", lambda row, details: enqueued.append(row))
+    session = Session(create_engine("sqlite://"))
+    db = SimpleNamespace(sync_session=session)
+    sender = SimpleNamespace(user_id=1, username="sender", profile_picture="")
+
+    activity.record_follow(db, 2, sender)
+    session.rollback()
+    session.commit()
+    assert enqueued == []
+
+    activity.record_follow(db, 3, sender)
+    session.commit()
+    assert [row["receiver_id"] for row in enqueued] == [3]
@@ -0,0 +1,49 @@
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("face_recognition")
+if not shutil.which("ffmpeg"):
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+from video_module import analyze
+
+
+def make_video(path, source: str, seconds: int):
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", f"{source}:size=320x240:rate=25:duration={seconds}",
+         "-pix_fmt", "yuv420p", str(path)],
+        check=True,
+    )
+    return str(path)
+
+
+def test_faceless_videos_have_no_fingerprint(tmp_path):
+    pattern = make_video(tmp_path / "pattern.mp4", "testsrc", 4)
+    bars = make_video(tmp_path / "bars.mp4", "smptebars", 7)
+
+    assert analyze.fingerprint(pattern) is None
+    assert analyze.fingerprint(bars) is None
+    assert analyze.analyze(bars).fingerprint is None
+
+
+def test_fingerprint_hashes_face_records():
+    import numpy as np
+
+    hasher = analyze.Fingerprint()
+    assert hasher.hexdigest() is None
+    hasher.update(analyze.face_record((10, 50, 60, 5), {}, 1.0, 0, 25, 5))
+    assert hasher.hexdigest() is not None
+    hasher.update(np.zeros(0, analyze.FACE_RECORD))
+    assert hasher.records == 1
+
+
+def test_tracks_in_place_without_shared_memory(monkeypatch):
+    def full(*args, **kwargs):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(analyze.framering, "FrameRing", full)
+    assert analyze._frame_ring((540, 960, 3)) is None
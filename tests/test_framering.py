@@ -0,0 +1,30 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from video_module import framering
+
+
+def test_close_with_a_live_view():
+    ring = framering.FrameRing((4, 4, 3), 2)
+    slot = ring.put(np.ones((4, 4, 3), np.uint8))
+    frame = ring.frames[slot]
+
+    ring.close()
+
+    assert frame.sum() == 48
+
+
+def test_fitting_slots_is_bounded_by_the_budget(monkeypatch):
+    monkeypatch.setattr(framering, "SHM_DIR", "/nonexistent")
+    assert framering.fitting_slots((540, 960, 3), 32, 16 << 20) == 10
+    assert framering.fitting_slots((540, 960, 3), 32, 1 << 20) == 0
+
+
+def test_failed_allocation_is_an_oserror(monkeypatch):
+    def full(memory, size):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(framering, "_reserve", full)
+    with pytest.raises(OSError):
+        framering.FrameRing((4, 4, 3), 2)
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlmodel")
+pytest.importorskip("face_recognition")
+
+from fastapi import HTTPException
+
+from services import post
+
+
+def test_failed_previews_upload_does_not_replace_the_error():
+    async def failed_upload():
+        raise HTTPException(status_code=500, detail="storage is down")
+
+    async def scenario():
+        task = asyncio.create_task(failed_upload())
+        await asyncio.sleep(0)
+        await post.discard_previews(task, "someone")
+
+    asyncio.run(scenario())
+
+
+def test_failed_deletion_is_logged_not_raised(monkeypatch):
+    async def uploaded():
+        return "media-id"
+
+    async def unavailable(*args):
+        raise HTTPException(status_code=500, detail="storage is down")
+
+    monkeypatch.setattr(post.upload, "delete_file", unavailable)
+
+    async def scenario():
+        task = asyncio.create_task(uploaded())
+        await asyncio.sleep(0)
+        await post.discard_upload(task, "someone", "video")
+
+    asyncio.run(scenario())
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlmodel")
+
+from services import process
+
+
+class NoDatabase:
+    async def execute(self, *args, **kwargs):
+        raise AssertionError("the database was queried")
+
+
+def test_media_without_fingerprint_is_not_checked():
+    asyncio.run(process.check_video_fingerprint(NoDatabase(), None, None))
+
+
+class NoRows:
+    def __init__(self):
+        self.queries = 0
+
+    async def execute(self, *args, **kwargs):
+        self.queries += 1
+        return self
+
+    def first(self):
+        return None
+
+
+@pytest.mark.parametrize("filter_answer", [False, True])
+def test_unknown_watermark_is_rejected_whatever_the_filter_says(monkeypatch, filter_answer):
+    monkeypatch.setattr(process.dmm_filter, "might_exist", lambda kind, value: filter_answer)
+    db = NoRows()
+
+    with pytest.raises(process.HTTPException) as rejected:
+        asyncio.run(process.check_video_watermark(db, "0123456789abcdef", None, None))
+
+    assert rejected.value.status_code == 406
+    assert db.queries == 1
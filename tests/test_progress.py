@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("pydantic_settings")
+
+import metrics
+from video_module import progress
+
+
+def test_metrics_progress_sets_and_clears_the_gauge(monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", True)
+    report = progress.metrics_progress()
+
+    list(progress.track("face_analysis", iter(range(4)), 4, report, interval=0))
+    assert "deepmark_media_progress_ratio{" not in metrics.render()
+
+    report(progress.ProgressEvent("face_analysis", 1, 4, 0.1))
+    assert 'deepmark_media_progress_ratio{stage="face_analysis",job=' in metrics.render()
+
+
+def test_no_callback_without_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", False)
+    assert progress.metrics_progress() is None
@@ -0,0 +1,48 @@
+import shutil
+import subprocess
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("ffmpeg")
+pytest.importorskip("pydantic_settings")
+
+from video_module import decode, segments
+
+
+def test_plan_seeks_relative_to_start_time(monkeypatch):
+    monkeypatch.setattr(segments, "keyframes", lambda path: [(0, 10.0), (250, 20.0), (500, 30.0), (750, 40.0)])
+    info = decode.VideoInfo(320, 240, 0, 1000, 25.0, 40.0, "h264", start_time=10.0)
+
+    plan = segments.plan("video.ts", info, count=4)
+
+    assert [segment.start_frame for segment in plan] == [0, 250, 500, 750]
+    assert [round(segment.seek_time, 3) for segment in plan] == [0.0, 10.02, 20.02, 30.02]
+
+
+@pytest.mark.skipif(not shutil.which("ffmpeg"), reason="ffmpeg is not installed")
+def test_segments_decode_the_same_frames_with_a_start_offset(tmp_path, monkeypatch):
+    path = str(tmp_path / "offset.ts")
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc:size=160x120:rate=25:duration=12",
+         "-c:v", "libx264", "-g", "50", "-pix_fmt", "yuv420p", "-output_ts_offset", "7", "-f", "mpegts", path],
+        check=True,
+    )
+    info = decode.probe(path)
+    assert info.start_time > 5
+    monkeypatch.setattr(segments.settings, "media_min_segment_seconds", 2.0)
+    if not info.frames:
+        # mpegts does not store a frame count
+        info = decode.VideoInfo(info.width, info.height, info.rotation, info.estimated_frames, info.fps,
+                                info.duration, info.codec, info.start_time)
+
+    plan = segments.plan(path, info, count=3)
+    assert len(plan) > 1
+
+    corner = (160, 120)
+    whole = [frame for _, frame in decode.corner_frames(path, info, corner, every=5)]
+    pieces = [
+        frame for segment in plan for _, frame in decode.corner_frames(path, info, corner, every=5, segment=segment)
+    ]
+    assert len(pieces) == len(whole)
+    assert all(np.array_equal(a, b) for a, b in zip(whole, pieces))
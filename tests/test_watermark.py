@@ -0,0 +1,22 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("pywt")
+pytest.importorskip("fastapi")
+
+from video_module import watermark
+
+
+def test_mark_reads_back_from_one_tile():
+    luma = np.full((watermark.MIN_MARK_SIZE[1], watermark.MIN_MARK_SIZE[0]), 128, np.float32)
+    assert watermark.read_luma(watermark.embed_luma(luma, "0123456789abcdef")) == "0123456789abcdef"
+
+
+def test_media_smaller_than_a_tile_is_not_marked():
+    luma = np.full((240, watermark.MIN_MARK_SIZE[0] - 16), 128, np.float32)
+    assert not watermark.luma_offsets(luma, "0123456789abcdef").any()
+
+
+def test_legacy_full_scan_is_off_by_default():
+    assert watermark.Settings(_env_file=None).watermark_legacy_full_scan is False
@@ -1,80 +1,352 @@
-import imageio
+import asyncio
+import concurrent.futures
 import face_recognition
-import json
-import sys
-import cv2
-from tqdm import tqdm
+import hashlib
+import logging
+import numpy as np
+from collections import deque
+from dataclasses import dataclass
 from fastapi import UploadFile
-from io import BytesIO
+from typing import Optional
 
-from hashing import Hash
+import metrics
+from . import decode, framering, progress, segments
+from .progress import ProgressCallback
+from .tracking import FaceTracker, Track, detect_faces
 
-async def normalize_orientation(frame):
-    if frame.shape[0] > frame.shape[1]:
-        return cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-    return frame
+logger = logging.getLogger(__name__)
 
+# longest side of the frames faces are detected on; detections are mapped back to source pixels
+FACE_MAX_SIDE = 960
+# every FRAME_SKIP-th frame is analyzed, fewer for videos longer than MAX_ANALYZED_FRAMES samples;
+# both are part of the fingerprint, changing them changes the hash of every video
+FRAME_SKIP = 5
+MAX_ANALYZED_FRAMES = 720
 
-async def analyze_video_face_recognition(video_file: UploadFile, frame_skip=5):
+# first byte of every fingerprint's hashed stream; bump it whenever the records
+# or the analysis behind them change, so old and new fingerprints never collide
+FINGERPRINT_VERSION = 2
+# the landmark model's features, in the order their points are packed
+LANDMARK_FEATURES = (
+    "chin", "left_eyebrow", "right_eyebrow", "nose_bridge", "nose_tip",
+    "left_eye", "right_eye", "top_lip", "bottom_lip",
+)
+MAX_LANDMARKS = 72
+# one face track, or one face of an image; little-endian and unpadded so the bytes are the same on every host
+FACE_RECORD = np.dtype([
+    ("start", "<u4"),
+    ("end", "<u4"),
+    ("frames", "<u4"),
+    # top, right, bottom, left
+    ("rect", "<i4", (4,)),
+    # points used in `points`, the rest are zero
+    ("landmarks", "<u2"),
+    ("points", "<i4", (MAX_LANDMARKS, 2)),
+])
+
+
+# encodings closer than this (euclidean, face_recognition's own tolerance is 0.6) are one person
+IDENTITY_DISTANCE = 0.5
+# identities kept per video, the most seen first
+MAX_IDENTITIES = 16
+
+# sampled frames decoded ahead of the tracker, whose scheduled detections run in the media pool meanwhile;
+# fewer when the frame ring would not fit in MEDIA_FRAME_RING_MB or the free shared memory
+LOOKAHEAD = 32
+# below this the detections hardly get ahead, and the tracker runs in place
+MIN_LOOKAHEAD = 8
+
+
+@dataclass(frozen=True)
+class FaceAnalysis:
+    # None when no face was found, see Fingerprint
+    fingerprint: Optional[str]
+    # (identities, 128) float32, one L2-normalized mean face encoding per identity seen in the video
+    faces: np.ndarray
+
+
+def frame_skip_for(frames: Optional[int]) -> int:
+    """The sampling interval for a video of `frames` frames."""
+    if not frames:
+        return FRAME_SKIP
+    return max(FRAME_SKIP, -(-frames // MAX_ANALYZED_FRAMES))
+
+
+@metrics.timed("face_analysis")
+async def analyze_video_face_recognition(
+    video_file: UploadFile, frame_skip: Optional[int] = None, on_progress: Optional[ProgressCallback] = None
+):
     """
-    Analyzes faces in an uploaded video using imageio instead of temporary files.
+    Analyzes faces in an uploaded video, decoding every `frame_skip`-th frame
+    at reduced resolution through an ffmpeg pipe.
     
     Args:
         video_file (UploadFile): Video file uploaded through FastAPI
-        frame_skip (int): Number of frames to skip between processing
+        frame_skip (int): Optional, number of frames to skip between processing; by default
+            frame_skip_for the video's frame count
+        on_progress (ProgressCallback): Optional, receives throttled progress events
     
     Returns:
-        str: SHA256 hash of the facial recognition data
+        str: SHA256 hash of the facial recognition data, None when the video has no faces
     """
     try:
-        # Read video bytes into memory
-        video_bytes = BytesIO(await video_file.read())
-        video_file.file.seek(0)
-        video_format = video_file.filename.split('.')[-1] if video_file.filename else 'mp4'
-
-        # Read video with imageio
-        with imageio.get_reader(video_bytes, format=video_format) as reader:
-            total_frames = reader.count_frames()
-            results = []
-            
-            # Disable tqdm if running in a non-terminal environment
-            disable_tqdm = not sys.stdout.isatty()
-            
-            with tqdm(
-                total=total_frames,
-                desc="📽️ Analyzing Video",
-                unit=" frames",
-                colour="blue",
-                disable=disable_tqdm
-            ) as pbar:
-                for frame_count, frame in enumerate(reader):
-                    pbar.update(1)  # Update progress bar
-                    
-                    if frame_count % frame_skip != 0:
-                        continue
-                    
-                    rgb_frame = await normalize_orientation(frame)
-                    face_locations = face_recognition.face_locations(rgb_frame)
-                    face_landmarks = face_recognition.face_landmarks(rgb_frame)
-                    
-                    frame_data = {"frame": frame_count, "faces": []}
-                    
-                    for i, face_location in enumerate(face_locations):
-                        top, right, bottom, left = face_location
-                        landmarks = face_landmarks[i] if i < len(face_landmarks) else {}
-                        frame_data["faces"].append({
-                            "rect": {"top": top, "right": right, "bottom": bottom, "left": left},
-                            "landmarks": landmarks
-                        })
-                    
-                    results.append(frame_data)
-
-            # Convert results to JSON and hash
-            json_string = json.dumps(results, sort_keys=True)
-            hashed_data = await Hash.sha256(json_string)
-
-            return hashed_data
+        with decode.media_path(video_file) as path:
+            return await asyncio.to_thread(fingerprint, path, frame_skip, on_progress, _detection_pool())
     except Exception as e:
         raise Exception(f"Error processing video: {str(e)}")
-    # finally:
-    #     multiprocessing.resource_tracker._cleanup_semaphores() 
+
+
+@metrics.timed("face_analysis")
+async def analyze_video_faces(
+    video_file: UploadFile, frame_skip: Optional[int] = None, on_progress: Optional[ProgressCallback] = None
+) -> FaceAnalysis:
+    """
+    Like analyze_video_face_recognition, and also encodes every detected
+    face and groups the encodings into one embedding per identity, for
+    similarity search across crops and re-encodes.
+    """
+    try:
+        with decode.media_path(video_file) as path:
+            return await asyncio.to_thread(analyze, path, frame_skip, on_progress, _detection_pool())
+    except Exception as e:
+        raise Exception(f"Error processing video: {str(e)}")
+
+
+def _detection_pool() -> Optional[concurrent.futures.Executor]:
+    return segments.pool() if segments.workers > 1 else None
+
+
+def fingerprint(
+    path: str, frame_skip: Optional[int] = None, on_progress: Optional[ProgressCallback] = None,
+    pool: Optional[concurrent.futures.Executor] = None,
+) -> Optional[str]:
+    """
+    The SHA256 of the face analysis of the video at `path`, None when it has
+    no faces; blocking. Without a `pool` it is safe to run in a worker process.
+    """
+    return _analyze_path(path, frame_skip, on_progress, pool=pool)
+
+
+def analyze(
+    path: str, frame_skip: Optional[int] = None, on_progress: Optional[ProgressCallback] = None,
+    pool: Optional[concurrent.futures.Executor] = None,
+) -> FaceAnalysis:
+    identities = Identities()
+    fingerprint = _analyze_path(path, frame_skip, on_progress, identities, pool)
+    return FaceAnalysis(fingerprint, identities.embeddings(MAX_IDENTITIES))
+
+
+class Fingerprint:
+    """
+    Incremental SHA256 over the version byte and then the packed face records, in order.
+
+    Media without a single face record has no fingerprint: its hash would be
+    the version byte alone, the same for every faceless upload.
+    """
+
+    def __init__(self):
+        self._sha = hashlib.sha256(bytes([FINGERPRINT_VERSION]))
+        self.records = 0
+
+    def update(self, records: np.ndarray):
+        records = np.ascontiguousarray(records, FACE_RECORD)
+        self._sha.update(records.tobytes())
+        self.records += len(records)
+
+    def hexdigest(self) -> Optional[str]:
+        return self._sha.hexdigest() if self.records else None
+
+
+def face_record(box, landmarks: dict, scale: float, start: int = 0, end: int = 0, frames: int = 1) -> np.ndarray:
+    """
+    Packs one face, its box (top, right, bottom, left) and landmark points
+    in frame pixels, quantized to whole source pixels (frame pixels x `scale`).
+    """
+    record = np.zeros(1, FACE_RECORD)
+    record["start"], record["end"], record["frames"] = start, end, frames
+    record["rect"] = np.rint(np.asarray(box, dtype=float) * scale)
+    features = [np.asarray(landmarks[feature], dtype=float).reshape(-1, 2) for feature in LANDMARK_FEATURES if feature in landmarks]
+    if features:
+        points = np.concatenate(features)[:MAX_LANDMARKS]
+        record["landmarks"] = len(points)
+        record["points"][0, :len(points)] = np.rint(points * scale)
+    return record
+
+
+def _analyze_path(
+    path: str, frame_skip: Optional[int], on_progress: Optional[ProgressCallback],
+    identities: Optional["Identities"] = None, pool: Optional[concurrent.futures.Executor] = None,
+) -> Optional[str]:
+    """
+    Hashes one record per face track, None when there is none: faces are detected on every
+    tracking.REDETECT_EVERY-th sampled frame, or sooner when the optical flow
+    loses them, and followed in between. Tracks are hashed as they end.
+    With a `pool`, the scheduled detections run there ahead of the tracker;
+    the result is the same.
+    """
+    info = decode.probe(path)
+    frame_skip = frame_skip or frame_skip_for(info.estimated_frames)
+    # portrait videos are analyzed turned to landscape, inside ffmpeg
+    width, height, scale, filters = decode.rgb_plan(info, FACE_MAX_SIDE, landscape=True)
+    total = -(-info.frames // frame_skip) if info.frames else None
+
+    frames = decode.frames(path, width, height, "rgb24", filters, frame_skip)
+    frames = progress.track("face_analysis", metrics.decode("face_analysis", frames), total, on_progress)
+
+    tracker = FaceTracker(
+        face_recognition.face_locations,
+        face_recognition.face_landmarks,
+        face_recognition.face_encodings if identities is not None else None,
+    )
+    hasher = Fingerprint()
+
+    def finish(tracks: list[Track]):
+        for track in tracks:
+            hasher.update(track_record(track, scale))
+            if identities is not None:
+                for encoding in track.encodings:
+                    identities.add(encoding)
+
+    sampled = 0
+    for _ in (_track_ahead(frames, tracker, (height, width, 3), pool) if pool else _track(frames, tracker)):
+        finish(tracker.pop_finished())
+        sampled += 1
+    finish(tracker.close())
+    logger.debug("face detection ran on %d of %d sampled frames", tracker.detections, sampled)
+    return hasher.hexdigest()
+
+
+def _track(frames, tracker: FaceTracker):
+    for frame_count, rgb_frame in frames:
+        tracker.update(frame_count, rgb_frame)
+        yield frame_count
+
+
+def _track_ahead(frames, tracker: FaceTracker, shape: tuple, pool: concurrent.futures.Executor):
+    """
+    Like _track, with up to LOOKAHEAD frames decoded into a shared-memory
+    ring ahead of the tracker. Frames the tracker will detect faces on, as
+    long as its tracks hold, are sent to `pool` by slot; a detection the
+    tracker needs sooner runs here, and the ones it no longer needs are
+    cancelled. Without room for a ring it is _track.
+    """
+    ring = _frame_ring(shape)
+    if ring is None:
+        yield from _track(frames, tracker)
+        return
+    ahead: deque[tuple[int, int]] = deque()
+    detections: dict[int, concurrent.futures.Future] = {}
+    encode = tracker.encode is not None
+
+    def schedule():
+        due = {index for index, _ in list(ahead)[tracker.next_detection - 1::tracker.redetect_every + 1]}
+        for index in [index for index in detections if index not in due]:
+            detections.pop(index).cancel()
+        for index, slot in ahead:
+            if index in due and index not in detections:
+                detections[index] = pool.submit(_detect_slot, ring.spec, slot, encode)
+                ring.hold_until_done(slot, detections[index])
+
+    def prefetched(index: int):
+        future = detections.pop(index, None)
+        return future.result() if future is not None else None
+
+    tracker.prefetched = prefetched
+    frames = iter(frames)
+    try:
+        while True:
+            for frame_count, rgb_frame in frames:
+                ahead.append((frame_count, ring.put(rgb_frame)))
+                if len(ahead) == ring.spec.slots - 1:
+                    break
+            if not ahead:
+                break
+            schedule()
+            frame_count, slot = ahead.popleft()
+            tracker.update(frame_count, ring.frames[slot])
+            ring.release(slot)
+            yield frame_count
+    finally:
+        tracker.prefetched = None
+        for future in detections.values():
+            future.cancel()
+        concurrent.futures.wait(detections.values())
+        ring.close()
+
+
+def _frame_ring(shape: tuple) -> Optional[framering.FrameRing]:
+    slots = framering.fitting_slots(shape, LOOKAHEAD, segments.settings.media_frame_ring_mb << 20)
+    if slots < MIN_LOOKAHEAD:
+        logger.info("no shared memory for %d frames of %s, tracking faces in place", MIN_LOOKAHEAD, shape)
+        return None
+    try:
+        return framering.FrameRing(shape, slots)
+    except OSError:
+        logger.warning("could not allocate a frame ring, tracking faces in place", exc_info=True)
+        return None
+
+
+def _detect_slot(spec: framering.RingSpec, slot: int, encode: bool):
+    """Runs in the media pool: the faces on one frame of a ring, as FaceTracker.faces returns them."""
+    return detect_faces(
+        framering.view(spec, slot),
+        face_recognition.face_locations,
+        face_recognition.face_landmarks,
+        face_recognition.face_encodings if encode else None,
+    )
+
+
+def track_record(track: Track, scale: float) -> np.ndarray:
+    """Span, median box and mean landmarks of a face track."""
+    landmarks = {}
+    if track.landmarks:
+        for feature in track.landmarks[0]:
+            landmarks[feature] = np.mean([detection[feature] for detection in track.landmarks], axis=0)
+    box = np.median(np.array(track.boxes), axis=0)
+    return face_record(box, landmarks, scale, track.start, track.end, len(track.boxes))
+
+
+def frame_records(rgb_frame, scale: float = 1.0, identities: Optional["Identities"] = None) -> np.ndarray:
+    """
+    The faces of one RGB frame by full detection, as FACE_RECORDs. With
+    `identities`, the faces are also encoded into it.
+    """
+    face_locations = face_recognition.face_locations(rgb_frame)
+    # the landmarks reuse the detections instead of running the detector again
+    face_landmarks = face_recognition.face_landmarks(rgb_frame, face_locations)
+    if identities is not None and face_locations:
+        for encoding in face_recognition.face_encodings(rgb_frame, face_locations):
+            identities.add(encoding)
+    records = [
+        face_record(location, face_landmarks[i] if i < len(face_landmarks) else {}, scale)
+        for i, location in enumerate(face_locations)
+    ]
+    return np.concatenate(records) if records else np.zeros(0, FACE_RECORD)
+
+
+class Identities:
+    """Groups face encodings across tracks and frames into identities, greedily by distance to each running mean."""
+
+    def __init__(self):
+        self.sums: list[np.ndarray] = []
+        self.counts: list[int] = []
+
+    def add(self, encoding: np.ndarray):
+        encoding = np.asarray(encoding, dtype=np.float64)
+        if self.sums:
+            means = np.array(self.sums) / np.array(self.counts)[:, None]
+            distances = np.linalg.norm(means - encoding, axis=1)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] < IDENTITY_DISTANCE:
+                self.sums[nearest] += encoding
+                self.counts[nearest] += 1
+                return
+        self.sums.append(encoding.copy())
+        self.counts.append(1)
+
+    def embeddings(self, limit: int) -> np.ndarray:
+        order = sorted(range(len(self.counts)), key=lambda i: -self.counts[i])[:limit]
+        if not order:
+            return np.zeros((0, 128), np.float32)
+        means = np.array([self.sums[i] / self.counts[i] for i in order])
+        return (means / np.linalg.norm(means, axis=1, keepdims=True)).astype(np.float32)
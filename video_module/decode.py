@@ -0,0 +1,279 @@
+"""
+Reduced-resolution decoding for the analysis stages.
+
+Frames are read from an ffmpeg pipe in exactly the shape the stage needs:
+a cropped BGR corner of the frame for watermark extraction and a downscaled
+RGB frame for face analysis. Scaling, sampling (`every`) and rotation all
+happen inside ffmpeg, so full-resolution BGR frames are never copied into
+Python. ffmpeg applies the container's rotation metadata itself.
+
+Watermark extraction converts its corner to Y with OpenCV instead of reading
+the decoder's own Y plane: version 1 marks are thresholded on single luma
+levels, which the two conversions disagree on.
+"""
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import ffmpeg
+import numpy as np
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+
+
+class DecodeError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Frames [start_frame, start_frame + frames) of a video, starting on a keyframe."""
+    start_frame: int
+    # 0 runs to the end of the video
+    frames: int
+    # a point between the keyframe and the next frame, for -ss: relative to the container's start_time
+    seek_time: float
+
+
+@dataclass(frozen=True)
+class VideoInfo:
+    # display size, after the container rotation is applied
+    width: int
+    height: int
+    rotation: int
+    frames: Optional[int]
+    fps: float
+    # seconds, 0 when the container does not say
+    duration: float = 0.0
+    codec: str = ""
+    # the container's first timestamp, which -ss positions are relative to
+    start_time: float = 0.0
+
+    @property
+    def portrait(self) -> bool:
+        return self.height > self.width
+
+    @property
+    def estimated_frames(self) -> Optional[int]:
+        """The frame count, estimated from duration and rate for containers that do not store it."""
+        if self.frames:
+            return self.frames
+        if self.duration and self.fps:
+            return int(round(self.duration * self.fps))
+        return None
+
+
+def probe(path: str) -> VideoInfo:
+    try:
+        info = ffmpeg.probe(path, select_streams="v:0")
+    except ffmpeg.Error as e:
+        raise DecodeError(e.stderr.decode() if e.stderr else str(e))
+    if not info.get("streams"):
+        raise DecodeError("no video stream")
+    stream = info["streams"][0]
+
+    rotation = int(stream.get("tags", {}).get("rotate", 0))
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            rotation = -int(side_data["rotation"])
+    rotation %= 360
+
+    width, height = int(stream["width"]), int(stream["height"])
+    if rotation in (90, 270):
+        width, height = height, width
+
+    frames = stream.get("nb_frames")
+    return VideoInfo(
+        width, height, rotation,
+        int(frames) if frames and frames.isdigit() else None,
+        _rate(stream.get("avg_frame_rate")) or _rate(stream.get("r_frame_rate")),
+        _seconds(stream.get("duration")) or _seconds(info.get("format", {}).get("duration")),
+        stream.get("codec_name", ""),
+        _seconds(info.get("format", {}).get("start_time")),
+    )
+
+
+def _seconds(value: Optional[str]) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _rate(value: Optional[str]) -> float:
+    numerator, _, denominator = (value or "0/0").partition("/")
+    try:
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def keyframes(path: str) -> list[tuple[int, float]]:
+    """(frame index, presentation time) of every keyframe of the first video stream."""
+    command = [
+        FFPROBE, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "json", path,
+    ]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise DecodeError(result.stderr.decode(errors="replace").strip())
+    packets = [
+        (float(p["pts_time"]), "K" in p.get("flags", ""))
+        for p in json.loads(result.stdout).get("packets", [])
+        if p.get("pts_time") not in (None, "N/A")
+    ]
+    # packets come in decode order, frames are numbered in presentation order
+    packets.sort()
+    return [(index, time) for index, (time, key) in enumerate(packets) if key]
+
+
+def frames(
+    path: str, width: int, height: int, pix_fmt: str, filters: list[str], every: int = 1,
+    segment: Optional[Segment] = None,
+) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Yields (frame index, frame) for every `every`-th frame of `path`, after
+    `filters`, as `pix_fmt` ("gray", "rgb24" or "bgr24") frames of width x height.
+
+    With a `segment` only its frames are decoded, starting from its
+    keyframe, and indices and sampling stay those of the whole video.
+    """
+    channels = {"gray": 1, "rgb24": 3, "bgr24": 3}[pix_fmt]
+    offset = segment.start_frame if segment else 0
+    if every > 1:
+        filters = [f"select=not(mod(n+{offset}\\,{every}))", *filters]
+    command = [FFMPEG, "-v", "error", "-nostdin"]
+    if segment and segment.seek_time:
+        # seeking just past the keyframe lands on it; no accurate seek, nothing is decoded twice
+        command += ["-noaccurate_seek", "-ss", f"{segment.seek_time:.6f}"]
+    if segment and segment.frames:
+        filters = [f"trim=end_frame={segment.frames}", *filters]
+    command += ["-i", path, "-an", "-sn"]
+    if filters:
+        command += ["-vf", ",".join(filters)]
+    command += ["-fps_mode", "passthrough", "-f", "rawvideo", "-pix_fmt", pix_fmt, "pipe:1"]
+
+    frame_size = width * height * channels
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=frame_size)
+    finished = False
+    try:
+        index = -(-offset // every) * every
+        while True:
+            data = process.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            yield index, np.frombuffer(data, np.uint8).reshape(shape)
+            index += every
+        finished = True
+    finally:
+        if not finished:
+            process.kill()
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise DecodeError(stderr.decode(errors="replace").strip() or f"ffmpeg exited with {returncode}")
+
+
+def concat(paths: list[str], workdir: str) -> str:
+    """Joins same-codec files end to end without re-encoding; returns the joined file's path."""
+    listing = os.path.join(workdir, "concat.txt")
+    with open(listing, "w") as f:
+        for path in paths:
+            f.write("file '{}'\n".format(os.path.abspath(path).replace("'", "'\\''")))
+    output = os.path.join(workdir, "joined" + os.path.splitext(paths[0])[1])
+    command = [FFMPEG, "-v", "error", "-nostdin", "-y", "-f", "concat", "-safe", "0", "-i", listing, "-c", "copy", output]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise DecodeError(result.stderr.decode(errors="replace").strip())
+    return output
+
+
+def _crop(info: VideoInfo, crop: Optional[tuple[int, int]], multiple: int) -> tuple[int, int, list[str]]:
+    if crop is None:
+        return info.width, info.height, []
+    # whole blocks only, so block averages downstream never straddle the edge
+    width = min(crop[0], info.width) // multiple * multiple
+    height = min(crop[1], info.height) // multiple * multiple
+    return width, height, [f"crop={width}:{height}:0:0"]
+
+
+def corner_frames(
+    path: str, info: VideoInfo, crop: tuple[int, int], every: int = 1, multiple: int = 4,
+    segment: Optional[Segment] = None,
+) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    The top-left `crop` (width, height) as BGR, converted by the same
+    swscale path OpenCV uses, so it is pixel-identical to the corner of a
+    cv2.VideoCapture frame.
+    """
+    width, height, filters = _crop(info, crop, multiple)
+    return frames(path, width, height, "bgr24", filters, every, segment)
+
+
+def rgb_plan(info: VideoInfo, max_side: int, landscape: bool = False) -> tuple[int, int, float, list[str]]:
+    """
+    Output width, height, the factor that maps output pixels back to the
+    (rotated) source and the filters producing them. With `landscape`,
+    portrait videos are turned 90 degrees clockwise inside ffmpeg.
+    """
+    width, height = info.width, info.height
+    filters = []
+    if landscape and info.portrait:
+        filters.append("transpose=clock")
+        width, height = height, width
+    factor = max(max(width, height) / max_side, 1.0)
+    out_width = max(int(width / factor) // 2 * 2, 2)
+    out_height = max(int(height / factor) // 2 * 2, 2)
+    if (out_width, out_height) != (width, height):
+        filters.append(f"scale={out_width}:{out_height}:flags=area")
+    return out_width, out_height, width / out_width, filters
+
+
+@contextlib.contextmanager
+def media_path(upload) -> Iterator[str]:
+    """
+    A filesystem path for an UploadFile, for ffmpeg to read. A file that
+    lives on disk under a name is used as is, an unnamed one (a spooled
+    upload) through its descriptor in /proc; anything else is copied to a
+    temporary file in chunks.
+    """
+    name = getattr(upload.file, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        upload.file.flush()
+        yield name
+        return
+
+    path = _descriptor_path(upload.file)
+    if path:
+        yield path
+        return
+
+    suffix = os.path.splitext(upload.filename or "")[1] or ".mp4"
+    with tempfile.NamedTemporaryFile(suffix=suffix) as temp:
+        position = upload.file.tell()
+        upload.file.seek(0)
+        shutil.copyfileobj(upload.file, temp, 1024 * 1024)
+        upload.file.seek(position)
+        temp.flush()
+        yield temp.name
+
+
+def _descriptor_path(file) -> Optional[str]:
+    try:
+        # moves a spooled file that is still in memory to disk
+        descriptor = file.fileno()
+        file.flush()
+    except (AttributeError, OSError, ValueError):
+        return None
+    # other processes (ffmpeg, segment workers) open it afresh, with their own position
+    path = f"/proc/{os.getpid()}/fd/{descriptor}"
+    return path if os.path.exists(path) else None
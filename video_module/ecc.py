@@ -0,0 +1,165 @@
+"""
+Reed-Solomon error correction over GF(256), for the watermark payload.
+
+A systematic code: `encode` appends `nsym` parity bytes to the message and
+`decode` corrects up to nsym // 2 wrong bytes anywhere in the codeword
+(Berlekamp-Massey, Chien search, Forney), or raises ReedSolomonError.
+"""
+
+# the field's primitive polynomial, x^8 + x^4 + x^3 + x^2 + 1
+PRIMITIVE = 0x11d
+
+EXP = [0] * 512
+LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    EXP[_i] = _x
+    LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= PRIMITIVE
+for _i in range(255, 512):
+    EXP[_i] = EXP[_i - 255]
+
+
+class ReedSolomonError(ValueError):
+    pass
+
+
+def _mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return EXP[LOG[a] + LOG[b]]
+
+
+def _div(a: int, b: int) -> int:
+    if b == 0:
+        raise ZeroDivisionError()
+    if a == 0:
+        return 0
+    return EXP[(LOG[a] + 255 - LOG[b]) % 255]
+
+
+def _pow(a: int, power: int) -> int:
+    return EXP[(LOG[a] * power) % 255]
+
+
+# polynomials are coefficient lists, highest power first unless noted
+
+def _poly_scale(p: list[int], x: int) -> list[int]:
+    return [_mul(c, x) for c in p]
+
+
+def _poly_add(p: list[int], q: list[int]) -> list[int]:
+    result = [0] * max(len(p), len(q))
+    result[len(result) - len(p):] = p
+    for i, c in enumerate(q):
+        result[i + len(result) - len(q)] ^= c
+    return result
+
+
+def _poly_mul(p: list[int], q: list[int]) -> list[int]:
+    result = [0] * (len(p) + len(q) - 1)
+    for j, b in enumerate(q):
+        for i, a in enumerate(p):
+            result[i + j] ^= _mul(a, b)
+    return result
+
+
+def _poly_eval(p: list[int], x: int) -> int:
+    y = p[0]
+    for c in p[1:]:
+        y = _mul(y, x) ^ c
+    return y
+
+
+def _generator(nsym: int) -> list[int]:
+    g = [1]
+    for i in range(nsym):
+        g = _poly_mul(g, [1, _pow(2, i)])
+    return g
+
+
+def encode(message: bytes, nsym: int) -> bytes:
+    if len(message) + nsym > 255:
+        raise ValueError("a codeword holds at most 255 bytes")
+    generator = _generator(nsym)
+    remainder = list(message) + [0] * nsym
+    for i in range(len(message)):
+        coef = remainder[i]
+        if coef:
+            for j in range(1, len(generator)):
+                remainder[i + j] ^= _mul(generator[j], coef)
+    return bytes(message) + bytes(remainder[len(message):])
+
+
+def _syndromes(codeword: list[int], nsym: int) -> list[int]:
+    return [_poly_eval(codeword, _pow(2, i)) for i in range(nsym)]
+
+
+def _error_locator(syndromes: list[int], nsym: int) -> list[int]:
+    """Berlekamp-Massey; coefficients from the highest power down."""
+    locator, previous = [1], [1]
+    for i in range(nsym):
+        previous = previous + [0]
+        delta = syndromes[i]
+        for j in range(1, min(len(locator), i + 1)):
+            delta ^= _mul(locator[-(j + 1)], syndromes[i - j])
+        if delta:
+            if len(previous) > len(locator):
+                scaled = _poly_scale(previous, delta)
+                previous = _poly_scale(locator, _div(1, delta))
+                locator = scaled
+            locator = _poly_add(locator, _poly_scale(previous, delta))
+    while len(locator) > 1 and locator[0] == 0:
+        locator = locator[1:]
+    if (len(locator) - 1) * 2 > nsym:
+        raise ReedSolomonError("too many errors to correct")
+    return locator
+
+
+def _error_positions(locator: list[int], length: int) -> list[int]:
+    """Chien search: the positions, counted from the start of the codeword, where the locator has a root."""
+    errors = len(locator) - 1
+    # the reversed locator has the roots X = 2^power instead of their inverses
+    reversed_locator = locator[::-1]
+    positions = [length - 1 - i for i in range(length) if _poly_eval(reversed_locator, _pow(2, i)) == 0]
+    if len(positions) != errors:
+        raise ReedSolomonError("could not locate the errors")
+    return positions
+
+
+def _correct(codeword: list[int], syndromes: list[int], positions: list[int]) -> list[int]:
+    """Forney: corrects the bytes at `positions` by their error magnitudes."""
+    roots = [_pow(2, len(codeword) - 1 - p) for p in positions]
+    # the locator and the evaluator S(x)L(x) mod x^nsym, lowest power first
+    locator = [1]
+    for root in roots:
+        locator = _poly_mul(locator, [1, root])
+    evaluator = _poly_mul(syndromes, locator)[:len(syndromes)]
+
+    corrected = list(codeword)
+    for i, root in enumerate(roots):
+        inverse = _div(1, root)
+        denominator = 1
+        for j, other in enumerate(roots):
+            if j != i:
+                denominator = _mul(denominator, 1 ^ _mul(other, inverse))
+        if denominator == 0:
+            raise ReedSolomonError("could not correct the errors")
+        corrected[positions[i]] ^= _div(_poly_eval(evaluator[::-1], inverse), denominator)
+    return corrected
+
+
+def decode(codeword: bytes, nsym: int) -> bytes:
+    """The message of `codeword`, corrected; raises ReedSolomonError when it cannot be."""
+    codeword = list(codeword)
+    syndromes = _syndromes(codeword, nsym)
+    if not any(syndromes):
+        return bytes(codeword[:-nsym])
+    locator = _error_locator(syndromes, nsym)
+    positions = _error_positions(locator, len(codeword))
+    corrected = _correct(codeword, syndromes, positions)
+    if any(_syndromes(corrected, nsym)):
+        raise ReedSolomonError("could not correct the errors")
+    return bytes(corrected[:-nsym])
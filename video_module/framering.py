@@ -0,0 +1,150 @@
+"""
+Decoded frames handed to worker processes without pickling them.
+
+A FrameRing is one block of shared memory holding `slots` frames of one
+shape. The process that decodes copies each frame into a free slot and
+passes only the ring's RingSpec and the slot number to the workers, which
+map the same memory and read the frame as a numpy view. Slots are reference
+counted in the owning process: the decoder holds a slot while it uses the
+frame itself, every task reading it holds it until its future is done, and
+the slot is reused once nobody holds it.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# rings a worker process keeps mapped; each request has its own
+ATTACHED_RINGS = 4
+# where SharedMemory blocks live, a tmpfs of 64 MB in a default Docker container
+SHM_DIR = "/dev/shm"
+# share of the free shared memory one ring may take, so concurrent requests still find room
+SHM_SHARE = 0.25
+
+
+@dataclass(frozen=True)
+class RingSpec:
+    """What a worker needs to map a ring; cheap to pickle."""
+    name: str
+    slots: int
+    shape: tuple
+    dtype: str
+
+
+def fitting_slots(shape: tuple, slots: int, max_bytes: int, dtype=np.uint8) -> int:
+    """How many of `slots` frames of `shape` fit in `max_bytes` and in SHM_SHARE of the free shared memory."""
+    frame_bytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    budget = max_bytes
+    try:
+        stat = os.statvfs(SHM_DIR)
+        budget = min(budget, int(stat.f_bavail * stat.f_frsize * SHM_SHARE))
+    except OSError:
+        pass
+    return max(min(slots, budget // frame_bytes), 0)
+
+
+class FrameRing:
+    """
+    Raises OSError when the shared memory cannot be had. Its pages are
+    reserved up front where the platform allows, since running out of a
+    tmpfs while writing a frame is a SIGBUS instead of an error.
+    """
+
+    def __init__(self, shape: tuple, slots: int, dtype=np.uint8):
+        dtype = np.dtype(dtype)
+        size = max(slots * int(np.prod(shape)) * dtype.itemsize, 1)
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            _reserve(self.memory, size)
+        except OSError:
+            self.memory.close()
+            self.memory.unlink()
+            raise
+        self.spec = RingSpec(self.memory.name, slots, tuple(shape), dtype.str)
+        self.frames = np.ndarray((slots, *shape), dtype, buffer=self.memory.buf)
+        self._refs = [0] * slots
+        self._free = deque(range(slots))
+        self._changed = threading.Condition()
+
+    def acquire(self) -> int:
+        """A free slot, held once by the caller; waits for one to be released when all are in use."""
+        with self._changed:
+            while not self._free:
+                self._changed.wait()
+            slot = self._free.popleft()
+            self._refs[slot] = 1
+            return slot
+
+    def put(self, frame: np.ndarray) -> int:
+        """Copies `frame` into a free slot and returns the slot, held once."""
+        slot = self.acquire()
+        self.frames[slot] = frame
+        return slot
+
+    def retain(self, slot: int):
+        with self._changed:
+            self._refs[slot] += 1
+
+    def release(self, slot: int):
+        with self._changed:
+            self._refs[slot] -= 1
+            if self._refs[slot] == 0:
+                self._free.append(slot)
+                self._changed.notify()
+
+    def hold_until_done(self, slot: int, future: Future):
+        """Keeps `slot` until `future`, a task reading it, is done or cancelled."""
+        self.retain(slot)
+        future.add_done_callback(lambda _: self.release(slot))
+
+    def close(self):
+        """Frees the shared memory; workers still reading keep their mapping until they are done."""
+        del self.frames
+        try:
+            self.memory.close()
+        except BufferError:
+            # a view of a frame is still alive; the mapping goes with it, the name is removed below
+            logger.debug("frame ring %s closed with views still alive", self.memory.name)
+        self.memory.unlink()
+
+
+def _reserve(memory: shared_memory.SharedMemory, size: int):
+    fd = getattr(memory, "_fd", -1)
+    if fd >= 0 and hasattr(os, "posix_fallocate"):
+        os.posix_fallocate(fd, 0, size)
+
+
+_attached: "OrderedDict[str, shared_memory.SharedMemory]" = OrderedDict()
+
+
+def view(spec: RingSpec, slot: int) -> np.ndarray:
+    """A read-only view of a slot of a ring created in another process."""
+    memory = _attached.get(spec.name)
+    if memory is None:
+        memory = shared_memory.SharedMemory(name=spec.name)
+        _attached[spec.name] = memory
+        _evict()
+    else:
+        _attached.move_to_end(spec.name)
+    frame = np.ndarray((spec.slots, *spec.shape), np.dtype(spec.dtype), buffer=memory.buf)[slot]
+    frame.flags.writeable = False
+    return frame
+
+
+def _evict():
+    while len(_attached) > ATTACHED_RINGS:
+        name, memory = next(iter(_attached.items()))
+        try:
+            memory.close()
+        except BufferError:
+            # a view of it is still alive; it is closed with the process
+            pass
+        del _attached[name]
+
@@ -1,10 +1,15 @@
 import ffmpeg
 import io
+import logging
 import tempfile
 import os
 from fastapi import UploadFile
 from starlette.datastructures import UploadFile as StarletteUploadFile, Headers
 
+import metrics
+
+logger = logging.getLogger(__name__)
+
 async def get_metadata(upload_file: UploadFile):
     """Extract metadata from an uploaded video file using a temporary file."""
     
@@ -15,11 +20,12 @@ async def get_metadata(upload_file: UploadFile):
         temp_file_path = temp_file.name
 
     try:
-        probe = ffmpeg.probe(temp_file_path)
+        with metrics.span("ffmpeg_probe"):
+            probe = ffmpeg.probe(temp_file_path)
         metadata = probe.get("format", {}).get("tags", {})
         format_name = probe.get("format", {}).get("format_name", "mp4")  # Default to mp4 if unknown
     except ffmpeg.Error as e:
-        print(f"FFmpeg probe error: {e}")
+        logger.warning("ffmpeg probe failed: %s", e)
         metadata, format_name = {}, "mp4"
     finally:
         os.remove(temp_file_path)  # Delete temp file immediately
@@ -34,14 +40,14 @@ async def append_metadata(upload_file: UploadFile, new_metadata) -> UploadFile:
     
     # Get existing metadata
     existing_metadata, format_name = await get_metadata(upload_file)
-    print(f"Existing Metadata: {existing_metadata}, Format: {format_name}")
+    logger.debug("existing metadata %s, format %s", existing_metadata, format_name)
     
     # Merge metadata
     merged_metadata = {
         k: str(v) for k, v in {**existing_metadata, **new_metadata}.items()
         if v and isinstance(v, (str, int, float)) and k.lower() != "encoder"
     }
-    print("Merged Metadata:", merged_metadata)
+    logger.debug("merged metadata %s", merged_metadata)
     
     # Use first format if multiple are detected
     primary_format = format_name.split(",")[0].strip()
@@ -75,7 +81,8 @@ async def append_metadata(upload_file: UploadFile, new_metadata) -> UploadFile:
                 acodec='copy',
                 **{f'metadata:g:{k}': f'{k}={v}' for k, v in merged_metadata.items()}
             )
-            ffmpeg.run(output_stream, overwrite_output=True)
+            with metrics.span("ffmpeg_remux"):
+                ffmpeg.run(output_stream, overwrite_output=True)
             
             # Read the output file
             with open(temp_out_path, 'rb') as f:
@@ -92,7 +99,7 @@ async def append_metadata(upload_file: UploadFile, new_metadata) -> UploadFile:
             return output_upload
             
         except ffmpeg.Error as e:
-            print(f"FFmpeg error: {e.stderr.decode() if hasattr(e, 'stderr') else str(e)}")
+            logger.warning("ffmpeg failed: %s", e.stderr.decode() if e.stderr else e)
             # If FFmpeg fails, return the original file
             return upload_file
     finally:
@@ -0,0 +1,110 @@
+"""
+Poster, thumbnail and preview clip of a post, made from frames the ingest
+already decodes to watermark the media, so feeds can show small variants
+without fetching or decoding the original again.
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .decode import VideoInfo
+
+# longest side of each variant, in pixels
+POSTER_SIDE = 720
+THUMBNAIL_SIDE = 240
+CLIP_SIDE = 360
+# the poster is the frame this far into the video, or its last one
+POSTER_SECONDS = 1.0
+CLIP_SECONDS = 3.0
+JPEG_QUALITY = 85
+
+POSTER_FILE = "poster.jpg"
+THUMBNAIL_FILE = "thumbnail.jpg"
+CLIP_FILE = "preview.mp4"
+
+
+@dataclass
+class Previews:
+    # JPEG
+    poster: Optional[bytes] = None
+    thumbnail: Optional[bytes] = None
+    # mp4, videos only
+    clip: Optional[bytes] = None
+
+
+def fit(width: int, height: int, side: int) -> tuple[int, int]:
+    """(width, height) scaled down to at most `side` on the longest side, even for the video encoders."""
+    scale = min(side / max(width, height), 1.0)
+    return max(int(width * scale) // 2 * 2, 2), max(int(height * scale) // 2 * 2, 2)
+
+
+def jpeg(frame: np.ndarray, side: int) -> bytes:
+    """A BGR frame scaled down to `side` and encoded as JPEG."""
+    size = fit(frame.shape[1], frame.shape[0], side)
+    if size != (frame.shape[1], frame.shape[0]):
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise ValueError("could not encode the preview")
+    return data.tobytes()
+
+
+def still(frame: np.ndarray) -> Previews:
+    """Poster and thumbnail of an image, from its BGR pixels."""
+    return Previews(poster=jpeg(frame, POSTER_SIDE), thumbnail=jpeg(frame, THUMBNAIL_SIDE))
+
+
+class PreviewWriter:
+    """
+    Fed the BGR frames of a video in order from its first, writes the
+    poster, thumbnail and clip into `directory`; `read` collects them.
+    Frames past the clip and the poster cost one comparison.
+    """
+
+    def __init__(self, directory: str, info: VideoInfo):
+        self.directory = directory
+        fps = info.fps or 30
+        self.poster_frame = round(POSTER_SECONDS * fps)
+        if info.frames:
+            self.poster_frame = min(self.poster_frame, info.frames - 1)
+        self.clip_frames = round(CLIP_SECONDS * fps)
+        self.size = fit(info.width, info.height, CLIP_SIDE)
+        self.clip = cv2.VideoWriter(
+            os.path.join(directory, CLIP_FILE), cv2.VideoWriter_fourcc(*'mp4v'), int(round(fps)) or 30, self.size
+        )
+        self._last: Optional[np.ndarray] = None
+        self._poster_written = False
+
+    def add(self, index: int, frame: np.ndarray):
+        if index < self.clip_frames:
+            self.clip.write(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA))
+        if not self._poster_written:
+            self._last = frame
+            if index >= self.poster_frame:
+                self._write_poster()
+
+    def close(self):
+        self.clip.release()
+        # videos shorter than POSTER_SECONDS without a frame count
+        if not self._poster_written and self._last is not None:
+            self._write_poster()
+
+    def _write_poster(self):
+        for name, side in ((POSTER_FILE, POSTER_SIDE), (THUMBNAIL_FILE, THUMBNAIL_SIDE)):
+            with open(os.path.join(self.directory, name), "wb") as f:
+                f.write(jpeg(self._last, side))
+        self._poster_written = True
+        self._last = None
+
+    @staticmethod
+    def read(directory: str) -> Previews:
+        previews = Previews()
+        for field, name in (("poster", POSTER_FILE), ("thumbnail", THUMBNAIL_FILE), ("clip", CLIP_FILE)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.path.getsize(path):
+                with open(path, "rb") as f:
+                    setattr(previews, field, f.read())
+        return previews
@@ -0,0 +1,87 @@
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    stage: str
+    done: int
+    # None when the frame count is unknown up front
+    total: Optional[int]
+    elapsed: float
+    finished: bool = False
+
+    @property
+    def fraction(self) -> Optional[float]:
+        if not self.total:
+            return None
+        return min(self.done / self.total, 1.0)
+
+
+ProgressCallback = Callable[[ProgressEvent], None]
+
+
+def track(stage: str, frames: Iterable, total: Optional[int], on_progress: Optional[ProgressCallback], interval: float = 0.5):
+    """
+    Passes `frames` through and reports how many were consumed to
+    `on_progress`, at most once per `interval` seconds plus a final event.
+
+    Without a callback the iterable is returned as is, so the frame loop
+    pays nothing for progress reporting.
+    """
+    if on_progress is None:
+        return frames
+    return _tracked(stage, frames, total, on_progress, interval)
+
+
+def _tracked(stage, frames, total, on_progress, interval):
+    start = time.perf_counter()
+    next_report = start + interval
+    done = 0
+    try:
+        for frame in frames:
+            yield frame
+            done += 1
+            now = time.perf_counter()
+            if now >= next_report:
+                next_report = now + interval
+                emit(on_progress, ProgressEvent(stage, done, total, now - start))
+    finally:
+        emit(on_progress, ProgressEvent(stage, done, total, time.perf_counter() - start, finished=True))
+
+
+def emit(on_progress, event):
+    # a broken progress consumer must never fail the media job
+    try:
+        on_progress(event)
+    except Exception:
+        logger.exception("progress callback failed for %s", event.stage)
+
+
+_jobs = itertools.count(1)
+
+
+def metrics_progress() -> Optional[ProgressCallback]:
+    """
+    A callback for one media job that shows its progress as
+    deepmark_media_progress_ratio{stage, job} until the stage finishes.
+    None when metrics are off, so the frame loops are left as they are.
+    """
+    if not metrics.enabled:
+        return None
+    job = str(next(_jobs))
+
+    def report(event: ProgressEvent):
+        if event.finished:
+            metrics.media_progress.remove(event.stage, job)
+        elif event.fraction is not None:
+            metrics.media_progress.set(event.fraction, event.stage, job)
+
+    return report
@@ -0,0 +1,156 @@
+"""
+Splits long videos at keyframes and runs a per-segment function on every
+core. Each segment starts on a keyframe, so a worker can seek straight to it
+and decode only its own frames.
+
+Workers are spawned processes shared by every request of the node, so
+concurrent uploads queue for cores instead of oversubscribing them.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import os
+import time
+from typing import Callable, Optional
+from pydantic_settings import BaseSettings
+
+import metrics
+from .decode import DecodeError, Segment, VideoInfo, keyframes
+from .progress import ProgressCallback, ProgressEvent, emit
+
+logger = logging.getLogger(__name__)
+
+
+# kept out of models/security.py so the media modules import without the server settings
+class Settings(BaseSettings):
+    # 0 uses every core
+    media_workers : int = 0
+    # shorter videos, or shorter pieces, are not worth a process round trip
+    media_min_segment_seconds : float = 4.0
+    # upper bound of the shared memory one face analysis decodes frames ahead into
+    media_frame_ring_mb : int = 16
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+
+settings = Settings()
+workers = settings.media_workers or os.cpu_count() or 1
+
+_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+
+def pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+WHOLE = Segment(0, 0, 0.0)
+
+
+def plan(path: str, info: VideoInfo, count: int = 0) -> list[Segment]:
+    """
+    Up to `count` (default: one per worker) keyframe-aligned segments of
+    roughly equal length. Short or single-GOP videos are one segment.
+    """
+    count = count or workers
+    min_frames = int(settings.media_min_segment_seconds * (info.fps or 30))
+    if count < 2 or not info.frames or info.frames < 2 * min_frames:
+        return [WHOLE]
+    try:
+        keys = keyframes(path)
+    except DecodeError:
+        logger.warning("could not list keyframes of %s, processing it in one piece", path, exc_info=True)
+        return [WHOLE]
+    if not keys or keys[0][0] != 0:
+        return [WHOLE]
+
+    count = min(count, info.frames // min_frames)
+    target = info.frames / count
+    starts = [keys[0]]
+    for index, pts in keys[1:]:
+        # close a segment at the first keyframe past its share of the frames
+        if index >= target * len(starts) and info.frames - index >= min_frames // 2:
+            starts.append((index, pts))
+        if len(starts) == count:
+            break
+
+    half_frame = 0.5 / (info.fps or 30)
+    segments = []
+    for i, (index, pts) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else info.frames
+        # keyframe times are packet timestamps, an input -ss counts from the container's start_time
+        segments.append(Segment(index, end - index, pts - info.start_time + half_frame if index else 0.0))
+    return segments
+
+
+def sampled(segment: Segment, every: int) -> int:
+    """How many of the segment's frames fall on every `every`-th frame of the video."""
+    end = segment.start_frame + segment.frames
+    return -(-end // every) - -(-segment.start_frame // every)
+
+
+async def run(
+    fn: Callable, path: str, segments: list[Segment], *args,
+    stage: str, every: int = 1, total: Optional[int] = None, on_progress: Optional[ProgressCallback] = None,
+) -> list:
+    """
+    Runs fn(path, segment, *args) for every segment, in the worker pool when
+    there is more than one, and returns the results in segment order.
+
+    A single segment runs on a thread of this process and gets `on_progress`
+    passed through as a keyword, so it reports frame by frame. Pooled
+    segments report once each as they complete, in frames sampled with
+    `every`, and are counted in this process' metrics since the workers'
+    registries are never scraped.
+    """
+    if len(segments) == 1:
+        return [await asyncio.to_thread(functools.partial(fn, on_progress=on_progress), path, segments[0], *args)]
+
+    loop = asyncio.get_running_loop()
+    futures = [loop.run_in_executor(pool(), fn, path, segment, *args) for segment in segments]
+    if on_progress is not None:
+        _report(futures, segments, stage, every, total, on_progress)
+    try:
+        results = await asyncio.gather(*futures)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    if metrics.enabled:
+        metrics.frames_processed.inc(sum(sampled(segment, every) for segment in segments), stage)
+    return results
+
+
+def _report(futures, segments, stage, every, total, on_progress):
+    start = time.perf_counter()
+    done = {"frames": 0, "segments": 0, "closed": False}
+
+    def completed(future, segment):
+        if done["closed"]:
+            return
+        if future.cancelled() or future.exception():
+            # the run fails; the stage is finished once, and segments still completing report nothing
+            done["closed"] = True
+            emit(on_progress, ProgressEvent(stage, done["frames"], total, time.perf_counter() - start, finished=True))
+            return
+        done["frames"] += sampled(segment, every)
+        done["segments"] += 1
+        emit(on_progress, ProgressEvent(
+            stage, done["frames"], total, time.perf_counter() - start, finished=done["segments"] == len(segments)
+        ))
+
+    for future, segment in zip(futures, segments):
+        future.add_done_callback(functools.partial(completed, segment=segment))
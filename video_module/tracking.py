@@ -0,0 +1,185 @@
+"""
+Detect-then-track for the face analysis.
+
+The HOG detector runs on every REDETECT_EVERY-th analyzed frame only. In
+between, each face box is carried forward by pyramidal Lucas-Kanade optical
+flow of feature points inside it, checked forward and backward. When too
+few points survive a step the faces are detected again on that frame, and
+detections continue the tracks they overlap.
+"""
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+
+# analyzed frames between two detections while every face tracks well
+REDETECT_EVERY = 6
+# share of a face's points that must survive a step to keep tracking it
+MIN_CONFIDENCE = 0.5
+MIN_POINTS = 4
+# pixels a point may land away from its start when tracked forward and back
+MAX_FB_ERROR = 1.5
+# overlap above which a detection continues a track
+MATCH_IOU = 0.3
+
+LK_PARAMS = dict(
+    winSize=(21, 21), maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+)
+
+
+@dataclass
+class Track:
+    id: int
+    start: int
+    # (top, right, bottom, left) in frame pixels, as floats while tracking
+    box: np.ndarray
+    points: Optional[np.ndarray] = None
+    end: int = 0
+    # box on every analyzed frame the track was alive
+    boxes: list = field(default_factory=list)
+    # landmarks and encodings of the detections that fed the track
+    landmarks: list = field(default_factory=list)
+    encodings: list = field(default_factory=list)
+
+
+class FaceTracker:
+    """
+    Feed `update` every analyzed RGB frame in order, collecting ended tracks
+    with `pop_finished`, and `close` after the last frame.
+    `detect` returns face boxes, `landmarks` and `encode` take the frame and
+    the boxes, like their face_recognition counterparts. `prefetched`, given
+    a frame index, may return the (boxes, landmarks, encodings) of that frame
+    computed elsewhere, or None to have them computed here.
+    """
+
+    def __init__(
+        self, detect: Callable, landmarks: Callable, encode: Optional[Callable] = None,
+        redetect_every: int = REDETECT_EVERY, prefetched: Optional[Callable] = None,
+    ):
+        self.detect = detect
+        self.landmarks = landmarks
+        self.encode = encode
+        self.redetect_every = redetect_every
+        self.prefetched = prefetched
+        self.active: list[Track] = []
+        self.finished: list[Track] = []
+        self.detections = 0
+        self._previous: Optional[np.ndarray] = None
+        self._since_detection = 0
+        self._next_id = 0
+
+    def pop_finished(self) -> list[Track]:
+        """The tracks that ended since the last call."""
+        finished, self.finished = self.finished, []
+        return finished
+
+    def close(self) -> list[Track]:
+        """Ends the tracks still alive after the last frame and returns every track not popped yet."""
+        self.finished.extend(self.active)
+        self.active = []
+        return self.pop_finished()
+
+    @property
+    def next_detection(self) -> int:
+        """Updates until the next scheduled detection, the detecting one included, while every face tracks well."""
+        if self._previous is None:
+            return 1
+        return max(self.redetect_every - self._since_detection, 0) + 1
+
+    def update(self, index: int, rgb: np.ndarray):
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        due = self._previous is None or self._since_detection >= self.redetect_every
+        if due or not self._follow(gray):
+            self._detect(index, rgb, gray)
+        else:
+            self._since_detection += 1
+        for track in self.active:
+            track.end = index
+            track.boxes.append(track.box.copy())
+        self._previous = gray
+
+    def _follow(self, gray: np.ndarray) -> bool:
+        """Moves every active box along the flow; False once any of them loses track."""
+        for track in self.active:
+            if track.points is None or len(track.points) < MIN_POINTS:
+                return False
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(self._previous, gray, track.points, None, **LK_PARAMS)
+            back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._previous, moved, None, **LK_PARAMS)
+            error = np.linalg.norm((track.points - back).reshape(-1, 2), axis=1)
+            good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < MAX_FB_ERROR)
+            if good.sum() < MIN_POINTS or good.mean() < MIN_CONFIDENCE:
+                return False
+
+            before, after = track.points[good].reshape(-1, 2), moved[good].reshape(-1, 2)
+            dx, dy = np.median(after - before, axis=0)
+            spread_before = np.linalg.norm(before - before.mean(axis=0), axis=1).mean()
+            spread_after = np.linalg.norm(after - after.mean(axis=0), axis=1).mean()
+            scale = spread_after / spread_before if spread_before > 0 else 1.0
+
+            top, right, bottom, left = track.box
+            cy, cx = (top + bottom) / 2 + dy, (left + right) / 2 + dx
+            half_h, half_w = (bottom - top) / 2 * scale, (right - left) / 2 * scale
+            track.box = np.array([cy - half_h, cx + half_w, cy + half_h, cx - half_w])
+            track.points = moved[good].reshape(-1, 1, 2)
+        return True
+
+    def _detect(self, index: int, rgb: np.ndarray, gray: np.ndarray):
+        self.detections += 1
+        self._since_detection = 0
+        locations, landmarks, encodings = self.faces(index, rgb)
+
+        unmatched = list(self.active)
+        tracks = []
+        for location in locations:
+            box = np.array(location, dtype=float)
+            best = max(unmatched, key=lambda track: _iou(track.box, box), default=None)
+            if best is not None and _iou(best.box, box) >= MATCH_IOU:
+                unmatched.remove(best)
+                best.box = box
+                tracks.append(best)
+            else:
+                tracks.append(Track(self._next_id, index, box))
+                self._next_id += 1
+        # faces that were not found again have left the picture
+        self.finished.extend(unmatched)
+        self.active = tracks
+
+        for track, face_landmarks in zip(tracks, landmarks):
+            track.landmarks.append(face_landmarks)
+        for track, encoding in zip(tracks, encodings or []):
+            track.encodings.append(encoding)
+        for track in tracks:
+            track.points = _features(gray, track.box)
+
+    def faces(self, index: int, rgb: np.ndarray) -> tuple[list, list, Optional[list]]:
+        """Boxes, landmarks and encodings (None without `encode`) of the faces on a frame."""
+        found = self.prefetched(index) if self.prefetched is not None else None
+        if found is not None:
+            return found
+        return detect_faces(rgb, self.detect, self.landmarks, self.encode)
+
+
+def detect_faces(
+    rgb: np.ndarray, detect: Callable, landmarks: Callable, encode: Optional[Callable] = None
+) -> tuple[list, list, Optional[list]]:
+    locations = detect(rgb)
+    if not locations:
+        return locations, [], None
+    return locations, landmarks(rgb, locations), encode(rgb, locations) if encode is not None else None
+
+
+def _features(gray: np.ndarray, box: np.ndarray) -> Optional[np.ndarray]:
+    top, right, bottom, left = np.round(box).astype(int)
+    mask = np.zeros_like(gray)
+    mask[max(top, 0):max(bottom, 0), max(left, 0):max(right, 0)] = 255
+    return cv2.goodFeaturesToTrack(gray, maxCorners=40, qualityLevel=0.01, minDistance=3, mask=mask)
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> float:
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(bottom - top, 0) * max(right - left, 0)
+    area = (a[2] - a[0]) * (a[1] - a[3]) + (b[2] - b[0]) * (b[1] - b[3]) - inter
+    return inter / area if area > 0 else 0.0
@@ -1,58 +1,108 @@
+import asyncio
 import cv2
+import functools
 import numpy as np
 import pywt
 import os
 import tempfile
+import zlib
 from collections import Counter
 from fastapi import UploadFile
 from io import BytesIO
-from tqdm import tqdm
+from typing import Optional
+from pydantic_settings import BaseSettings
 from starlette.datastructures import UploadFile as StarletteUploadFile
 
-async def embed_watermark(video_file: UploadFile, watermark_text: str) -> UploadFile:
+import metrics
+from . import decode, ecc, preview, progress, segments
+from .progress import ProgressCallback
+
+
+# kept out of models/security.py so the media modules import without the server settings
+class Settings(BaseSettings):
+    # also vote for version 1 marks over the whole video when the first SCAN_FRAMES carry none;
+    # off by default, since every unmarked upload would then be decoded to its end
+    watermark_legacy_full_scan : bool = False
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+
+settings = Settings()
+
+# Version 2 marks. One bit per pair of side by side 8x8 luma cells (2x2 blocks
+# of LL2 coefficients): the left one is brighter for a 1, the right one for a
+# 0, by at least MARGIN. Encoders shift and scale luma a little, which a
+# difference does not notice. A tile of pairs holds a 16 bit sync word and a
+# Reed-Solomon codeword of the version byte, the payload and its CRC32, and is
+# repeated over the whole frame; a reader averages the soft bits of every
+# tile it sees, so one frame decodes alone.
+WATERMARK_VERSION = 2
+SYNC = np.unpackbits(np.frombuffer(b"\xb5\x3c", np.uint8))
+# sync bits allowed to differ in a frame that carries a mark
+SYNC_TOLERANCE = 3
+PAYLOAD_BYTES = 16
+PARITY_BYTES = 14
+CELL = 8
+# bits per tile (rows, cols): 16 + (1 + 16 + 4 + 14) * 8 = 296, the last 4 stay 0
+TILE = (15, 20)
+TILE_BITS = len(SYNC) + (1 + PAYLOAD_BYTES + 4 + PARITY_BYTES) * 8
+# bit i of a tile sits at (i * 131) % 300, so a damaged area hits bits of many bytes
+INTERLEAVE = (np.arange(TILE[0] * TILE[1]) * 131) % (TILE[0] * TILE[1])
+# difference of mean luma a pair is brought to
+MARGIN = 6.0
+# every frame carries a version 2 mark, every LEGACY_EVERY-th one carried a version 1 mark
+LEGACY_EVERY = 15
+# consecutive frames read from the start at most: two version 1 marks whatever the cut
+SCAN_FRAMES = 2 * LEGACY_EVERY + 1
+# top-left pixels (width, height) read when looking for a mark, 4x4 tiles
+MARK_CROP = (4 * TILE[1] * 2 * CELL, 4 * TILE[0] * CELL)
+# smallest luma plane (width, height) holding a whole tile; smaller media is not marked
+MIN_MARK_SIZE = (TILE[1] * 2 * CELL, TILE[0] * CELL)
+
+
+@metrics.timed("watermark_embed")
+async def embed_watermark(
+    video_file: UploadFile, watermark_text: str, on_progress: Optional[ProgressCallback] = None
+) -> UploadFile:
     """
     Embeds a watermark in the given UploadFile video and returns a new UploadFile.
+    Long videos are split at keyframes and their segments marked on separate cores.
+    `on_progress` receives throttled progress events.
     """
-    video_bytes = BytesIO(await video_file.read())
+    output_upload, _ = await _embed(video_file, watermark_text, on_progress, with_previews=False)
+    return output_upload
+
+
+@metrics.timed("watermark_embed")
+async def embed_watermark_with_previews(
+    video_file: UploadFile, watermark_text: str, on_progress: Optional[ProgressCallback] = None
+) -> tuple[UploadFile, preview.Previews]:
+    """Like embed_watermark, and also makes the poster, thumbnail and clip from the marked frames."""
+    return await _embed(video_file, watermark_text, on_progress, with_previews=True)
+
+
+async def _embed(
+    video_file: UploadFile, watermark_text: str, on_progress: Optional[ProgressCallback], with_previews: bool
+) -> tuple[UploadFile, Optional[preview.Previews]]:
     video_format = os.path.splitext(video_file.filename)[1]
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix=video_format) as temp_input:
-        temp_input.write(video_bytes.getvalue())
-        temp_input_path = temp_input.name
-    
-    cap = cv2.VideoCapture(temp_input_path)
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix=video_format) as temp_output:
-        temp_output_path = temp_output.name
-    
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(temp_output_path, fourcc, fps, (frame_width, frame_height))
-    
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    with tqdm(total=frame_count, desc="🎬 Watermarking video", unit=" frames") as pbar:
-        frame_idx = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_idx % 15 == 0:
-                frame = await embed_frame_watermark(frame, watermark_text)
-            
-            out.write(frame)
-            pbar.update(1)
-            frame_idx += 1
-    
-    cap.release()
-    out.release()
-    os.remove(temp_input_path)
-    
-    with open(temp_output_path, "rb") as f:
-        output_bytes = BytesIO(f.read())
-    os.remove(temp_output_path)
+    previews = None
+    with tempfile.TemporaryDirectory() as workdir:
+        previews_dir = workdir if with_previews else None
+        with decode.media_path(video_file) as path:
+            info = await asyncio.to_thread(decode.probe, path)
+            plan = await asyncio.to_thread(segments.plan, path, info)
+            outputs = await segments.run(
+                _embed_segment, path, plan, info, watermark_text, os.path.join(workdir, f"%d{video_format}"),
+                previews_dir, stage="watermark_embed", total=info.frames, on_progress=on_progress,
+            )
+        output_path = outputs[0] if len(outputs) == 1 else await asyncio.to_thread(decode.concat, outputs, workdir)
+
+        with open(output_path, "rb") as f:
+            output_bytes = BytesIO(f.read())
+        if previews_dir:
+            previews = await asyncio.to_thread(preview.PreviewWriter.read, previews_dir)
    
     video_file.file.seek(0)
     output_upload = StarletteUploadFile(
@@ -60,95 +110,233 @@ async def embed_watermark(video_file: UploadFile, watermark_text: str) -> Upload
                 filename=f"output{video_format}",
     )
 
-    return output_upload
+    return output_upload, previews
+
+
+def _embed_segment(
+    path: str, segment: decode.Segment, info: decode.VideoInfo, watermark_text: str, output_pattern: str,
+    previews_dir: Optional[str] = None, on_progress: Optional[ProgressCallback] = None,
+) -> str:
+    """
+    Marks one segment into its own file, named after its first frame; runs in a worker process for long videos.
+    The first segment also writes the previews into `previews_dir`, clipped to its own frames.
+    """
+    output_path = output_pattern % segment.start_frame
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(output_path, fourcc, int(round(info.fps)) or 30, (info.width, info.height))
+    previews = preview.PreviewWriter(previews_dir, info) if previews_dir and segment.start_frame == 0 else None
+
+    frames = decode.frames(path, info.width, info.height, "bgr24", [], segment=segment)
+    frames = progress.track("watermark_embed", metrics.decode("watermark_embed", frames), info.frames, on_progress)
+    try:
+        for frame_idx, frame in frames:
+            frame = _embed_frame(frame, watermark_text)
+            out.write(frame)
+            if previews is not None:
+                previews.add(frame_idx, frame)
+    finally:
+        out.release()
+        if previews is not None:
+            previews.close()
+    return output_path
+
 
 async def embed_frame_watermark(frame, watermark_text):
-    yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)
-    y_channel = yuv[:,:,0].astype(float)
-    
-    coeffs = pywt.dwt2(y_channel, 'haar')
-    LL1, (LH1, HL1, HH1) = coeffs
-    coeffs2 = pywt.dwt2(LL1, 'haar')
-    LL2, (LH2, HL2, HH2) = coeffs2
-    
-    watermark_bits = ''.join(format(ord(c), '08b') for c in watermark_text if ord(c) <= 255)
-    
-    rows, cols = LL2.shape
-    required_pixels = len(watermark_bits)
-    if rows * cols < required_pixels:
-        return frame
-    
-    alpha = 1.0
-    for i, bit in enumerate(watermark_bits):
-        row, col = 4 + (i // 32), 4 + (i % 32)
-        if row < LL2.shape[0] and col < LL2.shape[1]:
-            original_value = LL2[row, col]
-            LL2[row, col] = original_value + alpha * abs(original_value) if bit == '1' else original_value - alpha * abs(original_value)
-    
-    LL1_modified = pywt.idwt2((LL2, (LH2, HL2, HH2)), 'haar')
-    LL1_modified = cv2.resize(LL1_modified, (LL1.shape[1], LL1.shape[0])) if LL1_modified.shape != LL1.shape else LL1_modified
-    
-    y_channel_modified = pywt.idwt2((LL1_modified, (LH1, HL1, HH1)), 'haar')
-    y_channel_modified = cv2.resize(y_channel_modified, (y_channel.shape[1], y_channel.shape[0])) if y_channel_modified.shape != y_channel.shape else y_channel_modified
-    
-    yuv[:,:,0] = np.clip(y_channel_modified, 0, 255).astype(np.uint8)
-    return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
+    return _embed_frame(frame, watermark_text)
+
+
+def _embed_frame(frame, watermark_text):
+    y_channel = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)[:,:,0].astype(np.float32)
+    # the same amount added to B, G and R moves Y by it and leaves U and V alone
+    offsets = luma_offsets(y_channel, watermark_text)
+    return cv2.add(frame, cv2.merge([offsets, offsets, offsets]), dtype=cv2.CV_8U)
+
+
+@functools.lru_cache(maxsize=64)
+def tile_bits(watermark_text: str) -> np.ndarray:
+    """The (TILE) grid of bits carrying `watermark_text`, at most PAYLOAD_BYTES of ASCII."""
+    payload = watermark_text.encode("ascii")
+    if len(payload) > PAYLOAD_BYTES:
+        raise ValueError(f"watermarks hold at most {PAYLOAD_BYTES} ASCII characters")
+    message = bytes([WATERMARK_VERSION]) + payload.ljust(PAYLOAD_BYTES, b"\0")
+    message += zlib.crc32(message).to_bytes(4, "big")
+    codeword = np.frombuffer(ecc.encode(message, PARITY_BYTES), np.uint8)
+    bits = np.zeros(TILE[0] * TILE[1], np.uint8)
+    bits[INTERLEAVE[:TILE_BITS]] = np.concatenate([SYNC, np.unpackbits(codeword)])
+    return bits.reshape(TILE)
+
 
-async def extract_watermark(video_file: UploadFile):
+def embed_luma(y_channel: np.ndarray, watermark_text: str) -> np.ndarray:
+    """Marks a luma plane (float) in place and returns it."""
+    y_channel += luma_offsets(y_channel, watermark_text)
+    return y_channel
+
+
+def luma_offsets(y_channel: np.ndarray, watermark_text: str) -> np.ndarray:
     """
-    Extracts the watermark from an UploadFile video.
+    What to add to each luma pixel to mark it. Moving a cell's mean is the
+    same as moving its 2x2 LL2 coefficients and inverting both DWT levels,
+    without the transforms. Pairs that already differ enough in the right
+    direction are left alone.
     """
-    video_bytes = BytesIO(await video_file.read())
+    offsets = np.zeros(y_channel.shape, np.float32)
+    rows, pairs = y_channel.shape[0] // CELL, y_channel.shape[1] // (2 * CELL)
+    # read_luma needs a whole tile, a partial one could never be read back
+    if not fits_tile(y_channel.shape[1], y_channel.shape[0]):
+        return offsets
+    bits = tile_bits(watermark_text)
+    signs = np.tile(bits, (-(-rows // TILE[0]), -(-pairs // TILE[1])))[:rows, :pairs] * 2.0 - 1
+    means = cell_means(y_channel, rows, 2 * pairs)
+    difference = means[:, 0::2] - means[:, 1::2]
+    shift = np.maximum(MARGIN - signs * difference, 0) / 2 * signs
+    cells = np.stack([shift, -shift], axis=2).reshape(rows, 2 * pairs).astype(np.float32)
+    offsets[:rows * CELL, :pairs * 2 * CELL] = cv2.resize(
+        cells, (pairs * 2 * CELL, rows * CELL), interpolation=cv2.INTER_NEAREST
+    )
+    return offsets
+
+
+def fits_tile(width: int, height: int) -> bool:
+    """Whether a `width` x `height` luma plane holds a whole tile, so its mark can be read back."""
+    return width >= MIN_MARK_SIZE[0] and height >= MIN_MARK_SIZE[1]
+
+
+def cell_means(y_channel: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """Mean of each CELL x CELL block of the top-left `rows` x `cols` cells."""
+    corner = np.ascontiguousarray(y_channel[:rows * CELL, :cols * CELL], dtype=np.float32)
+    return cv2.resize(corner, (cols, rows), interpolation=cv2.INTER_AREA).astype(float)
+
+
+def read_luma(y_channel: np.ndarray) -> Optional[str]:
+    """The version 2 mark of a luma plane, None unless its sync word, Reed-Solomon code and CRC all check out."""
+    if not fits_tile(y_channel.shape[1], y_channel.shape[0]):
+        return None
+    rows, pairs = y_channel.shape[0] // CELL, y_channel.shape[1] // (2 * CELL)
+    means = cell_means(y_channel, rows, 2 * pairs)
+    # about +1 for a 1, -1 for a 0; a strong edge in the picture counts no more than twice that
+    soft = np.clip((means[:, 0::2] - means[:, 1::2]) / MARGIN, -2, 2)
+    tiles_down, tiles_across = rows // TILE[0], pairs // TILE[1]
+    soft = soft[:tiles_down * TILE[0], :tiles_across * TILE[1]]
+    soft = soft.reshape(tiles_down, TILE[0], tiles_across, TILE[1]).mean(axis=(0, 2))
+
+    bits = (soft.ravel()[INTERLEAVE[:TILE_BITS]] > 0).astype(np.uint8)
+    if np.count_nonzero(bits[:len(SYNC)] != SYNC) > SYNC_TOLERANCE:
+        return None
+    try:
+        message = ecc.decode(np.packbits(bits[len(SYNC):]).tobytes(), PARITY_BYTES)
+    except ecc.ReedSolomonError:
+        return None
+    if message[0] != WATERMARK_VERSION or zlib.crc32(message[:-4]).to_bytes(4, "big") != message[-4:]:
+        return None
+    try:
+        return message[1:-4].rstrip(b"\0").decode("ascii") or None
+    except UnicodeDecodeError:
+        return None
+
+# Version 1 marks: raw ASCII bits in LL2 rows 4-19, cols 4-35, voted across frames.
+# Only read now, for media marked before version 2.
+# top-left Y pixels (width, height) holding the LL2 rows/cols that carry bits, plus the threshold window
+EXTRACT_CROP = (192, 128)
+
+
+@metrics.timed("watermark_extract")
+async def extract_watermark(video_file: UploadFile, on_progress: Optional[ProgressCallback] = None):
+    """
+    Extracts the watermark from an UploadFile video. A version 2 mark
+    decodes from its first frame, which is usually all that is read; version
+    1 marks are voted for over the first SCAN_FRAMES. With
+    WATERMARK_LEGACY_FULL_SCAN, unmarked starts are followed by a vote over
+    the whole video, one keyframe-aligned segment per core for long videos.
+    `on_progress` receives throttled progress events.
+    """
+    with decode.media_path(video_file) as path:
+        info = await asyncio.to_thread(decode.probe, path)
+        watermark = await asyncio.to_thread(_scan_start, path, info, on_progress)
+        if watermark is None and settings.watermark_legacy_full_scan:
+            plan = await asyncio.to_thread(segments.plan, path, info)
+            total = -(-info.frames // LEGACY_EVERY) if info.frames else None
+            results = await segments.run(
+                _extract_segment, path, plan, info,
+                stage="watermark_extract", every=LEGACY_EVERY, total=total, on_progress=on_progress,
+            )
+            # votes in frame order, the same list a single pass produces
+            extracted_watermarks = [watermark for marks in results for watermark in marks]
+            if len(extracted_watermarks) > 2:
+                watermark = vote(extracted_watermarks)
     video_file.file.seek(0)
-    video_format = os.path.splitext(video_file.filename)[1]
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix=video_format) as temp_input:
-        temp_input.write(video_bytes.getvalue())
-        temp_input_path = temp_input.name
-    
-    cap = cv2.VideoCapture(temp_input_path)
+    return watermark
+
+
+def vote(extracted_watermarks: list[str]) -> Optional[str]:
+    """The most common version 1 mark, if it was read at least twice."""
+    most_common = Counter(extracted_watermarks).most_common(1)
+    return most_common[0][0] if most_common and most_common[0][1] >= 2 else None
+
+
+def _scan_start(path: str, info: decode.VideoInfo, on_progress: Optional[ProgressCallback] = None) -> Optional[str]:
+    """
+    The version 2 mark of the first frame that carries one, otherwise a
+    version 1 mark read on at least two of the first SCAN_FRAMES.
+    """
+    frames = decode.corner_frames(path, info, MARK_CROP, multiple=CELL, segment=decode.Segment(0, SCAN_FRAMES, 0.0))
+    frames = progress.track("watermark_extract", metrics.decode("watermark_extract", frames), SCAN_FRAMES, on_progress)
+
+    legacy = []
+    for _, corner in frames:
+        y_channel = cv2.cvtColor(corner, cv2.COLOR_BGR2YUV)[:,:,0].astype(float)
+        watermark = read_luma(y_channel)
+        if watermark:
+            return watermark
+        watermark = extract_ll2_watermark(block_sum(y_channel[:EXTRACT_CROP[1], :EXTRACT_CROP[0]], 4) / 4)
+        if watermark and len(watermark) > 8:
+            legacy.append(watermark[:16])
+    return vote(legacy)
+
+
+def _extract_segment(
+    path: str, segment: decode.Segment, info: decode.VideoInfo, on_progress: Optional[ProgressCallback] = None
+) -> list[str]:
+    """
+    Reads version 1 marks from the corner of every LEGACY_EVERY-th frame of a segment. The corner's LL2 is
+    the 4x4 block sum / 4 of its Y plane, so neither the full frame nor the
+    two DWT levels are needed. Y is derived from BGR exactly as the full
+    frame path does it: the thresholding below flips bits on a one level
+    luma difference, which the decoder's own Y plane would introduce.
+    """
+    total = -(-info.frames // LEGACY_EVERY) if info.frames else None
+    frames = decode.corner_frames(path, info, EXTRACT_CROP, every=LEGACY_EVERY, segment=segment)
+    frames = progress.track("watermark_extract", metrics.decode("watermark_extract", frames), total, on_progress)
+
     extracted_watermarks = []
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    with tqdm(total=frame_count, desc="🔍 Extracting watermark", unit=" frames") as pbar:
-        frame_idx = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_idx % 15 == 0:
-                watermark = await extract_frame_watermark(frame)
-                if watermark and len(watermark) > 8:
-                    extracted_watermarks.append(watermark[:16])
-            
-            pbar.update(1)
-            frame_idx += 1
-    
-    cap.release()
-    os.remove(temp_input_path)
-    video_file.file.seek(0)
-    
-    # Return the most common watermark found
-    if extracted_watermarks:
-        if len(extracted_watermarks) <=2 : return None
+    for _, corner in frames:
+        y_channel = cv2.cvtColor(corner, cv2.COLOR_BGR2YUV)[:,:,0].astype(float)
+        watermark = extract_ll2_watermark(block_sum(y_channel, 4) / 4)
+        if watermark and len(watermark) > 8:
+            extracted_watermarks.append(watermark[:16])
+    return extracted_watermarks
 
-        watermark_counts = Counter(extracted_watermarks)
 
-        most_common = watermark_counts.most_common(1)
-        return most_common[0][0] if most_common and most_common[0][1] >= 2 else None
-    
-    # return set(extracted_watermarks)
+def block_sum(plane, factor):
+    rows, cols = plane.shape[0] // factor, plane.shape[1] // factor
+    return plane[:rows * factor, :cols * factor].reshape(rows, factor, cols, factor).sum(axis=(1, 3))
+
 
 async def extract_frame_watermark(frame):
     yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)
     y_channel = yuv[:,:,0].astype(float)
-    
+    watermark = read_luma(y_channel)
+    if watermark:
+        return watermark
+
     coeffs = pywt.dwt2(y_channel, 'haar')
     LL1, (LH1, HL1, HH1) = coeffs
     coeffs2 = pywt.dwt2(LL1, 'haar')
     LL2, (LH2, HL2, HH2) = coeffs2
-    
+
+    return extract_ll2_watermark(LL2)
+
+
+def extract_ll2_watermark(LL2):
     if np.std(LL2) < 0.5:
         return None
     
@@ -166,12 +354,3 @@ async def extract_frame_watermark(frame):
     watermark = ''.join(chr(int(watermark_bits[i:i+8], 2)) for i in range(0, len(watermark_bits), 8) if 32 <= int(watermark_bits[i:i+8], 2) <= 126)
     
     return watermark if watermark else None
-
-
-# if __name__ == "__main__":
-#     video_path = "./video_module/demo_analyze.MOV"
-#     test_watermark = "nandu09112003nan"
-#     print(f"Embedding watermark: {test_watermark}")
-#     embed_watermark(video_path, test_watermark)
-#     extracted = extract_watermark(video_path)
-#     print(f"Extracted watermark: {extracted}")
\ No newline at end of file